@@ -3,9 +3,11 @@
 import json
 import os
 import datetime as dt
-from typing import Any, Dict, List, Optional
+import threading
+from typing import Any, Callable, Dict, List, Optional
 from django.conf import settings
 import requests
+from .llm_client import get_client, read_chat_stream
 from .tools import (
     describe_schema,
     run_aggregation,
@@ -39,7 +41,9 @@ B) 在所有工具完成后，输出严格 JSON：{"final": {...}}。不得包
 - 用户口述"X月Y日"且未指明年份时，优先按当前年解释
 - 避免在 pipeline 中自行写时间匹配；一律通过 time_range
 - 如果查询无结果，先查询实际数据时间范围并给出合适建议
-- 高频数据（10秒采集）会自动按分钟级采样，减少数据量
+- 高频数据（10秒采集）超过50条时自动改读分钟汇总并按5分钟取均值（管道只用 $avg 聚合时），返回的 source 说明实际数据来源
+- run_aggregation 返回 ok=false 且带 hint 时，说明查询超出成本预算，按 hint.suggestions 调整后重试
+- run_aggregation 的 source 参数：auto（默认）/ raw（原始数据，需要瞬时值或精确极值时使用）/ minute / hour（逐条返回分钟/小时均值，长时间趋势优先用 hour）
 
 仅允许以下最终输出其一：
 - {"final": {"type": "chart", "option": {...}, "explain": "..."}}
@@ -160,6 +164,7 @@ TOOLS: Dict[str, Dict[str, Any]] = {
                 },
                 "time_field": {"type": "string", "default": "timestamp"},
                 "sample_interval": {"type": "integer"},
+                "source": {"type": "string", "enum": ["auto", "raw", "minute", "hour"], "default": "auto"},
             },
             "required": ["collection", "pipeline"],
         },
@@ -219,8 +224,9 @@ def call_deepseek(
     json_only: bool = True,
     trace: Optional[List[Dict[str, Any]]] = None,
     logger: Optional[ConversationLogger] = None,
+    on_delta: Optional[Callable[[str], None]] = None,
 ) -> Dict[str, Any]:
-    """OpenAI 兼容调用；支持首轮强制工具、严格 JSON、写入 trace。"""
+    """OpenAI 兼容调用；支持首轮强制工具、严格 JSON、写入 trace。传入 on_delta 时以 stream=true 调用，文本增量逐段回调。"""
     print("=== Call DeepSeek ===")
     api_key = getattr(settings, "DEEPSEEKKEY", "")
     if not api_key:
@@ -239,6 +245,9 @@ def call_deepseek(
         payload["tool_choice"] = {"type": "function", "function": {"name": force_tool}} if force_tool else "auto"
     if json_only:
         payload["response_format"] = {"type": "json_object"}
+    stream = on_delta is not None
+    if stream:
+        payload["stream"] = True
 
     # 获取超时配置
     timeout_seconds = getattr(settings, "DEEPSEEK_TIMEOUT", 120)
@@ -257,6 +266,7 @@ def call_deepseek(
         "has_tools": bool(tools),
         "force_tool": force_tool,
         "json_only": json_only,
+        "stream": stream,
         "payload_size": len(str(payload)),
         "last_message": messages[-1] if messages else None,
     }
@@ -284,38 +294,49 @@ def call_deepseek(
             "request_info": request_info,
         })
 
+    resp = None
     try:
         print(f"=== Sending request to DeepSeek API ===")
-        resp = requests.post(api_url, headers=headers, json=payload, timeout=timeout_seconds)
+        # 共享连接池的客户端：复用 keep-alive 连接，429/5xx 自动退避重试
+        resp = get_client().post(api_url, headers=headers, json=payload, timeout=timeout_seconds, stream=stream)
+
+        # 流式响应在这里读完并拼回非流式结构，之后的日志与返回逻辑不变
+        streamed_json = None
+        if stream and resp.status_code == 200:
+            streamed_json = read_chat_stream(resp, on_delta)
+        response_text = json.dumps(streamed_json, ensure_ascii=False) if streamed_json is not None else resp.text
         
         print(f"=== DeepSeek Response ===")
         print(f"Status code: {resp.status_code}")
-        print(f"Response size: {len(resp.text)} chars")
+        print(f"Latency: {resp.latency_ms}ms, attempts: {resp.attempts}")
+        print(f"Response size: {len(response_text)} chars")
         print(f"Response headers: {dict(resp.headers)}")
-        print(f"Response text: {resp.text}")
+        print(f"Response text: {response_text}")
         
         # 记录完整的响应信息
         if logger:
-            response_json = None
-            if resp.status_code == 200:
+            response_json = streamed_json
+            if response_json is None and resp.status_code == 200:
                 try:
                     response_json = resp.json()
                 except:
                     pass
-            logger.log_response(resp.status_code, dict(resp.headers), resp.text, response_json)
+            logger.log_response(resp.status_code, dict(resp.headers), response_text, response_json)
         
         if trace is not None:
             trace.append({
                 "stage": "api_response_meta",
                 "status_code": resp.status_code,
                 "ok": resp.status_code == 200,
-                "response_size": len(resp.text),
+                "response_size": len(response_text),
                 "response_headers": dict(resp.headers),
+                "latency_ms": resp.latency_ms,
+                "attempts": resp.attempts,
             })
             
         if resp.status_code == 200:
             try:
-                response_json = resp.json()
+                response_json = streamed_json if streamed_json is not None else resp.json()
                 print(f"Response parsed successfully, keys: {list(response_json.keys())}")
                 return response_json
             except Exception as parse_error:
@@ -352,6 +373,9 @@ def call_deepseek(
                 "error": str(conn_error),
             })
         return {"error": error_msg}
+
+    except AgentCancelled:
+        raise
         
     except Exception as e:
         error_msg = f"API call failed: {e}"
@@ -366,6 +390,11 @@ def call_deepseek(
             })
         return {"error": error_msg}
 
+    finally:
+        # 流式响应不关闭时连接不会归还连接池
+        if resp is not None:
+            resp.close()
+
 def _exec_tool(name: str, args: Dict[str, Any], trace: Optional[List[Dict[str, Any]]] = None, logger: Optional[ConversationLogger] = None) -> Dict[str, Any]:
     """执行工具并写入精简 trace。"""
     try:
@@ -429,7 +458,7 @@ def _summarize_result(result: Dict[str, Any]) -> Dict[str, Any]:
     if not isinstance(result, dict):
         return {"type": type(result).__name__}
     summary = {}
-    for k in ("ok", "error", "count", "pipeline", "time_range", "collection"):
+    for k in ("ok", "error", "hint", "count", "pipeline", "time_range", "collection", "source"):
         if k in result:
             summary[k] = result[k] if k != "pipeline" else f"len={len(result[k])}"
     if "data" in result:
@@ -440,14 +469,44 @@ def _summarize_result(result: Dict[str, Any]) -> Dict[str, Any]:
             summary["data_sample_keys"] = list(sample.keys())[:6]
     return summary
 
-def run_agent(user_query: str, *, max_iterations: int = 6, debug: bool = True, session_id: str = None) -> Dict[str, Any]:
+class AgentCancelled(Exception):
+    """流式问答的客户端已断开，停止后续的大模型调用与工具执行"""
+
+
+class _EventTrace(list):
+    """append 时同步回调，供流式接口在循环进行中推送 trace"""
+
+    def __init__(self, on_event: Callable[[Dict[str, Any]], None]):
+        super().__init__()
+        self._on_event = on_event
+
+    def append(self, entry: Dict[str, Any]):
+        super().append(entry)
+        self._on_event(entry)
+
+
+def run_agent(user_query: str, *, max_iterations: int = 6, debug: bool = True, session_id: str = None,
+              on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+              cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
     """
     主执行循环：首轮强制 describe_schema；全程追踪 trace；必要时降级。
+    传入 on_event 时每条 trace 写入后立即回调，大模型以流式调用，文本增量以 {"stage": "delta", "text": ...} 回调。
+    cancel 被置位后，在下一次大模型调用、工具执行或流式文本增量处抛出 AgentCancelled。
     """
     # 创建日志记录器
     logger = ConversationLogger(session_id)
-    
-    trace: List[Dict[str, Any]] = []
+
+    def check_cancel():
+        if cancel is not None and cancel.is_set():
+            logger.log("CANCELLED", {"session_id": logger.session_id})
+            raise AgentCancelled()
+
+    def on_delta_event(text: str):
+        check_cancel()
+        on_event({"stage": "delta", "text": text})
+
+    trace: List[Dict[str, Any]] = _EventTrace(on_event) if on_event else []
+    on_delta = on_delta_event if on_event else None
     messages: List[Dict[str, Any]] = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user_query},
@@ -467,7 +526,8 @@ def run_agent(user_query: str, *, max_iterations: int = 6, debug: bool = True, s
     logger.log_message("user", user_query)
 
     # 第1轮：强制 describe_schema（避免模型只回"让我看看…"的文本）
-    resp = call_deepseek(messages, TOOLS, force_tool="describe_schema", json_only=True, trace=trace, logger=logger)
+    check_cancel()
+    resp = call_deepseek(messages, TOOLS, force_tool="describe_schema", json_only=True, trace=trace, logger=logger, on_delta=on_delta)
     if "error" in resp:
         result = {"final": {"type": "text", "content": f"API错误: {resp['error']}"}}
         # 即使API失败，也返回trace信息以便调试
@@ -492,6 +552,7 @@ def run_agent(user_query: str, *, max_iterations: int = 6, debug: bool = True, s
                 args = json.loads(tc["function"].get("arguments", "{}"))
             except json.JSONDecodeError:
                 args = {}
+            check_cancel()
             result = _exec_tool(name, args, trace, logger)
             messages.append({
                 "role": "tool",
@@ -514,7 +575,8 @@ def run_agent(user_query: str, *, max_iterations: int = 6, debug: bool = True, s
     iteration = 1
     while iteration < max_iterations:
         iteration += 1
-        resp = call_deepseek(messages, TOOLS, json_only=True, trace=trace, logger=logger)
+        check_cancel()
+        resp = call_deepseek(messages, TOOLS, json_only=True, trace=trace, logger=logger, on_delta=on_delta)
         if "error" in resp:
             result = {"final": {"type": "text", "content": f"API错误: {resp['error']}"}}
             # 即使API失败，也返回trace信息以便调试
@@ -537,6 +599,7 @@ def run_agent(user_query: str, *, max_iterations: int = 6, debug: bool = True, s
                     args = json.loads(tc["function"].get("arguments", "{}"))
                 except json.JSONDecodeError:
                     args = {}
+                check_cancel()
                 result = _exec_tool(name, args, trace, logger)
                 messages.append({
                     "role": "tool",
@@ -547,7 +610,8 @@ def run_agent(user_query: str, *, max_iterations: int = 6, debug: bool = True, s
             continue  # 继续下一轮，让模型基于工具结果产生 final
 
         # 没有 tool_calls：尝试直接要最终 JSON
-        final_try = call_deepseek(messages, TOOLS, json_only=False, trace=trace, logger=logger)
+        check_cancel()
+        final_try = call_deepseek(messages, TOOLS, json_only=False, trace=trace, logger=logger, on_delta=on_delta)
         if "error" in final_try:
             result = {"final": {"type": "text", "content": f"最终API错误: {final_try['error']}"}}
             return _with_debug(result, trace, debug=True, logger=logger)  # 强制返回debug信息
@@ -1,8 +1,13 @@
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 
+from .. import cache as agg_cache
+from ..llm_client import get_client
+from ..streaming import agent_event_stream
+from dataservice.renderers import EventStreamRenderer, FastJSONRenderer
 from ..services.ai_service import AIDataService
 
 class AgentAskView(APIView):
@@ -42,3 +47,52 @@ class AgentAskView(APIView):
                 {"final": {"type": "text", "content": f"Agent执行错误: {str(e)}"}},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+class AgentAskStreamView(APIView):
+    """
+    Agent问答接口（Server-Sent Events）
+
+    请求体与 agent/ask/ 相同；执行过程中逐条推送 trace 阶段（tool_call / tool_result / delta ...），
+    最后推送 final 事件，数据与 agent/ask/ 的响应体相同。
+    """
+    permission_classes = []
+    renderer_classes = [EventStreamRenderer, FastJSONRenderer]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ai_service = AIDataService()
+
+    def post(self, request):
+        query = request.data.get('query', '').strip()
+        debug = request.data.get('debug', True)
+
+        if not query:
+            return Response(
+                {"error": "query required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = StreamingHttpResponse(
+            agent_event_stream(self.ai_service, query, debug=debug),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # 关闭 nginx 缓冲
+        return response
+
+
+class AgentCacheStatsView(APIView):
+    """run_aggregation 结果缓存的命中统计"""
+    permission_classes = []
+
+    def get(self, request):
+        return Response(agg_cache.stats(), status=status.HTTP_200_OK)
+
+
+class AgentLLMStatsView(APIView):
+    """大模型调用的耗时、重试与状态码统计"""
+    permission_classes = []
+
+    def get(self, request):
+        return Response(get_client().stats(), status=status.HTTP_200_OK)
@@ -0,0 +1,124 @@
+# apps/aiservice/cache.py
+"""
+run_aggregation 结果缓存（进程内）。
+
+键为规范化后的查询参数哈希：清理后的 pipeline、projection、limit、数据来源，以及对齐到
+AGENT_CACHE_BUCKET_S 边界的时间范围——“最近24小时”这类随时间滑动的查询在同一个时间桶内得到相同的键，
+重复提问直接返回缓存结果，不访问 MongoDB。
+
+淘汰策略：TTL（AGENT_CACHE_TTL_S）+ LRU，条目数不超过 AGENT_CACHE_MAX_ENTRIES，
+结果按 JSON 序列化长度估算的总大小不超过 AGENT_CACHE_MAX_BYTES；AGENT_CACHE_TTL_S=0 关闭缓存。
+"""
+import copy
+import datetime as dt
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+
+_lock = threading.Lock()
+# key -> (过期时间, 估算字节数, 结果)
+_entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+_bytes = 0
+_counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "oversize": 0}
+
+
+def ttl() -> float:
+    return float(getattr(settings, 'AGENT_CACHE_TTL_S', 120))
+
+
+def enabled() -> bool:
+    return ttl() > 0
+
+
+def snap_time_range(tr: Dict[str, dt.datetime]) -> Dict[str, dt.datetime]:
+    """
+    生成缓存键用的时间范围：起止时间都向下对齐到时间桶边界，缓存关闭时原样返回。
+    只用于缓存键，查询仍使用原始区间（对齐后的区间可能为空或丢掉末尾不足一个桶的数据）
+    """
+    bucket = int(getattr(settings, 'AGENT_CACHE_BUCKET_S', 60))
+    if not enabled() or bucket <= 0:
+        return tr
+    epoch = dt.datetime(1970, 1, 1)
+
+    def snap(value: dt.datetime) -> dt.datetime:
+        seconds = int((value - epoch).total_seconds())
+        return epoch + dt.timedelta(seconds=seconds - seconds % bucket)
+
+    return {"start": snap(tr["start"]), "end": snap(tr["end"])}
+
+
+def make_key(**params: Any) -> str:
+    """参数按键排序后 JSON 序列化（datetime 转为 ISO 字符串）再取哈希"""
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    """命中时返回结果的深拷贝（调用方可自由修改）"""
+    global _bytes
+    if not enabled():
+        return None
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _counters["misses"] += 1
+            return None
+        expires, size, result = entry
+        if expires < time.monotonic():
+            del _entries[key]
+            _bytes -= size
+            _counters["expirations"] += 1
+            _counters["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _counters["hits"] += 1
+    return copy.deepcopy(result)
+
+
+def put(key: str, result: Dict[str, Any]):
+    global _bytes
+    if not enabled():
+        return
+    size = len(json.dumps(result, default=str))
+    max_bytes = int(getattr(settings, 'AGENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    max_entries = int(getattr(settings, 'AGENT_CACHE_MAX_ENTRIES', 256))
+    if size > max_bytes:
+        with _lock:
+            _counters["oversize"] += 1
+        return
+    stored = copy.deepcopy(result)
+    with _lock:
+        old = _entries.pop(key, None)
+        if old is not None:
+            _bytes -= old[1]
+        _entries[key] = (time.monotonic() + ttl(), size, stored)
+        _bytes += size
+        _counters["stores"] += 1
+        while _entries and (_bytes > max_bytes or len(_entries) > max_entries):
+            _, (_, evicted_size, _) = _entries.popitem(last=False)
+            _bytes -= evicted_size
+            _counters["evictions"] += 1
+
+
+def clear():
+    global _bytes
+    with _lock:
+        _entries.clear()
+        _bytes = 0
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        lookups = _counters["hits"] + _counters["misses"]
+        return dict(
+            _counters,
+            entries=len(_entries),
+            bytes=_bytes,
+            hit_ratio=round(_counters["hits"] / lookups, 4) if lookups else None,
+            ttl_s=ttl(),
+        )
@@ -0,0 +1,144 @@
+# apps/aiservice/cost.py
+"""
+agent 聚合管道的执行前成本检查。
+
+执行前先用 explain（queryPlanner，不实际执行）取得计划：是否走索引、是否全表扫描、是否需要内存排序；
+再估算扫描文档数（走索引时用首个 $match 做 count，全表扫描时用集合估算总数），
+按管道中的高成本阶段加权得到成本，与 AGENT_COST_BUDGET 比较。
+
+超出预算或包含写入阶段时返回结构化提示（reason / estimated_docs / suggestions ...），
+供 run_aggregation 改写（source=auto 且只含 $avg 时改读小时汇总）或直接拒绝并交给大模型调整查询。
+"""
+import json
+from typing import Any, Dict, List, Optional, Set
+
+from django.conf import settings
+from pymongo.errors import ExecutionTimeout, PyMongoError
+
+# 会写数据库的阶段，一律拒绝
+FORBIDDEN_STAGES = ("$out", "$merge")
+# 阶段 -> 成本倍数
+EXPENSIVE_STAGES = {"$lookup": 5.0, "$graphLookup": 10.0, "$facet": 2.0, "$setWindowFields": 2.0}
+ROOT_GROUP_WEIGHT = 4.0     # $group 中引用 $$ROOT：每组都要在内存中保存整条文档
+BLOCKING_SORT_WEIGHT = 2.0  # 计划中有不走索引的 SORT
+
+
+def budget() -> float:
+    return float(getattr(settings, 'AGENT_COST_BUDGET', 100000))
+
+
+def _plan_stages(node: Any, found: Set[str]):
+    """递归收集 explain 输出中的计划阶段名（兼容经典引擎与 SBE 的不同结构）"""
+    if isinstance(node, dict):
+        stage = node.get("stage")
+        if isinstance(stage, str):
+            found.add(stage)
+        for value in node.values():
+            _plan_stages(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            _plan_stages(value, found)
+
+
+def explain_plan(collection_obj, pipeline: List[Dict[str, Any]]) -> Set[str]:
+    result = collection_obj.database.command(
+        "aggregate", collection_obj.name, pipeline=pipeline, explain=True,
+    )
+    found: Set[str] = set()
+    _plan_stages(result, found)
+    return found
+
+
+def estimate_docs(collection_obj, pipeline: List[Dict[str, Any]], uses_index: bool) -> int:
+    """估算首个 $match 命中的文档数；不走索引时按全表计算"""
+    first_match = pipeline[0].get("$match") if pipeline and isinstance(pipeline[0], dict) else None
+    if not first_match or not uses_index:
+        return collection_obj.estimated_document_count()
+    timeout_ms = int(getattr(settings, 'AGENT_COST_COUNT_TIMEOUT_MS', 1000))
+    try:
+        return collection_obj.count_documents(first_match, maxTimeMS=timeout_ms)
+    except ExecutionTimeout:
+        # 索引计数都超时，说明范围很大，按全表处理
+        return collection_obj.estimated_document_count()
+
+
+def _weight(pipeline: List[Dict[str, Any]]) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for stage in pipeline:
+        if not isinstance(stage, dict):
+            continue
+        for name in stage:
+            if name in EXPENSIVE_STAGES:
+                weights[name] = EXPENSIVE_STAGES[name]
+            if name == "$group" and "$$ROOT" in json.dumps(stage[name], default=str):
+                weights["$group($$ROOT)"] = ROOT_GROUP_WEIGHT
+    return weights
+
+
+def preflight(collection_obj, pipeline: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    返回 {ok, cost, budget, estimated_docs, uses_index, collscan, blocking_sort, weights, reason, suggestions}。
+    ok=False 时 reason 为 forbidden_stage / over_budget；explain 本身失败时放行（交给 maxTimeMS 兜底）。
+    """
+    limit = budget()
+    forbidden = [name for stage in pipeline if isinstance(stage, dict) for name in stage if name in FORBIDDEN_STAGES]
+    if forbidden:
+        return {
+            "ok": False,
+            "reason": "forbidden_stage",
+            "stages": forbidden,
+            "suggestions": ["管道中不能包含写入阶段（$out/$merge），请直接返回查询结果"],
+        }
+
+    try:
+        plan = explain_plan(collection_obj, pipeline)
+        uses_index = "IXSCAN" in plan or "EXPRESS_IXSCAN" in plan
+        collscan = "COLLSCAN" in plan
+        docs = estimate_docs(collection_obj, pipeline, uses_index and not collscan)
+    except PyMongoError as e:
+        return {"ok": True, "skipped": f"explain failed: {e}", "budget": limit}
+
+    weights = _weight(pipeline)
+    blocking_sort = "SORT" in plan
+    if blocking_sort:
+        weights["SORT"] = BLOCKING_SORT_WEIGHT
+    cost = float(docs)
+    for w in weights.values():
+        cost *= w
+
+    report: Dict[str, Any] = {
+        "ok": cost <= limit,
+        "cost": round(cost),
+        "budget": limit,
+        "estimated_docs": docs,
+        "uses_index": uses_index,
+        "collscan": collscan,
+        "blocking_sort": blocking_sort,
+        "weights": weights,
+    }
+    if not report["ok"]:
+        suggestions: List[str] = ["缩短 time_range"]
+        if collection_obj.name == "sensor_data":
+            suggestions.append("使用 source='hour' 读取小时汇总")
+        if "$group($$ROOT)" in weights:
+            suggestions.append("$group 中只累加需要的字段，不要使用 $$ROOT")
+        if collscan:
+            suggestions.append("首个阶段使用按 timestamp 的 $match 以便走索引")
+        for name in EXPENSIVE_STAGES:
+            if name in weights:
+                suggestions.append(f"避免使用 {name}")
+        report.update({"reason": "over_budget", "suggestions": suggestions})
+    return report
+
+
+def rejection(report: Dict[str, Any], source: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """把检查结果转换为 run_aggregation 的失败返回，hint 供大模型调整查询"""
+    if report.get("reason") == "forbidden_stage":
+        error = f"Pipeline rejected: write stages {report['stages']} are not allowed"
+    else:
+        error = (f"Pipeline rejected: estimated cost {report['cost']} exceeds budget {report['budget']:.0f} "
+                 f"(~{report['estimated_docs']} documents)")
+    result = {"ok": False, "error": error, "hint": report}
+    if source:
+        result["source"] = source
+    return result
@@ -0,0 +1,167 @@
+# apps/aiservice/llm_client.py
+"""
+大模型 HTTP 客户端（进程内共享）。
+
+一次问答会调用大模型 3~6 次，每次新建连接都要重新做 TCP/TLS 握手。这里使用一个共享的
+requests.Session（HTTPAdapter 连接池，keep-alive 复用连接），并提供：
+- 429 / 5xx 与连接错误时按指数退避 + 全抖动重试（优先遵循 Retry-After），读超时不重试
+- 每次调用的耗时、重试次数、状态码统计（stats()）；流式请求的耗时为收到响应头（首字节）的时间
+- read_chat_stream()：把 OpenAI 兼容的 stream=true 响应拼回与非流式相同的结构
+"""
+import json
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+LATENCY_WINDOW = 500
+
+
+class LLMClient:
+    def __init__(self, pool_size: int = 10, max_retries: int = 2,
+                 backoff_base_s: float = 0.5, backoff_max_s: float = 8.0):
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._counters: Dict[str, Any] = {'calls': 0, 'errors': 0, 'retries': 0, 'status': {}}
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max_s)
+            except ValueError:
+                pass
+        # 全抖动：在 [0, base * 2^attempt] 内随机，避免多个请求同时重试
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt)))
+
+    def post(self, url: str, *, timeout: float, **kwargs) -> requests.Response:
+        """
+        发送 POST，必要时重试；返回最后一次的响应（可能是非 200），
+        并在响应上附加 latency_ms（含重试的总耗时）与 attempts。连接错误重试耗尽后抛出原异常。
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self.session.post(url, timeout=timeout, **kwargs)
+            except requests.exceptions.ConnectionError:
+                # 包括连接超时与复用到已被服务端关闭的连接
+                if attempt >= self.max_retries:
+                    self._record(started, None)
+                    raise
+            except requests.exceptions.RequestException:
+                self._record(started, None)
+                raise
+            else:
+                if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                    response.latency_ms = round((time.monotonic() - started) * 1000, 1)
+                    response.attempts = attempt + 1
+                    self._record(started, response.status_code)
+                    return response
+                response.close()
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+            with self._lock:
+                self._counters['retries'] += 1
+
+    def _record(self, started: float, status_code: Optional[int]):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._counters['calls'] += 1
+            self._latencies.append(elapsed_ms)
+            if status_code is None or status_code >= 400:
+                self._counters['errors'] += 1
+            key = str(status_code) if status_code is not None else 'exception'
+            self._counters['status'][key] = self._counters['status'].get(key, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            result = dict(self._counters, status=dict(self._counters['status']))
+        if latencies:
+            result['latency_ms'] = {
+                'avg': round(sum(latencies) / len(latencies), 1),
+                'p50': round(latencies[len(latencies) // 2], 1),
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+                'max': round(latencies[-1], 1),
+                'window': len(latencies),
+            }
+        return result
+
+
+def read_chat_stream(response: requests.Response,
+                     on_delta: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    逐行读取 SSE（data: {...} / data: [DONE]），每段文本增量回调 on_delta，
+    tool_calls 按 index 拼接 id / name / arguments 片段；返回 {"choices": [{"message": ...}], "usage": ...}。
+    [DONE] 之后仍读到响应结束，使连接可以归还连接池；调用方负责 close()。
+    """
+    response.encoding = 'utf-8'
+    content_parts = []
+    tool_calls: Dict[int, Dict[str, Any]] = {}
+    finish_reason = None
+    usage = None
+    done = False
+    for line in response.iter_lines(decode_unicode=True):
+        if done or not line or not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            done = True
+            continue
+        chunk = json.loads(data)
+        usage = chunk.get('usage') or usage
+        for choice in chunk.get('choices') or []:
+            delta = choice.get('delta') or {}
+            text = delta.get('content')
+            if text:
+                content_parts.append(text)
+                if on_delta:
+                    on_delta(text)
+            for part in delta.get('tool_calls') or []:
+                slot = tool_calls.setdefault(part.get('index', 0), {
+                    'id': None, 'type': 'function', 'function': {'name': '', 'arguments': ''},
+                })
+                if part.get('id'):
+                    slot['id'] = part['id']
+                function = part.get('function') or {}
+                slot['function']['name'] += function.get('name') or ''
+                slot['function']['arguments'] += function.get('arguments') or ''
+            finish_reason = choice.get('finish_reason') or finish_reason
+
+    message: Dict[str, Any] = {'role': 'assistant', 'content': ''.join(content_parts)}
+    if tool_calls:
+        message['tool_calls'] = [tool_calls[index] for index in sorted(tool_calls)]
+    return {'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}], 'usage': usage}
+
+
+_client: Optional[LLMClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> LLMClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient(
+                    pool_size=int(getattr(settings, 'LLM_POOL_SIZE', 10)),
+                    max_retries=int(getattr(settings, 'LLM_MAX_RETRIES', 2)),
+                    backoff_base_s=float(getattr(settings, 'LLM_BACKOFF_BASE_S', 0.5)),
+                    backoff_max_s=float(getattr(settings, 'LLM_BACKOFF_MAX_S', 8)),
+                )
+    return _client
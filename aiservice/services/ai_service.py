@@ -3,29 +3,34 @@ import json
 from typing import Dict, Any
 from django.conf import settings
 # backend\aiservice\agent.py
-from ..agent import run_agent, run_simple_query
+from ..agent import AgentCancelled, run_agent, run_simple_query
 
 class AIDataService:
     def __init__(self):
         self.api_key = getattr(settings, 'DEEPSEEKKEY', None)
         
-    def analyze_data_with_agent(self, query: str, debug: bool = True) -> Dict[str, Any]:
+    def analyze_data_with_agent(self, query: str, debug: bool = True, on_event=None, cancel=None) -> Dict[str, Any]:
         """
         使用Agent分析数据
         
         Args:
             query: 用户查询
             debug: 是否返回调试信息
+            on_event: 可选，执行过程中的 trace 回调（流式接口使用）
+            cancel: 可选，threading.Event，置位后停止执行（流式接口的客户端断开）
         """
         try:
             # 优先使用完整的Agent
             if self.api_key:
-                result = run_agent(query, debug=debug)
+                result = run_agent(query, debug=debug, on_event=on_event, cancel=cancel)
             else:
                 # 降级到简单查询
                 result = run_simple_query(query)
                 
             return result
+
+        except AgentCancelled:
+            return {"final": {"type": "text", "content": "已取消"}}
             
         except Exception as e:
             # 如果Agent失败，降级到简单查询
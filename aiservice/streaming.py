@@ -0,0 +1,66 @@
+# apps/aiservice/streaming.py
+"""
+Agent 问答的 SSE 输出。
+
+run_agent 在后台线程中执行，trace 通过回调写入队列；响应生成器从队列中取出事件立即推送：
+- event 名即 trace 的 stage：start / model_msg / tool_call / tool_result / tool_error / delta（大模型文本增量）...
+- 最后一条为 final 事件，数据与 agent/ask/ 的响应体相同
+debug=False 时只推送 PUBLIC_STAGES 中的阶段（不含请求与响应的原始内容）。
+"""
+import json
+import queue
+import threading
+from typing import Any, Dict, Iterator
+
+from django.conf import settings
+
+PUBLIC_STAGES = frozenset({
+    "start", "model_msg", "forced_schema_inject", "tool_call", "tool_result", "tool_error",
+    "delta", "json_retry", "fallback", "api_timeout", "api_connection_error", "api_general_error",
+})
+
+
+def sse_event(name: str, data: Any) -> bytes:
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+    return f"event: {name}\ndata: {payload}\n\n".encode("utf-8")
+
+
+def agent_event_stream(service, query: str, debug: bool = True) -> Iterator[bytes]:
+    """
+    单个问答连接的输出生成器。客户端中途断开时生成器被关闭并置位 cancel，
+    后台线程在下一次大模型调用、工具执行或流式文本增量处停止。
+    """
+    keepalive = float(getattr(settings, "AGENT_STREAM_KEEPALIVE_S", 15))
+    events: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+    cancel = threading.Event()
+
+    def on_event(entry: Dict[str, Any]):
+        if cancel.is_set():
+            return
+        if debug or entry.get("stage") in PUBLIC_STAGES:
+            events.put(entry)
+
+    def worker():
+        try:
+            result = service.analyze_data_with_agent(query, debug=debug, on_event=on_event, cancel=cancel)
+        except Exception as e:
+            result = {"final": {"type": "text", "content": f"Agent执行错误: {str(e)}"}}
+        events.put({"stage": "final", "result": result})
+
+    threading.Thread(target=worker, name="agent-stream", daemon=True).start()
+
+    try:
+        yield f"retry: {int(keepalive * 1000)}\n\n".encode()
+        while True:
+            try:
+                entry = events.get(timeout=keepalive)
+            except queue.Empty:
+                yield b": keepalive\n\n"
+                continue
+            if entry.get("stage") == "final":
+                yield sse_event("final", entry["result"])
+                return
+            yield sse_event(entry.get("stage", "trace"), entry)
+    finally:
+        # 正常结束时无影响；客户端断开（生成器被关闭）时通知后台线程停止
+        cancel.set()
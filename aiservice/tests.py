@@ -0,0 +1,538 @@
+import datetime as dt
+import json
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, override_settings
+from pymongo.errors import ExecutionTimeout, OperationFailure
+
+from dataservice import rollups
+
+from . import cache, cost, llm_client, tools
+from .llm_client import LLMClient, read_chat_stream
+
+
+class FakeAggregateCollection:
+    def __init__(self, name):
+        self.name = name
+        self.pipelines = []
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return iter([])
+
+
+class RunAggregationTestCase(SimpleTestCase):
+    """run_aggregation 的集合、汇总水位与成本检查替换为内存实现；preflight 依次返回 self.reports"""
+
+    DAY = {'start': '2024-01-01T00:00:00', 'end': '2024-01-02T00:00:00'}
+    AVG = [{'$group': {'_id': None, 'avg': {'$avg': '$LDC_1'}}}]
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.raw = FakeAggregateCollection('sensor_data')
+        self.db = {name: FakeAggregateCollection(name) for name in rollups.ROLLUP_COLLECTIONS.values()}
+        self.watermarks = {'minute': dt.datetime(2024, 1, 3), 'hour': dt.datetime(2024, 1, 3)}
+        self.coverage = {'minute': dt.datetime(2023, 12, 1), 'hour': dt.datetime(2023, 12, 1)}
+        self.reports = []
+        for target, name, replacement in (
+            (tools.SensorData, '_get_collection', lambda: self.raw),
+            (tools.cost, 'preflight', self.preflight),
+            (tools.rollups, 'get_state', lambda g: {'watermark': self.watermarks.get(g)}),
+            (tools.rollups, 'coverage_start', self.coverage.get),
+        ):
+            patcher = mock.patch.object(target, name, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('mongoengine.connection.get_db', lambda: self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def preflight(self, collection_obj, pipeline):
+        if self.reports:
+            return self.reports.pop(0)
+        return {'ok': True, 'cost': 1.0, 'budget': 10000}
+
+    def run_aggregation(self, pipeline, time_range=None, **kwargs):
+        return tools.run_aggregation('sensor_data', pipeline, time_range=time_range or self.DAY, **kwargs)
+
+    def read_from(self):
+        """实际执行聚合的集合名"""
+        return [c.name for c in [self.raw, *self.db.values()] if c.pipelines]
+
+
+class RollupRoutingTests(RunAggregationTestCase):
+    """run_aggregation 在汇总集合与原始数据之间的选择"""
+
+    def test_needs_raw_precision(self):
+        self.assertFalse(tools._needs_raw_precision(self.AVG + [{'$sort': {'avg': -1}}]))
+        self.assertFalse(tools._needs_raw_precision([
+            {'$setWindowFields': {'sortBy': {'timestamp': 1}, 'output': {
+                'ma': {'$avg': '$LDC_1', 'window': {'documents': [-5, 0]}}}}},
+        ]))
+        for op in ('$min', '$max', '$sum', '$first', '$push'):
+            self.assertTrue(tools._needs_raw_precision([{'$group': {'_id': None, 'v': {op: '$LDC_1'}}}]), op)
+        self.assertTrue(tools._needs_raw_precision([{'$count': 'n'}]))
+        self.assertTrue(tools._needs_raw_precision([{'$bucket': {'groupBy': '$LDC_1', 'boundaries': [0, 100]}}]))
+
+    def test_avg_only_reads_rollup(self):
+        result = self.run_aggregation(self.AVG)
+        self.assertTrue(result['ok'])
+        self.assertEqual(result['source']['collection'], 'sensor_data_minute')
+        self.assertEqual(result['source']['granularity'], '5min')
+        self.assertEqual(self.read_from(), ['sensor_data_minute'])
+
+        result = self.run_aggregation(self.AVG, source='hour')
+        self.assertEqual((result['source']['collection'], result['source']['granularity']),
+                         ('sensor_data_hour', 'hour'))
+
+    def test_precision_accumulators_read_raw(self):
+        for op in ('$min', '$max', '$sum'):
+            cache.clear()
+            result = self.run_aggregation([{'$group': {'_id': None, 'v': {op: '$LDC_1'}}}])
+            self.assertEqual(result['source']['collection'], 'sensor_data', op)
+            self.assertIn('需要原始数据精度', result['source']['reason'])
+        result = self.run_aggregation([{'$count': 'n'}])
+        self.assertEqual(result['source']['collection'], 'sensor_data')
+        self.assertEqual(self.db['sensor_data_minute'].pipelines, [])
+
+    def test_short_and_sub_hour_ranges_read_raw(self):
+        result = self.run_aggregation(self.AVG, {'start': '2024-01-01T10:00:00', 'end': '2024-01-01T10:05:00'})
+        self.assertEqual(result['source']['reason'], '样本较少，直接读取原始数据')
+        # 小时汇总水位停在 10:00，区间内没有完整的小时桶
+        self.watermarks['hour'] = dt.datetime(2024, 1, 1, 10)
+        result = self.run_aggregation(self.AVG, {'start': '2024-01-01T10:05:00', 'end': '2024-01-01T10:45:00'},
+                                      source='hour')
+        self.assertEqual(result['source']['collection'], 'sensor_data')
+        self.assertEqual(result['source']['reason'], 'hour 汇总尚未覆盖该时间段，改用原始数据')
+        self.assertEqual(self.read_from(), ['sensor_data'])
+
+    def test_range_before_coverage_reads_raw(self):
+        self.coverage['minute'] = dt.datetime(2024, 1, 1, 6)
+        result = self.run_aggregation(self.AVG)
+        self.assertEqual(result['source']['collection'], 'sensor_data')
+
+    def test_tail_after_watermark_from_raw(self):
+        tr = {'start': dt.datetime(2024, 1, 1), 'end': dt.datetime(2024, 1, 2)}
+        self.watermarks['minute'] = dt.datetime(2024, 1, 1, 20)
+        stages = tools._rollup_source_stages('minute', tr, 1)
+        self.assertEqual(stages[0], {'$match': {'timestamp': {'$gte': tr['start'], '$lt': dt.datetime(2024, 1, 1, 20)}}})
+        union = stages[2]['$unionWith']
+        self.assertEqual(union['coll'], 'sensor_data')
+        self.assertEqual(union['pipeline'][0],
+                         {'$match': {'timestamp': {'$gte': dt.datetime(2024, 1, 1, 20), '$lte': tr['end']}}})
+        self.assertEqual(stages[-1], {'$sort': {'timestamp': 1}})
+        self.watermarks['minute'] = dt.datetime(2024, 1, 3)
+        self.assertFalse(any('$unionWith' in stage for stage in tools._rollup_source_stages('minute', tr, 1)))
+
+
+class FakeDatabase:
+    def __init__(self, plan, error=None):
+        self.plan = plan
+        self.error = error
+        self.commands = []
+
+    def command(self, name, collection, **kwargs):
+        self.commands.append((name, collection, kwargs))
+        if self.error:
+            raise self.error
+        return self.plan
+
+
+class FakeCollection:
+    """只实现 preflight 用到的接口：database.command / name / 两种计数"""
+
+    def __init__(self, plan, total=1000000, matched=100, name='sensor_data', count_error=None, explain_error=None):
+        self.database = FakeDatabase(plan, explain_error)
+        self.name = name
+        self.total = total
+        self.matched = matched
+        self.count_error = count_error
+        self.counted = []
+
+    def estimated_document_count(self):
+        return self.total
+
+    def count_documents(self, query, maxTimeMS=None):
+        self.counted.append((query, maxTimeMS))
+        if self.count_error:
+            raise self.count_error
+        return self.matched
+
+
+def plan(*stages):
+    """构造嵌套的 explain 输出：stages[0] 为根阶段"""
+    node = None
+    for stage in reversed(stages):
+        node = {'stage': stage, 'inputStage': node} if node else {'stage': stage}
+    return {'stages': [{'$cursor': {'queryPlanner': {'winningPlan': node}}}]}
+
+
+MATCH = {'$match': {'timestamp': {'$gte': '2024-01-01', '$lt': '2024-01-02'}}}
+
+
+@override_settings(AGENT_COST_BUDGET=10000, AGENT_COST_COUNT_TIMEOUT_MS=200)
+class CostPreflightTests(SimpleTestCase):
+    """聚合执行前的成本估算"""
+
+    def test_forbidden_stage(self):
+        collection = FakeCollection(plan('IXSCAN'))
+        report = cost.preflight(collection, [MATCH, {'$out': 'copy'}])
+        self.assertFalse(report['ok'])
+        self.assertEqual(report['reason'], 'forbidden_stage')
+        self.assertEqual(report['stages'], ['$out'])
+        self.assertEqual(collection.database.commands, [])
+        self.assertIn('$out', cost.rejection(report)['error'])
+
+    def test_index_scan_within_budget(self):
+        collection = FakeCollection(plan('FETCH', 'IXSCAN'), matched=2000)
+        report = cost.preflight(collection, [MATCH, {'$group': {'_id': None, 'avg': {'$avg': '$LDC_1'}}}])
+        self.assertTrue(report['ok'])
+        self.assertEqual((report['cost'], report['estimated_docs']), (2000, 2000))
+        self.assertTrue(report['uses_index'])
+        self.assertFalse(report['collscan'])
+        self.assertEqual(collection.counted, [(MATCH['$match'], 200)])
+
+    def test_collscan_over_budget(self):
+        collection = FakeCollection(plan('COLLSCAN'), total=50000)
+        report = cost.preflight(collection, [{'$match': {'LDC_1': {'$gt': 1}}}])
+        self.assertFalse(report['ok'])
+        self.assertEqual(report['reason'], 'over_budget')
+        self.assertEqual(report['estimated_docs'], 50000)
+        self.assertEqual(collection.counted, [])
+        self.assertIn("使用 source='hour' 读取小时汇总", report['suggestions'])
+        self.assertIn('首个阶段使用按 timestamp 的 $match 以便走索引', report['suggestions'])
+        rejected = cost.rejection(report, {'source': 'raw'})
+        self.assertIn('exceeds budget 10000', rejected['error'])
+        self.assertEqual(rejected['source'], {'source': 'raw'})
+
+    def test_stage_weights_multiply(self):
+        collection = FakeCollection(plan('SORT', 'IXSCAN'), matched=400)
+        pipeline = [
+            MATCH,
+            {'$lookup': {'from': 'other', 'localField': 'a', 'foreignField': 'b', 'as': 'c'}},
+            {'$group': {'_id': '$hour', 'rows': {'$push': '$$ROOT'}}},
+        ]
+        report = cost.preflight(collection, pipeline)
+        self.assertEqual(report['weights'], {'$lookup': 5.0, '$group($$ROOT)': 4.0, 'SORT': 2.0})
+        self.assertEqual(report['cost'], 400 * 5 * 4 * 2)
+        self.assertTrue(report['blocking_sort'])
+        self.assertIn('避免使用 $lookup', report['suggestions'])
+        self.assertIn('$group 中只累加需要的字段，不要使用 $$ROOT', report['suggestions'])
+
+    def test_count_timeout_falls_back_to_total(self):
+        collection = FakeCollection(plan('IXSCAN'), total=3000, count_error=ExecutionTimeout('slow'))
+        report = cost.preflight(collection, [MATCH])
+        self.assertEqual(report['estimated_docs'], 3000)
+
+    def test_explain_failure_is_allowed(self):
+        collection = FakeCollection(plan('IXSCAN'), explain_error=OperationFailure('no explain'))
+        report = cost.preflight(collection, [MATCH])
+        self.assertTrue(report['ok'])
+        self.assertIn('skipped', report)
+
+
+OVER_BUDGET = {'ok': False, 'reason': 'over_budget', 'cost': 50000, 'budget': 10000, 'estimated_docs': 50000,
+               'suggestions': ['缩短 time_range']}
+
+
+class CostGuardTests(RunAggregationTestCase):
+    """run_aggregation 超出预算时的改写与拒绝"""
+
+    def test_auto_avg_falls_back_to_hour(self):
+        self.reports = [OVER_BUDGET]
+        result = self.run_aggregation(self.AVG)
+        self.assertTrue(result['ok'])
+        self.assertEqual(result['source']['collection'], 'sensor_data_hour')
+        self.assertEqual(result['cost']['rewritten_from'], {'source': 'auto', 'cost': 50000, 'estimated_docs': 50000})
+        self.assertTrue(self.run_aggregation(self.AVG)['cache']['hit'])
+
+    def test_raw_source_is_rejected(self):
+        self.reports = [OVER_BUDGET]
+        result = self.run_aggregation(self.AVG, source='raw')
+        self.assertFalse(result['ok'])
+        self.assertIn('exceeds budget 10000', result['error'])
+        self.assertEqual(result['hint'], OVER_BUDGET)
+        self.assertEqual(self.read_from(), [])
+
+    def test_precision_pipeline_is_rejected(self):
+        pipeline = [{'$group': {'_id': None, 'peak': {'$max': '$LDC_1'}}}]
+        self.reports = [OVER_BUDGET]
+        result = self.run_aggregation(pipeline)
+        self.assertFalse(result['ok'])
+        self.assertEqual(result['source']['collection'], 'sensor_data')
+        self.assertEqual(self.read_from(), [])
+        # 拒绝结果不缓存：预算允许后重新执行
+        result = self.run_aggregation(pipeline)
+        self.assertTrue(result['ok'])
+        self.assertFalse(result['cache']['hit'])
+        self.assertEqual(self.read_from(), ['sensor_data'])
+
+    def test_forbidden_stage_is_rejected(self):
+        self.reports = [{'ok': False, 'reason': 'forbidden_stage', 'stages': ['$out'], 'suggestions': []}]
+        result = self.run_aggregation(self.AVG + [{'$out': 'copy'}])
+        self.assertFalse(result['ok'])
+        self.assertIn('$out', result['error'])
+
+
+@override_settings(AGENT_CACHE_TTL_S=60, AGENT_CACHE_BUCKET_S=60,
+                   AGENT_CACHE_MAX_ENTRIES=2, AGENT_CACHE_MAX_BYTES=1024 * 1024)
+class AggregationCacheTests(SimpleTestCase):
+    """run_aggregation 结果缓存的 LRU / TTL / 字节上限"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.now = 1000.0
+        patcher = mock.patch.object(cache.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def counter(self, name):
+        return cache.stats()[name]
+
+    def test_lru_eviction(self):
+        evictions = self.counter('evictions')
+        cache.put('a', {'ok': True, 'rows': [1]})
+        cache.put('b', {'ok': True, 'rows': [2]})
+        self.assertIsNotNone(cache.get('a'))  # a 成为最近使用
+        cache.put('c', {'ok': True, 'rows': [3]})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'ok': True, 'rows': [1]})
+        self.assertEqual(cache.get('c'), {'ok': True, 'rows': [3]})
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertEqual(self.counter('evictions') - evictions, 1)
+
+    def test_ttl_expiry(self):
+        expirations = self.counter('expirations')
+        cache.put('a', {'rows': [1]})
+        self.now += 59
+        self.assertIsNotNone(cache.get('a'))
+        self.now += 2
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(self.counter('expirations') - expirations, 1)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    @override_settings(AGENT_CACHE_MAX_ENTRIES=100, AGENT_CACHE_MAX_BYTES=100)
+    def test_byte_ceiling(self):
+        oversize = self.counter('oversize')
+        cache.put('huge', {'rows': ['x' * 200]})
+        self.assertIsNone(cache.get('huge'))
+        self.assertEqual(self.counter('oversize') - oversize, 1)
+        cache.put('a', {'rows': ['x' * 40]})
+        cache.put('b', {'rows': ['y' * 40]})
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        self.assertLessEqual(cache.stats()['bytes'], 100)
+
+    def test_results_are_copied(self):
+        result = {'rows': [{'v': 1}]}
+        cache.put('a', result)
+        result['rows'][0]['v'] = 2
+        hit = cache.get('a')
+        hit['rows'].append({'v': 3})
+        self.assertEqual(cache.get('a'), {'rows': [{'v': 1}]})
+
+    @override_settings(AGENT_CACHE_TTL_S=0)
+    def test_disabled(self):
+        cache.put('a', {'rows': [1]})
+        self.assertIsNone(cache.get('a'))
+        tr = {'start': dt.datetime(2024, 1, 1, 0, 0, 17), 'end': dt.datetime(2024, 1, 2, 0, 0, 17)}
+        self.assertIs(cache.snap_time_range(tr), tr)
+
+    def test_snap_time_range_and_key(self):
+        tr = {'start': dt.datetime(2024, 1, 1, 10, 3, 17), 'end': dt.datetime(2024, 1, 2, 10, 3, 59)}
+        self.assertEqual(cache.snap_time_range(tr), {
+            'start': dt.datetime(2024, 1, 1, 10, 3), 'end': dt.datetime(2024, 1, 2, 10, 3),
+        })
+        pipeline = [{'$match': {'a': 1}}]
+        self.assertEqual(cache.make_key(pipeline=pipeline, limit=10, time_range=cache.snap_time_range(tr)),
+                         cache.make_key(time_range=cache.snap_time_range(tr), limit=10, pipeline=pipeline))
+        self.assertNotEqual(cache.make_key(pipeline=pipeline, limit=10), cache.make_key(pipeline=pipeline, limit=20))
+
+
+@override_settings(AGENT_CACHE_TTL_S=60, AGENT_CACHE_BUCKET_S=60)
+class CachedQueryRangeTests(RunAggregationTestCase):
+    """缓存键按时间桶对齐，查询始终使用请求的区间"""
+
+    def raw_match(self, call=-1):
+        return self.raw.pipelines[call][0]['$match']['timestamp']
+
+    def test_sub_minute_range(self):
+        result = self.run_aggregation([], {'start': '2024-01-01T10:00:10', 'end': '2024-01-01T10:00:50'})
+        self.assertTrue(result['ok'])
+        self.assertEqual(self.raw_match(), {'$gte': dt.datetime(2024, 1, 1, 10, 0, 10),
+                                            '$lte': dt.datetime(2024, 1, 1, 10, 0, 50)})
+        self.assertEqual(result['time_range'], {'start': '2024-01-01T10:00:10', 'end': '2024-01-01T10:00:50'})
+
+    def test_trailing_edge_is_queried(self):
+        tr = {'start': '2024-01-01T10:00:05', 'end': '2024-01-01T10:03:59'}
+        self.assertFalse(self.run_aggregation([], tr)['cache']['hit'])
+        self.assertEqual(self.raw_match()['$lte'], dt.datetime(2024, 1, 1, 10, 3, 59))
+
+    def test_same_bucket_shares_key(self):
+        first = self.run_aggregation([], {'start': '2024-01-01T10:00:05', 'end': '2024-01-01T10:03:20'})
+        again = self.run_aggregation([], {'start': '2024-01-01T10:00:40', 'end': '2024-01-01T10:03:59'})
+        self.assertTrue(again['cache']['hit'])
+        self.assertEqual(again['cache']['key'], first['cache']['key'])
+        self.assertEqual(len(self.raw.pipelines), 1)
+        later = self.run_aggregation([], {'start': '2024-01-01T10:00:05', 'end': '2024-01-01T10:04:00'})
+        self.assertFalse(later['cache']['hit'])
+        self.assertEqual(self.raw_match()['$lte'], dt.datetime(2024, 1, 1, 10, 4))
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class LLMClientTests(SimpleTestCase):
+    """共享会话的重试与统计；session.post 依次返回 outcomes（异常实例则抛出）"""
+
+    def setUp(self):
+        self.client = LLMClient(max_retries=2, backoff_base_s=0.5, backoff_max_s=8)
+        self.outcomes = []
+        self.calls = []
+        self.sleeps = []
+        for target, name, replacement in (
+            (self.client.session, 'post', self.post),
+            (llm_client.time, 'sleep', self.sleeps.append),
+            (llm_client.random, 'uniform', lambda low, high: high),
+        ):
+            patcher = mock.patch.object(target, name, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, url, timeout=None, **kwargs):
+        self.calls.append((url, timeout, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def test_retries_429_and_5xx(self):
+        throttled, failed, ok = FakeResponse(429), FakeResponse(503), FakeResponse(200)
+        self.outcomes = [throttled, failed, ok]
+        response = self.client.post('http://llm/v1/chat', timeout=30, json={'a': 1})
+        self.assertIs(response, ok)
+        self.assertEqual(response.attempts, 3)
+        self.assertEqual(self.calls, [('http://llm/v1/chat', 30, {'json': {'a': 1}})] * 3)
+        self.assertTrue(throttled.closed and failed.closed)
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+        stats = self.client.stats()
+        self.assertEqual((stats['calls'], stats['retries'], stats['errors']), (1, 2, 0))
+        self.assertEqual(stats['status'], {'200': 1})
+        self.assertEqual(stats['latency_ms']['window'], 1)
+
+    def test_retry_after_header(self):
+        self.outcomes = [FakeResponse(429, {'Retry-After': '3'}), FakeResponse(429, {'Retry-After': '60'}),
+                         FakeResponse(200)]
+        self.client.post('http://llm', timeout=5)
+        self.assertEqual(self.sleeps, [3.0, 8])
+
+    def test_client_error_not_retried(self):
+        self.outcomes = [FakeResponse(400)]
+        response = self.client.post('http://llm', timeout=5)
+        self.assertEqual((response.status_code, response.attempts), (400, 1))
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(self.client.stats()['errors'], 1)
+
+    def test_gives_up_after_max_retries(self):
+        last = FakeResponse(502)
+        self.outcomes = [FakeResponse(500), FakeResponse(502), last]
+        response = self.client.post('http://llm', timeout=5)
+        self.assertIs(response, last)
+        self.assertFalse(last.closed)
+        self.assertEqual((response.attempts, len(self.calls), len(self.sleeps)), (3, 3, 2))
+        self.assertEqual(self.client.stats()['status'], {'502': 1})
+
+    def test_connection_error_reraised_after_retries(self):
+        self.outcomes = [requests.exceptions.ConnectionError('reset')] * 3
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.client.post('http://llm', timeout=5)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(self.client.stats()['status'], {'exception': 1})
+
+    def test_read_timeout_not_retried(self):
+        self.outcomes = [requests.exceptions.ReadTimeout('slow'), FakeResponse(200)]
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            self.client.post('http://llm', timeout=5)
+        self.assertEqual(len(self.calls), 1)
+
+
+class FakeStreamResponse:
+    def __init__(self, lines):
+        self.lines = lines
+        self.consumed = 0
+        self.encoding = None
+
+    def iter_lines(self, decode_unicode=False):
+        for line in self.lines:
+            self.consumed += 1
+            yield line
+
+
+def sse(delta, finish_reason=None, usage=None):
+    chunk = {'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+    if usage:
+        chunk['usage'] = usage
+    return 'data: ' + json.dumps(chunk, ensure_ascii=False)
+
+
+class ReadChatStreamTests(SimpleTestCase):
+    """流式响应拼回非流式结构"""
+
+    def test_content_deltas(self):
+        response = FakeStreamResponse([
+            ': keepalive', '',
+            sse({'role': 'assistant', 'content': '平均'}),
+            sse({'content': '值为 '}),
+            sse({'content': '1.5'}, 'stop', {'total_tokens': 12}),
+            'data: [DONE]',
+        ])
+        deltas = []
+        result = read_chat_stream(response, deltas.append)
+        self.assertEqual(response.encoding, 'utf-8')
+        self.assertEqual(deltas, ['平均', '值为 ', '1.5'])
+        self.assertEqual(result, {
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': '平均值为 1.5'},
+                         'finish_reason': 'stop'}],
+            'usage': {'total_tokens': 12},
+        })
+
+    def test_tool_call_fragments_reassembled(self):
+        response = FakeStreamResponse([
+            sse({'tool_calls': [{'index': 0, 'id': 'call_a', 'type': 'function',
+                                 'function': {'name': 'get_', 'arguments': ''}}]}),
+            sse({'tool_calls': [{'index': 0, 'function': {'name': 'schema', 'arguments': '{"col'}}]}),
+            sse({'tool_calls': [{'index': 1, 'id': 'call_b', 'function': {'name': 'run_aggregation'}}]}),
+            sse({'tool_calls': [{'index': 0, 'function': {'arguments': 'lection":"sensor_data"}'}}]}),
+            sse({'tool_calls': [{'index': 1, 'function': {'arguments': '{"pipeline":[]}'}}]}),
+            sse({}, 'tool_calls'),
+            'data: [DONE]',
+        ])
+        deltas = []
+        message = read_chat_stream(response, deltas.append)['choices'][0]
+        self.assertEqual(deltas, [])
+        self.assertEqual(message['finish_reason'], 'tool_calls')
+        self.assertEqual(message['message']['tool_calls'], [
+            {'id': 'call_a', 'type': 'function',
+             'function': {'name': 'get_schema', 'arguments': '{"collection":"sensor_data"}'}},
+            {'id': 'call_b', 'type': 'function',
+             'function': {'name': 'run_aggregation', 'arguments': '{"pipeline":[]}'}},
+        ])
+        self.assertEqual(json.loads(message['message']['tool_calls'][0]['function']['arguments']),
+                         {'collection': 'sensor_data'})
+
+    def test_body_consumed_after_done(self):
+        lines = [sse({'content': 'ok'}), 'data: [DONE]', '', 'data: {not json']
+        response = FakeStreamResponse(lines)
+        result = read_chat_stream(response)
+        self.assertEqual(result['choices'][0]['message']['content'], 'ok')
+        self.assertEqual(response.consumed, len(lines))
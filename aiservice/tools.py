@@ -8,28 +8,15 @@ from pymongo.errors import PyMongoError
 
 # 使用现有的MongoEngine连接，但这里用pymongo进行聚合查询
 from mongoengine import connect
-from dataservice.models import SensorData
+from dataservice import latest_cache, rollups
+
+from . import cache as agg_cache
+from . import cost
+from dataservice.models import SensorData, SENSOR_FIELD_CATEGORIES
 
 class ToolError(Exception):
     pass
 
-# 数据字段分类配置
-SENSOR_FIELD_CATEGORIES = {
-    "负荷": ["LDC_1", "LDC_2", "LDC_3", "LDC_4"],
-    "五抽压力": ["S5_01", "S5_02", "S5_0301", "S5_0302", "S5_0401", "S5_0402"],
-    "累计热量": ["HEATSUP_TOTAL_HG", "HEATSUP_TOTAL_STC", "HEATSUP_TOTAL_NH", "STEAMSUP_TOTAL_YC"],
-    "供水流量": ["FEED_FLOW_HG", "FEED_FLOW_STC", "FEED_FLOW_NH"],
-    "回水流量": ["BACK_FLOW_HG", "BACK_FLOW_STC", "BACK_FLOW_NH"],
-    "供水压力": ["FEED_P_HG", "FEED_P_STC", "FEED_P_NH"],
-    "回水压力": ["BACK_P_HG", "BACK_P_STC", "BACK_P_NH"],
-    "实时热量": ["HEATNOW_HG", "HEATNOW_STC", "HEATNOW_NH"],
-    "供水温度": ["FEED_T_HG", "FEED_T_STC", "FEED_T_NH"],
-    "回水温度": ["BACK_T_HG", "BACK_T_STC", "BACK_T_NH"],
-    "疏水流量": ["DRAIN_BH_03", "DRAIN_BH_04", "DRAIN_NH_03", "DRAIN_NH_04"],
-    "补水流量": ["MAKEUP_BH_N", "MAKEUP_BH_E", "MAKEUP_NH_N", "MAKEUP_NH_E"],
-    "海淡抽汽": ["U1_FLOW", "U2_FLOW", "U3_FLOW", "U4_FLOW", "U5_FLOW", "U6_FLOW", "U7_FLOW", "U8_FLOW"]
-}
-
 FIELD_DESCRIPTIONS = {
     "timestamp": "数据采集时间戳（10秒间隔）",
     "LDC_1": "1号机组负荷(MW)",
@@ -126,8 +113,7 @@ def describe_schema(collection: Optional[str] = None) -> Dict[str, Any]:
             
             # 取最新一条数据作为示例
             try:
-                sample = SensorData.objects().order_by('-timestamp').limit(1).first()
-                sample_dict = sample.to_mongo().to_dict() if sample else {}
+                sample_dict = latest_cache.get_latest_row() or {}
                 # 转换ObjectId为字符串
                 if '_id' in sample_dict:
                     sample_dict['_id'] = str(sample_dict['_id'])
@@ -151,6 +137,93 @@ def describe_schema(collection: Optional[str] = None) -> Dict[str, Any]:
             
     return {"collections": allowed}
 
+# run_aggregation 的数据来源：auto 自动选择；raw 原始数据；minute/hour 直接读取对应汇总
+AGGREGATION_SOURCES = ("auto", "raw", "minute", "hour")
+# auto 模式下分钟汇总再按多少分钟分组（与原来原始数据的5分钟采样一致）
+AUTO_SAMPLE_MINUTES = 5
+# 汇总文档的字段值是桶内均值，只有对它再取 $avg 结果不变；其余累加器（$sum/$count/$min/$max/$first/$last ...）
+# 以及计数类阶段会得到错误的总数、条数或极值，auto 模式改用原始数据
+MEAN_SAFE_ACCUMULATORS = ("$avg",)
+COUNTING_STAGES = ("$count", "$sortByCount")
+# 窗口/分桶规格中不是累加器的键
+NON_ACCUMULATOR_KEYS = ("window",)
+
+
+def _accumulator_specs(stage: Dict[str, Any]) -> Optional[List[Any]]:
+    """返回阶段中的累加器规格列表；不含累加器的阶段返回 None"""
+    if isinstance(stage.get("$group"), dict):
+        return [v for k, v in stage["$group"].items() if k != "_id"]
+    for name in ("$bucket", "$bucketAuto", "$setWindowFields"):
+        body = stage.get(name)
+        if isinstance(body, dict):
+            output = body.get("output")
+            if not output:
+                # $bucket/$bucketAuto 未指定 output 时默认输出 count
+                return [{"$sum": 1}] if name != "$setWindowFields" else []
+            return list(output.values()) if isinstance(output, dict) else [output]
+    return None
+
+
+def _needs_raw_precision(pipeline: List[Dict[str, Any]]) -> bool:
+    for stage in pipeline:
+        if not isinstance(stage, dict):
+            continue
+        if any(name in stage for name in COUNTING_STAGES):
+            return True
+        for spec in _accumulator_specs(stage) or []:
+            if not isinstance(spec, dict):
+                return True
+            if any(op not in MEAN_SAFE_ACCUMULATORS for op in spec if op not in NON_ACCUMULATOR_KEYS):
+                return True
+    return False
+
+
+def _bucket_avg_group(unit: str, bin_size: int = 1) -> Dict[str, Any]:
+    """按时间桶对各字段取均值，输出与原始文档同结构的 {_id, timestamp, 字段...}"""
+    trunc = {"date": "$timestamp", "unit": unit}
+    if bin_size > 1:
+        trunc["binSize"] = bin_size
+    group: Dict[str, Any] = {"_id": {"$dateTrunc": trunc}}
+    for f in rollups.ROLLUP_FIELDS:
+        group[f] = {"$avg": f"${f}"}
+    return {"$group": group}
+
+
+def _rollup_source_stages(granularity: str, tr: Dict[str, dt.datetime], bin_minutes: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    生成读取汇总集合的前置阶段：汇总文档改写为 {timestamp, 字段: 桶均值}，
+    水位之后尚未汇总的部分用 $unionWith 从原始数据按同样粒度补齐；
+    汇总覆盖不到起点（早于最早的汇总桶或不早于水位）时返回 None。
+    """
+    watermark = rollups.get_state(granularity).get("watermark")
+    if watermark is None or watermark <= tr["start"]:
+        return None
+    earliest = rollups.coverage_start(granularity)
+    if earliest is None or rollups.floor_time(tr["start"], granularity) < earliest:
+        return None
+    split = min(watermark, tr["end"])
+    reshape: Dict[str, Any] = {"_id": "$timestamp", "timestamp": "$timestamp"}
+    for f in rollups.ROLLUP_FIELDS:
+        reshape[f] = f"${f}_avg"
+    stages: List[Dict[str, Any]] = [
+        {"$match": {"timestamp": {"$gte": tr["start"], "$lt": split}}},
+        {"$replaceWith": reshape},
+    ]
+    if watermark <= tr["end"]:
+        stages.append({"$unionWith": {
+            "coll": SensorData._get_collection().name,
+            "pipeline": [
+                {"$match": {"timestamp": {"$gte": split, "$lte": tr["end"]}}},
+                _bucket_avg_group(granularity),
+                {"$set": {"timestamp": "$_id"}},
+            ],
+        }})
+    if bin_minutes > 1:
+        stages.extend([_bucket_avg_group("minute", bin_minutes), {"$set": {"timestamp": "$_id"}}])
+    stages.append({"$sort": {"timestamp": 1}})
+    return stages
+
+
 def run_aggregation(
     collection: str,
     pipeline: List[Dict[str, Any]],
@@ -158,11 +231,23 @@ def run_aggregation(
     projection: Optional[Dict[str, int]] = None,
     time_range: Optional[Dict[str, str]] = None,
     time_field: str = "timestamp",
-    sample_interval: Optional[int] = None
+    sample_interval: Optional[int] = None,
+    source: str = "auto"
 ) -> Dict[str, Any]:
+    """
+    source 决定数据来源：
+    - auto：预估超过50条时读取分钟汇总并按5分钟取均值（原来为原始数据每5分钟取第一条）；
+      样本很少、管道包含 $avg 以外的累加器（$sum/$count/$min/$max/$first/$last 等）或计数阶段、
+      汇总尚未覆盖该时间段（早于最早的汇总桶或晚于水位）时使用原始数据
+    - raw：原始数据（超过50条时每5分钟取第一条）
+    - minute / hour：逐条返回分钟/小时汇总（字段值为桶内均值）
+    返回结果中的 source 说明实际使用的数据来源。
+    """
     ensure_collection_allowed(collection)
     if not isinstance(pipeline, list):
         raise ToolError("pipeline must be a list of stages")
+    if source not in AGGREGATION_SOURCES:
+        raise ToolError(f"source must be one of {', '.join(AGGREGATION_SOURCES)}")
 
     # 强制 limit 上限（针对高频数据降低默认值）
     max_docs = getattr(settings, 'AGENT_MAX_DOCS', 5000)
@@ -176,6 +261,7 @@ def run_aggregation(
             final_pipeline: List[Dict[str, Any]] = [
                 {"$match": {time_field: {"$gte": tr["start"], "$lte": tr["end"]}}}
             ]
+            source_info: Dict[str, Any] = {"collection": collection, "granularity": "raw", "reason": ""}
 
             # 2) 清理用户管道中对 timestamp 的字符串/自定义匹配，避免与后端冲突
             sanitized_pipeline: List[Dict[str, Any]] = []
@@ -194,12 +280,51 @@ def run_aggregation(
                         continue
                 sanitized_pipeline.append(stage)
 
+            # 只有缓存键使用对齐到时间桶的起止时间（滑动窗口类查询在同一个桶内命中同一条缓存），查询本身使用原始区间
+            key_range = agg_cache.snap_time_range(tr)
+            cache_key = agg_cache.make_key(
+                collection=collection, pipeline=sanitized_pipeline, projection=projection, limit=limit,
+                start=key_range["start"], end=key_range["end"], time_field=time_field, source=source,
+            )
+            cached = agg_cache.get(cache_key)
+            if cached is not None:
+                cached["cache"] = {"hit": True, "key": cache_key[:16]}
+                return cached
+
             # 自动数据采样：对于高频数据（10秒采集），自动按5分钟采样
             time_span_seconds = (tr["end"] - tr["start"]).total_seconds()
             estimated_records = int(time_span_seconds / 10)  # 10秒采集一次
 
+            # 选择数据来源：能用汇总时改写为读取分钟/小时汇总集合
+            rollup_stages = None
+            granularity = source
+            if source == "auto":
+                granularity = "minute"
+                if estimated_records <= 50:
+                    source_info["reason"] = "样本较少，直接读取原始数据"
+                elif _needs_raw_precision(sanitized_pipeline):
+                    source_info["reason"] = "管道包含 $avg 以外的累加器或计数阶段，需要原始数据精度"
+                elif time_field != "timestamp":
+                    source_info["reason"] = "汇总只支持 timestamp 时间字段"
+            if granularity in ("minute", "hour") and not source_info["reason"]:
+                bin_minutes = AUTO_SAMPLE_MINUTES if source == "auto" else 1
+                rollup_stages = _rollup_source_stages(granularity, tr, bin_minutes)
+                if rollup_stages is None:
+                    source_info["reason"] = f"{granularity} 汇总尚未覆盖该时间段，改用原始数据"
+                else:
+                    source_info = {
+                        "collection": rollups.ROLLUP_COLLECTIONS[granularity],
+                        "granularity": f"{AUTO_SAMPLE_MINUTES}min" if bin_minutes > 1 else granularity,
+                        "value": "bucket_avg",
+                        "reason": "读取汇总集合，水位之后的数据由原始数据补齐",
+                    }
+            elif source == "raw":
+                source_info["reason"] = "指定使用原始数据"
+
+            if rollup_stages is not None:
+                final_pipeline = rollup_stages
             # 如果预估记录数超过50条，自动进行5分钟级采样
-            if estimated_records > 50:
+            elif estimated_records > 50:
                 # 在分组前按时间升序排序，确保 $first 语义稳定
                 # 仅当用户未显式排序时添加
                 has_user_sort = any(isinstance(st, dict) and "$sort" in st for st in sanitized_pipeline)
@@ -270,7 +395,30 @@ def run_aggregation(
                 final_pipeline.append({"$project": projection})
 
             # 执行聚合查询
-            collection_obj = SensorData._get_collection()
+            if rollup_stages is not None:
+                from mongoengine.connection import get_db
+                collection_obj = get_db()[source_info["collection"]]
+            else:
+                collection_obj = SensorData._get_collection()
+
+            # 执行前成本检查：auto 且只含 $avg 的查询超出预算时改读小时汇总（结果仍是均值），
+            # 指定了数据来源、需要原始数据精度、仍超出或包含写入阶段时拒绝并返回提示
+            cost_report = cost.preflight(collection_obj, final_pipeline)
+            if not cost_report["ok"]:
+                if (cost_report.get("reason") == "over_budget" and source == "auto" and time_field == "timestamp"
+                        and not _needs_raw_precision(sanitized_pipeline)):
+                    rewritten = run_aggregation(
+                        collection, pipeline, limit, projection, time_range, time_field, sample_interval, source="hour"
+                    )
+                    if rewritten.get("ok"):
+                        rewritten["cost"] = dict(rewritten.get("cost") or {}, rewritten_from={
+                            "source": source, "cost": cost_report["cost"], "estimated_docs": cost_report["estimated_docs"],
+                        })
+                        rewritten.pop("cache", None)
+                        agg_cache.put(cache_key, rewritten)
+                    return rewritten
+                return cost.rejection(cost_report, source_info)
+
             timeout_ms = getattr(settings, 'AGENT_TIMEOUT_S', 20) * 1000
             data = list(collection_obj.aggregate(
                 final_pipeline, 
@@ -293,10 +441,12 @@ def run_aggregation(
                     "end": tr["end"].isoformat()
                 }
 
-            return {
+            result = {
                 "ok": True,
                 "count": len(data),
                 "data": data,
+                "source": source_info,
+                "cost": cost_report,
                 "pipeline": final_pipeline,
                 "time_range": time_range_info,
                 "estimated_total_records": int((tr["end"] - tr["start"]).total_seconds() / 10) if tr else 0,
@@ -313,6 +463,9 @@ def run_aggregation(
                     "data_exists": len(data) > 0
                 }
             }
+            agg_cache.put(cache_key, result)
+            result["cache"] = {"hit": False, "key": cache_key[:16]}
+            return result
         else:
             return {"ok": False, "error": f"Collection {collection} not implemented yet"}
             
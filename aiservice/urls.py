@@ -1,8 +1,11 @@
 from django.urls import path
-from .api.chat import AgentAskView
+from .api.chat import AgentAskView, AgentAskStreamView, AgentCacheStatsView, AgentLLMStatsView
 
 urlpatterns = [
 
     # 新的Agent接口
     path('agent/ask/', AgentAskView.as_view(), name='agent_ask'),
+    path('agent/ask/stream/', AgentAskStreamView.as_view(), name='agent_ask_stream'),
+    path('agent/cache/stats/', AgentCacheStatsView.as_view(), name='agent_cache_stats'),
+    path('agent/llm/stats/', AgentLLMStatsView.as_view(), name='agent_llm_stats'),
 ]
@@ -0,0 +1,55 @@
+"""
+列式 JSON 输出（?format=columnar）。
+
+行式结果每个点都重复全部字段名和格式化的时间字符串；列式结果为
+    {"timestamps": [epoch_ms, ...], "fields": {"LDC_1": [...], ...}}
+直接从 pymongo 游标/行字典逐行追加到各列数组，不经过序列化器，字段名只出现一次。
+
+数据库中的 timestamp 为按 settings.TIME_ZONE 记录的本地时间（naive），换算毫秒时间戳时按该时区解释，
+前端可直接 new Date(ms)。
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from django.utils import timezone
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MS = timedelta(milliseconds=1)
+
+
+class EpochConverter:
+    """naive 本地时间 -> 毫秒时间戳；时区偏移按小时缓存，避免逐行 make_aware"""
+
+    def __init__(self):
+        self._tz = timezone.get_default_timezone()
+        self._offsets: Dict[int, int] = {}
+
+    def __call__(self, ts: Optional[datetime]) -> Optional[int]:
+        if ts is None:
+            return None
+        if ts.tzinfo is not None:
+            return (ts.replace(tzinfo=None) - ts.utcoffset() - EPOCH) // ONE_MS
+        key = ts.toordinal() * 24 + ts.hour
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._offsets[key] = timezone.make_aware(ts, self._tz).utcoffset() // ONE_MS
+        return (ts - EPOCH) // ONE_MS - offset
+
+
+def build_columns(rows: Iterable[Dict[str, Any]], fields: Sequence[str], include_id: bool = False) -> Dict[str, Any]:
+    """把行字典（pymongo 文档或 get_timeseries 结果）转换为列式结构"""
+    to_epoch = EpochConverter()
+    timestamps: List[Optional[int]] = []
+    ids: List[str] = []
+    columns: Dict[str, List[Any]] = {f: [] for f in fields}
+    appenders = [(f, columns[f].append) for f in fields]
+    for row in rows:
+        timestamps.append(to_epoch(row.get('timestamp')))
+        if include_id:
+            ids.append(str(row.get('_id', row.get('id', ''))))
+        for f, append in appenders:
+            append(row.get(f))
+    result: Dict[str, Any] = {'timestamps': timestamps, 'fields': columns}
+    if include_id:
+        result['ids'] = ids
+    return result
@@ -0,0 +1,114 @@
+"""
+时序数据降采样（用于图表：点数与屏幕像素同量级即可，峰谷必须保留）。
+
+- lttb：Largest-Triangle-Three-Buckets，每个桶选与前一选中点、下一桶均值构成三角形面积最大的点，
+  曲线形状保持最好；桶均值用 reduceat 一次算出，每个桶内的面积计算向量化
+- minmax：每个桶保留最小值与最大值两个点，尖峰一定保留，适合告警/巡检类图表
+
+多个字段时每个字段分别选点后取并集，每个字段的点数预算为 max_points // 字段数，
+因此返回行数不超过 max_points；某字段在被其他字段选中的行上保留原值。
+每个字段至少需要 MIN_POINTS_PER_FIELD 个点（首尾加一个中间点），max_points 小于 字段数×3 的请求被拒绝。
+"""
+from datetime import datetime
+from typing import List, Sequence
+
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+MIN_POINTS_PER_FIELD = 3
+
+
+def check_budget(max_points: int, field_count: int):
+    """max_points 不足以给每个字段分配 MIN_POINTS_PER_FIELD 个点时抛出 ValueError"""
+    if max_points > 0 and field_count and max_points < MIN_POINTS_PER_FIELD * field_count:
+        raise ValueError(
+            f'max_points 至少为字段数×{MIN_POINTS_PER_FIELD}（{field_count} 个字段需要 '
+            f'{MIN_POINTS_PER_FIELD * field_count}），请减少字段或增大 max_points'
+        )
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """返回 LTTB 选中点的下标（升序，含首尾点）"""
+    n = len(x)
+    if n_out >= n or n <= 2:
+        return np.arange(n)
+    n_out = max(n_out, 3)
+    # 首尾点单独保留，中间 n-2 个点分为 n_out-2 个桶：[edges[i], edges[i+1])
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 1 < n_out - 2:
+            next_x, next_y = avg_x[i + 1], avg_y[i + 1]
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def _first_match(values: np.ndarray, targets: np.ndarray, bucket_ids: np.ndarray) -> np.ndarray:
+    """每个桶中第一个等于该桶目标值的下标"""
+    matched = np.flatnonzero(values == targets[bucket_ids])
+    _, first = np.unique(bucket_ids[matched], return_index=True)
+    return matched[first]
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """返回每个桶最小值、最大值所在下标（升序，含首尾点）"""
+    n = len(y)
+    if n_out >= n or n <= 2:
+        return np.arange(n)
+    if n_out < 4:
+        # 预算不够一个桶的最小值+最大值：只保留首尾与最大值
+        return np.unique([0, n - 1, int(np.argmax(y))])
+    buckets = (n_out - 2) // 2
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    bucket_ids = np.repeat(np.arange(buckets), np.diff(edges))
+    mins = np.minimum.reduceat(y, edges[:-1])
+    maxs = np.maximum.reduceat(y, edges[:-1])
+    picked = np.concatenate((
+        [0, n - 1],
+        _first_match(y, mins, bucket_ids),
+        _first_match(y, maxs, bucket_ids),
+    ))
+    return np.unique(picked)
+
+
+def _epoch_ms(timestamps: Sequence[datetime]) -> np.ndarray:
+    return np.array(timestamps, dtype='datetime64[ms]').astype(np.int64).astype(np.float64)
+
+
+def downsample(rows: List[dict], fields: List[str], max_points: int, method: str = 'lttb') -> List[dict]:
+    """
+    对 get_timeseries 返回的行（{timestamp, field1, ...}）降采样到不超过 max_points 行，保持原有顺序。
+    空值不参与选点。
+    """
+    if method not in METHODS:
+        raise ValueError(f'不支持的降采样方法: {method}')
+    check_budget(max_points, len(fields))
+    if max_points <= 0 or len(rows) <= max_points or not fields:
+        return rows
+
+    budget = max_points // len(fields)
+    x = _epoch_ms([row['timestamp'] for row in rows])
+    keep = np.zeros(len(rows), dtype=bool)
+    for f in fields:
+        y = np.array([row[f] for row in rows], dtype=np.float64)  # None -> nan
+        valid = np.flatnonzero(~np.isnan(y))
+        if len(valid) == 0:
+            continue
+        if method == 'lttb':
+            picked = lttb_indices(x[valid], y[valid], budget)
+        else:
+            picked = minmax_indices(y[valid], budget)
+        keep[valid[picked]] = True
+    return [rows[i] for i in np.flatnonzero(keep)]
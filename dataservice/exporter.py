@@ -0,0 +1,259 @@
+"""
+传感器数据流式导出（CSV / Parquet / Arrow IPC stream）。
+
+直接遍历 pymongo 游标（带投影与 batch_size），逐行格式化为 CSV，不构建 SensorData 对象；
+以生成器配合 StreamingHttpResponse 分块输出，可选 gzip 压缩，内存占用与导出行数无关。
+
+Parquet / Arrow 需要安装 pyarrow（可选依赖）：游标按 EXPORT_ARROW_BATCH_ROWS 行累积为列数组，
+每批写成一个 row group / record batch 后立即输出，内存只与批大小有关；
+数值保留原值（空值为 null），时间为毫秒精度的时间戳，按时间升序导出。
+"""
+import csv
+import io
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from django.conf import settings
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 可选依赖，未安装时只支持 CSV
+    pa = None
+    pq = None
+
+from . import storage
+from .importer import CSV_FIELD_LABELS
+from .models import SENSOR_FIELDS
+
+# 派生列：海淡抽汽流量总和
+FLOW_SUM_COLUMN = 'U_FLOW_SUM'
+FLOW_FIELDS = tuple(f'U{i}_FLOW' for i in range(1, 9))
+
+COLUMN_LABELS = dict(CSV_FIELD_LABELS, id='ID', **{FLOW_SUM_COLUMN: '海淡抽汽流量总和(T/H)'})
+
+# 默认导出列（与历史版本的 21 列一致）
+DEFAULT_COLUMNS = ('id', 'timestamp') + tuple(f for f in CSV_FIELD_LABELS if f != 'timestamp') + (FLOW_SUM_COLUMN,)
+
+ROWS_PER_CHUNK = 1000
+
+# file_format -> (Content-Type, 扩展名)
+ARROW_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+# Arrow IPC 只支持这两种压缩
+IPC_COMPRESSIONS = ('lz4', 'zstd')
+
+
+def available_columns() -> List[str]:
+    return ['id', 'timestamp'] + list(SENSOR_FIELDS) + [FLOW_SUM_COLUMN]
+
+
+def arrow_default_columns() -> List[str]:
+    """Parquet/Arrow 默认导出的列：不含派生列，分析时可自行计算"""
+    return ['id', 'timestamp'] + list(SENSOR_FIELDS)
+
+
+def parse_columns(value: Optional[str], default: Optional[Sequence[str]] = None) -> List[str]:
+    """解析逗号分隔的列名；为空时使用 default（默认为 DEFAULT_COLUMNS），含未知列名时抛出 ValueError"""
+    if not value:
+        return list(default or DEFAULT_COLUMNS)
+    allowed = set(available_columns())
+    columns = [c.strip() for c in value.split(',') if c.strip()]
+    unknown = [c for c in columns if c not in allowed]
+    if unknown:
+        raise ValueError(f'未知的列: {", ".join(unknown)}')
+    return columns
+
+
+def _projection_fields(columns: Sequence[str]) -> List[str]:
+    fields = []
+    for column in columns:
+        if column == FLOW_SUM_COLUMN:
+            fields.extend(FLOW_FIELDS)
+        elif column in SENSOR_FIELDS:
+            fields.append(column)
+    return list(dict.fromkeys(fields))
+
+
+def _row_formatter(columns: Sequence[str]):
+    """预先生成每列的取值函数，逐行只做字典取值（空值/0 输出为空，与历史导出一致）"""
+    getters = []
+    for column in columns:
+        if column == 'id':
+            getters.append(lambda doc: str(doc['_id']))
+        elif column == 'timestamp':
+            getters.append(lambda doc: doc['timestamp'].strftime('%Y-%m-%d %H:%M:%S') if doc.get('timestamp') else '')
+        elif column == FLOW_SUM_COLUMN:
+            def flow_sum(doc):
+                total = sum((doc.get(f) or 0) for f in FLOW_FIELDS)
+                return round(total, 2) if total > 0 else ''
+            getters.append(flow_sum)
+        else:
+            getters.append(lambda doc, f=column: doc.get(f) or '')
+    return lambda doc: [get(doc) for get in getters]
+
+
+def iter_csv(match: Dict[str, Any],
+             columns: Sequence[str],
+             gzip: bool = False,
+             batch_size: Optional[int] = None) -> Iterator[bytes]:
+    """按时间倒序导出，产出编码后的字节块"""
+    batch_size = batch_size or getattr(settings, 'EXPORT_BATCH_SIZE', 2000)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    format_row = _row_formatter(columns)
+
+    def take() -> bytes:
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    # 添加BOM以支持Excel正确显示中文
+    buffer.write('\ufeff')
+    writer.writerow([COLUMN_LABELS.get(c, c) for c in columns])
+
+    cursor = storage.find_rows(match, fields=_projection_fields(columns), batch_size=batch_size)
+    try:
+        pending = 0
+        for doc in cursor:
+            writer.writerow(format_row(doc))
+            pending += 1
+            if pending >= ROWS_PER_CHUNK:
+                chunk = take()
+                if chunk:
+                    yield chunk
+                pending = 0
+        chunk = take()
+        if compressor:
+            chunk += compressor.flush()
+        if chunk:
+            yield chunk
+    finally:
+        cursor.close()
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的输出流：pyarrow 写入的字节暂存在这里，由生成器取走后输出"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def arrow_compression(file_format: str) -> Optional[str]:
+    """
+    EXPORT_ARROW_COMPRESSION 转换为写入参数：Parquet 原样使用（空值为 'none'）；
+    Arrow IPC 只接受 lz4/zstd，'none'、空值与其他算法都按不压缩（None）处理
+    """
+    value = (getattr(settings, 'EXPORT_ARROW_COMPRESSION', 'zstd') or 'none').strip().lower()
+    if file_format == 'parquet':
+        return value
+    return value if value in IPC_COMPRESSIONS else None
+
+
+def arrow_schema(columns: Sequence[str]):
+    types = []
+    for column in columns:
+        if column == 'id':
+            types.append(pa.field(column, pa.string()))
+        elif column == 'timestamp':
+            types.append(pa.field(column, pa.timestamp('ms')))
+        else:
+            types.append(pa.field(column, pa.float64()))
+    return pa.schema(types)
+
+
+def _arrow_value_getters(columns: Sequence[str]):
+    getters = []
+    for column in columns:
+        if column == 'id':
+            getters.append(lambda doc: str(doc['_id']))
+        elif column == FLOW_SUM_COLUMN:
+            def flow_sum(doc):
+                values = [doc.get(f) for f in FLOW_FIELDS]
+                values = [v for v in values if v is not None]
+                return sum(values) if values else None
+            getters.append(flow_sum)
+        else:
+            getters.append(lambda doc, f=column: doc.get(f))
+    return getters
+
+
+def iter_arrow(match: Dict[str, Any],
+               columns: Sequence[str],
+               file_format: str = 'parquet',
+               batch_size: Optional[int] = None) -> Iterator[bytes]:
+    """按时间升序导出为 Parquet 或 Arrow IPC stream，产出字节块"""
+    if pa is None:
+        raise ValueError('导出 Parquet/Arrow 需要安装 pyarrow')
+    if file_format not in ARROW_FORMATS:
+        raise ValueError(f'不支持的导出格式: {file_format}')
+    rows_per_batch = batch_size or getattr(settings, 'EXPORT_ARROW_BATCH_ROWS', 65536)
+    compression = arrow_compression(file_format)
+    schema = arrow_schema(columns)
+    getters = _arrow_value_getters(columns)
+
+    sink = _ChunkSink()
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression=compression)
+
+        def write(batch):
+            # 每批一个 row group
+            writer.write_table(pa.Table.from_batches([batch]))
+    else:
+        writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+        write = writer.write_batch
+
+    def to_batch(values: List[List[Any]]):
+        return pa.record_batch([pa.array(v, type=f.type) for v, f in zip(values, schema)], schema=schema)
+
+    cursor = storage.find_rows(
+        match, fields=_projection_fields(columns), sort=[('timestamp', 1)],
+        batch_size=getattr(settings, 'EXPORT_BATCH_SIZE', 2000),
+    )
+    try:
+        values: List[List[Any]] = [[] for _ in columns]
+        appenders = [(get, column.append) for get, column in zip(getters, values)]
+        pending = 0
+        for doc in cursor:
+            for get, append in appenders:
+                append(get(doc))
+            pending += 1
+            if pending >= rows_per_batch:
+                write(to_batch(values))
+                for column in values:
+                    column.clear()
+                pending = 0
+                chunk = sink.take()
+                if chunk:
+                    yield chunk
+        if pending:
+            write(to_batch(values))
+        writer.close()
+        chunk = sink.take()
+        if chunk:
+            yield chunk
+    finally:
+        cursor.close()
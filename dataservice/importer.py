@@ -0,0 +1,156 @@
+"""
+传感器数据 CSV 流式导入。
+
+按行增量解析上传文件（不把整个文件读入内存），根据表头一次性生成“列下标 -> 字段/转换函数”表，
+逐行转换后按批无序写入（storage.insert_rows），内存占用只与批量大小有关，与文件大小无关。
+
+表头支持下载接口导出的中文列名，也支持直接使用 SensorData 字段名；
+未识别的列（如 ID、海淡抽汽流量总和等派生列）忽略。
+"""
+import csv
+import io
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from pymongo.errors import PyMongoError
+
+from . import rollups
+from .ingest import write_batch
+from .models import SENSOR_FIELDS
+
+# 字段 -> 导出 CSV 的中文列名（与 download 接口一致）
+CSV_FIELD_LABELS = {
+    'timestamp': '时间戳',
+    'LDC_1': '#1机负荷(MW)',
+    'LDC_2': '#2机负荷(MW)',
+    'LDC_3': '#3机负荷(MW)',
+    'LDC_4': '#4机负荷(MW)',
+    'S5_01': '#1机五抽压力(MPa)',
+    'S5_02': '#2机五抽压力(MPa)',
+    'S5_0301': '#3机五抽一路压力(MPa)',
+    'S5_0302': '#3机五抽二路压力(MPa)',
+    'S5_0401': '#4机五抽一路压力(MPa)',
+    'S5_0402': '#4机五抽二路压力(MPa)',
+    'HEATNOW_HG': '汉沽实时热量(GJ/H)',
+    'HEATNOW_STC': '生态城实时热量(GJ/H)',
+    'HEATNOW_NH': '宁河实时热量(GJ/H)',
+    'STEAMNOW_YC': '盐场实时流量(T/H)',
+    'HEATSUP_TOTAL_HG': '汉沽累计热量(GJ)',
+    'HEATSUP_TOTAL_STC': '生态城累计热量(GJ)',
+    'HEATSUP_TOTAL_NH': '宁河累计热量(GJ)',
+    'STEAMSUP_TOTAL_YC': '盐场累计供汽量(GJ)',
+}
+
+HEADER_ALIASES = {label: field for field, label in CSV_FIELD_LABELS.items()}
+HEADER_ALIASES.update({field: field for field in SENSOR_FIELDS})
+HEADER_ALIASES['timestamp'] = 'timestamp'
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+MAX_REPORTED_ERRORS = 100
+
+
+def parse_timestamp(value: str) -> datetime:
+    """解析 YYYY-MM-DD HH:MM:SS；fromisoformat 比 strptime 快一个数量级，失败时再按固定格式解析"""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def build_converters(header: List[str]) -> List[Tuple[int, str, Callable[[str], Any]]]:
+    """根据表头生成 (列下标, 字段名, 转换函数) 表，只包含可识别的列"""
+    converters = []
+    seen = set()
+    for index, name in enumerate(header):
+        field = HEADER_ALIASES.get(name.strip())
+        if field is None or field in seen:
+            continue
+        seen.add(field)
+        converters.append((index, field, parse_timestamp if field == 'timestamp' else float))
+    return converters
+
+
+def import_csv(binary_file, batch_size: Optional[int] = None, encoding: str = 'utf-8-sig') -> Dict[str, Any]:
+    """
+    流式导入 CSV，返回统计：
+    {rows, created, errors, skipped, rejected: [{line, error}], elapsed_s, rows_per_sec}
+    rejected 最多记录 MAX_REPORTED_ERRORS 条；line 为文件中的行号（表头为第 1 行）。
+    空行或没有任何有效值的行计入 skipped。
+    """
+    batch_size = max(1, int(batch_size or getattr(settings, 'IMPORT_BATCH_SIZE', 1000)))
+    batch_size = min(batch_size, int(getattr(settings, 'IMPORT_MAX_BATCH_SIZE', 5000)))
+    started = time.monotonic()
+    result: Dict[str, Any] = {'rows': 0, 'created': 0, 'errors': 0, 'skipped': 0, 'rejected': []}
+
+    def reject(line: int, error: str):
+        result['errors'] += 1
+        if len(result['rejected']) < MAX_REPORTED_ERRORS:
+            result['rejected'].append({'line': line, 'error': error})
+
+    earliest: List[datetime] = []
+
+    def flush(batch: List[Dict[str, Any]]):
+        written, failed = write_batch(batch)
+        result['created'] += written
+        result['errors'] += failed
+        batch_min = min(doc['timestamp'] for doc in batch)
+        earliest[:] = [min(earliest[0], batch_min)] if earliest else [batch_min]
+
+    text = io.TextIOWrapper(binary_file, encoding=encoding, newline='')
+    try:
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if not header:
+            raise ValueError('CSV文件为空')
+        converters = build_converters(header)
+        if not any(field == 'timestamp' for _, field, _ in converters):
+            raise ValueError('CSV缺少时间戳列')
+
+        batch: List[Dict[str, Any]] = []
+        for row in reader:
+            result['rows'] += 1
+            line = reader.line_num
+            doc: Dict[str, Any] = {}
+            try:
+                for index, field, convert in converters:
+                    if index < len(row):
+                        value = row[index].strip()
+                        if value:
+                            doc[field] = convert(value)
+            except ValueError as e:
+                reject(line, f'{field}: {e}')
+                continue
+
+            if not doc:
+                result['skipped'] += 1
+                continue
+            if 'timestamp' not in doc:
+                reject(line, 'timestamp: 缺少时间戳')
+                continue
+
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ValueError(f'第 {result["rows"] + 1} 行附近解析失败: {e}')
+    except PyMongoError as e:
+        raise ValueError(f'写入数据库失败（已写入 {result["created"]} 条）: {e}')
+    finally:
+        # 避免 TextIOWrapper 被回收时关闭上传文件
+        text.detach()
+        # 导入的多为历史数据：登记汇总重算（数据库异常已由上面的 except 报告）
+        if earliest:
+            try:
+                rollups.mark_dirty(earliest[0])
+            except PyMongoError:
+                pass
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    result['elapsed_s'] = round(elapsed, 3)
+    result['rows_per_sec'] = round(result['rows'] / elapsed, 1)
+    return result
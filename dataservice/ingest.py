@@ -0,0 +1,305 @@
+"""
+传感器数据批量写入器。
+
+采集端调用 add() 把采样放入内存缓冲区，后台线程按“条数达到 batch_size”或
+“距上次刷新超过 flush_interval 秒”两种条件之一，使用无序 insert_many 批量写入，
+避免每条采样一次往返和一次索引更新。close() 会在退出前把缓冲区写完。
+
+配置了本地 spool（见 spool.py）时：批次重试后仍因数据库不可用而失败、或缓冲区积压超过
+max_pending 条，数据落盘而不是丢弃/无限占用内存，数据库恢复后由回放线程写回。
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from django.conf import settings
+from pymongo.errors import AutoReconnect, BulkWriteError, ConnectionFailure, ExecutionTimeout, WTimeoutError
+from pymongo.write_concern import WriteConcern
+
+from . import latest_cache, rollups, storage
+from .spool import DiskSpool, SpoolReplayer
+
+logger = logging.getLogger(__name__)
+
+# 网络类错误可以重试：_id 在入缓冲区时已分配。document 模式下重复写入以重复键报错并被视为已写入；
+# 时间序列集合不校验 _id 唯一，重试与 spool 回放前先按 _id 去重（write_batch(dedupe=True)）；
+# bucket 模式的 $push 不是幂等的，写入结果不明时重试可能重复追加
+RETRYABLE_ERRORS = (AutoReconnect, ConnectionFailure, ExecutionTimeout, WTimeoutError)
+DUPLICATE_KEY = 11000
+
+
+def parse_write_concern(value: Any) -> Optional[WriteConcern]:
+    """
+    解析写关注配置：None/'' 表示使用连接默认值；'0'/'1'/'2' 等为节点数；其余字符串如 'majority' 原样使用
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, WriteConcern):
+        return value
+    if isinstance(value, int) or str(value).isdigit():
+        return WriteConcern(w=int(value))
+    return WriteConcern(w=str(value))
+
+
+def build_spool(directory: Optional[str] = None) -> Optional[DiskSpool]:
+    """按 settings.INGEST_SPOOL_* 创建本地 spool；目录为空表示不启用"""
+    directory = directory if directory is not None else getattr(settings, 'INGEST_SPOOL_DIR', '')
+    if not directory:
+        return None
+    return DiskSpool(
+        directory,
+        segment_bytes=int(getattr(settings, 'INGEST_SPOOL_SEGMENT_MB', 64)) * 1024 * 1024,
+        fsync_every=getattr(settings, 'INGEST_SPOOL_FSYNC_EVERY', 100),
+        fsync_interval=getattr(settings, 'INGEST_SPOOL_FSYNC_INTERVAL_S', 1.0),
+    )
+
+
+def write_batch(batch: List[Dict[str, Any]], write_concern=None, dedupe: bool = False) -> Tuple[int, int]:
+    """
+    写入一个批次，返回 (确认写入条数, 失败条数)；重复键视为此前已写入成功。
+    dedupe=True（重试或回放，批次可能已部分写入）时，timeseries 模式先跳过已存在的 _id。
+    网络类错误（RETRYABLE_ERRORS）原样抛出，由调用方决定重试或落盘。
+    """
+    skipped = 0
+    if dedupe and storage.is_timeseries_mode():
+        existing = storage.existing_row_ids(batch)
+        if existing:
+            batch = [doc for doc in batch if doc['_id'] not in existing]
+            skipped = len(existing)
+            if not batch:
+                return skipped, 0
+    written, failed = _insert_batch(batch, write_concern)
+    return written + skipped, failed
+
+
+def _insert_batch(batch: List[Dict[str, Any]], write_concern=None) -> Tuple[int, int]:
+    try:
+        return storage.insert_rows(batch, write_concern=write_concern), 0
+    except BulkWriteError as e:
+        details = e.details or {}
+        if storage.is_bucket_mode():
+            # 分桶写入的错误对应的是桶而不是采样行，保守地按整批失败计
+            logger.warning('分桶批量写入失败: %s', e)
+            return 0, len(batch)
+        errors = details.get('writeErrors') or []
+        duplicates = sum(1 for err in errors if err.get('code') == DUPLICATE_KEY)
+        failed = len(errors) - duplicates
+        if failed:
+            logger.warning('批量写入部分失败: %s 条, 首个错误: %s', failed, errors[0].get('errmsg'))
+        return details.get('nInserted', 0) + duplicates, failed
+
+
+class BufferedSensorWriter:
+    """
+    带缓冲的批量写入器，线程安全。
+
+    计数：
+    - buffered：累计进入缓冲区的采样数
+    - flushed：已确认写入的采样数
+    - failed：重试后仍写入失败的采样数
+    - retried：因网络类错误被重试的采样条数（每重试一次按批次条数累计）
+    - spooled：因数据库不可用或积压而写入本地 spool 的采样数
+    - replayed：从 spool 回放写入数据库的采样数
+    """
+
+    def __init__(self,
+                 batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 write_concern: Any = None,
+                 max_retries: Optional[int] = None,
+                 retry_backoff: float = 0.5,
+                 spool: Optional[DiskSpool] = None,
+                 max_pending: Optional[int] = None):
+        self.batch_size = max(1, int(batch_size or getattr(settings, 'INGEST_BATCH_SIZE', 100)))
+        self.flush_interval = float(flush_interval or getattr(settings, 'INGEST_FLUSH_INTERVAL_S', 10))
+        if write_concern is None:
+            write_concern = getattr(settings, 'INGEST_WRITE_CONCERN', None)
+        self.write_concern = parse_write_concern(write_concern)
+        self.max_retries = int(max_retries if max_retries is not None else getattr(settings, 'INGEST_MAX_RETRIES', 3))
+        self.retry_backoff = retry_backoff
+        self.spool = spool
+        self.max_pending = max(self.batch_size, int(max_pending or getattr(settings, 'INGEST_MAX_PENDING', 10000)))
+        self._replayer: Optional[SpoolReplayer] = None
+
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()  # 保证同一时刻只有一个批次在写
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._last_flush = time.monotonic()
+
+        self.counters = {
+            'buffered': 0, 'flushed': 0, 'failed': 0, 'retried': 0, 'batches': 0, 'spooled': 0, 'replayed': 0,
+        }
+        self.last_error: Optional[str] = None
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='sensor-ingest-writer', daemon=True)
+            self._thread.start()
+        if self.spool is not None and self._replayer is None:
+            self._replayer = SpoolReplayer(
+                self.spool,
+                self._replay_batch,
+                batch_size=max(self.batch_size, 500),
+                interval=getattr(settings, 'INGEST_SPOOL_REPLAY_INTERVAL_S', 5.0),
+            ).start()
+        return self
+
+    def close(self, timeout: Optional[float] = None):
+        """停止后台线程并把缓冲区剩余数据写完"""
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+        if self._replayer is not None:
+            self._replayer.stop(timeout)
+            self._replayer = None
+        if self.spool is not None:
+            self.spool.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def add(self, sample: Dict[str, Any]):
+        """放入缓冲区，不做任何数据库调用"""
+        if not storage.is_bucket_mode():
+            sample.setdefault('_id', ObjectId())
+        spill: List[Dict[str, Any]] = []
+        with self._lock:
+            self._buffer.append(sample)
+            self.counters['buffered'] += 1
+            if self.spool is not None and len(self._buffer) >= self.max_pending:
+                # 数据库写入跟不上：积压部分直接落盘，内存占用保持有界
+                spill, self._buffer = self._buffer, []
+            elif len(self._buffer) >= self.batch_size:
+                self._wakeup.notify()
+        if spill:
+            self._spool_batch(spill)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self) -> int:
+        """把当前缓冲区作为一个批次写入，返回确认写入的条数"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                self._last_flush = time.monotonic()
+            if not batch:
+                return 0
+            written, failed = self._write_with_retry(batch)
+            with self._lock:
+                self.counters['batches'] += 1
+                self.counters['flushed'] += written
+                self.counters['failed'] += failed
+            if written:
+                self._after_write(batch)
+            return written
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self.counters)
+            data['pending'] = len(self._buffer)
+        data['last_error'] = self.last_error
+        data['spool_pending'] = self.spool.has_pending() if self.spool is not None else False
+        return data
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._stopping:
+                    due = self._last_flush + self.flush_interval - time.monotonic()
+                    if len(self._buffer) >= self.batch_size or (self._buffer and due <= 0):
+                        break
+                    self._wakeup.wait(timeout=max(due, 0.05) if self._buffer else self.flush_interval)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception as e:  # 保证后台线程不退出
+                self.last_error = str(e)
+                logger.exception('批量写入异常')
+
+    def _write_with_retry(self, batch: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        写入一个批次，返回 (确认写入条数, 失败条数)。
+        网络类错误按指数退避重试；重试耗尽后若配置了 spool 则落盘，否则计为失败。
+        """
+        attempt = 0
+        while True:
+            try:
+                return write_batch(batch, self.write_concern, dedupe=attempt > 0)
+            except RETRYABLE_ERRORS as e:
+                self.last_error = str(e)
+                if attempt >= self.max_retries:
+                    if self.spool is not None:
+                        logger.warning('数据库不可用，%s 条写入本地 spool: %s', len(batch), e)
+                        self._spool_batch(batch)
+                        return 0, 0
+                    logger.error('批量写入失败，已重试 %s 次: %s', attempt, e)
+                    return 0, len(batch)
+                attempt += 1
+                with self._lock:
+                    self.counters['retried'] += len(batch)
+                time.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error('批量写入失败: %s', e)
+                return 0, len(batch)
+
+    def _after_write(self, batch: List[Dict[str, Any]]):
+        """
+        写入成功后的通知：把批次中最新的一条推送到最新数据缓存（分桶模式的行 _id 由读路径生成，只做失效），
+        并为早于汇总水位的迟到数据登记重算
+        """
+        try:
+            if storage.is_bucket_mode():
+                latest_cache.invalidate()
+            else:
+                latest_cache.publish(max(batch, key=lambda doc: doc['timestamp']))
+        except Exception as e:  # 缓存不可用不影响写入
+            logger.warning('更新最新数据缓存失败: %s', e)
+        try:
+            rollups.mark_dirty(min(doc['timestamp'] for doc in batch))
+        except Exception as e:
+            logger.warning('登记汇总重算失败: %s', e)
+
+    def _spool_batch(self, batch: List[Dict[str, Any]]):
+        try:
+            self.spool.append(batch)
+        except Exception as e:
+            self.last_error = f'spool 写入失败: {e}'
+            logger.error('spool 写入失败，丢弃 %s 条: %s', len(batch), e)
+            with self._lock:
+                self.counters['failed'] += len(batch)
+            return
+        with self._lock:
+            self.counters['spooled'] += len(batch)
+
+    def _replay_batch(self, batch: List[Dict[str, Any]]):
+        """spool 回放写入；网络类错误向上抛出，由回放线程保留进度稍后重试"""
+        written, failed = write_batch(batch, self.write_concern, dedupe=True)
+        with self._lock:
+            self.counters['replayed'] += written
+            self.counters['failed'] += failed
+        if written:
+            self._after_write(batch)
@@ -0,0 +1,92 @@
+"""
+最新一条传感器数据的缓存。
+
+两级缓存：
+- 进程内副本：命中时只是一次字典拷贝，不访问数据库与缓存后端
+- Django 缓存（settings.CACHES）：多进程/多实例共享；默认 LocMemCache 只在本进程内有效，
+  部署多个进程时应配置 Redis 等共享后端，采集进程的写入才能对 Web 进程可见
+
+写入路径（BufferedSensorWriter 刷新、上传/删除接口）调用 publish()/invalidate() 更新缓存；
+无论是否收到通知，任何一级缓存的数据最多保留 LATEST_CACHE_MAX_AGE_S 秒，超过即回源查询，
+以此作为陈旧度上限。
+"""
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import storage
+
+CACHE_KEY = 'sensor:latest_row'
+
+_lock = threading.Lock()
+_local: Dict[str, Any] = {'row': None, 'at': 0.0}
+_counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'publishes': 0, 'invalidations': 0}
+
+
+def max_age() -> float:
+    return float(getattr(settings, 'LATEST_CACHE_MAX_AGE_S', 5))
+
+
+def _count(name: str):
+    with _lock:
+        _counters[name] += 1
+
+
+def _remember(row: Optional[Dict[str, Any]]):
+    with _lock:
+        _local['row'] = row
+        _local['at'] = time.monotonic()
+
+
+def get_latest_row() -> Optional[Dict[str, Any]]:
+    """返回最新一行（与 sensor_data 文档同结构的字典副本），没有数据时返回 None"""
+    with _lock:
+        row, at = _local['row'], _local['at']
+    if row is not None and time.monotonic() - at < max_age():
+        _count('local_hits')
+        return dict(row)
+
+    row = cache.get(CACHE_KEY)
+    if row is not None:
+        _count('shared_hits')
+        _remember(row)
+        return dict(row)
+
+    _count('misses')
+    row = storage.latest_row()
+    if row is not None:
+        cache.set(CACHE_KEY, row, max_age())
+        _remember(row)
+        return dict(row)
+    return None
+
+
+def publish(row: Dict[str, Any]):
+    """写入路径通知有新数据；只有比缓存中更新的行才会替换（回放的历史数据不会覆盖）"""
+    current = cache.get(CACHE_KEY)
+    if current is not None and current.get('timestamp') and current['timestamp'] >= row['timestamp']:
+        return
+    cache.set(CACHE_KEY, row, max_age())
+    _remember(row)
+    _count('publishes')
+
+
+def invalidate():
+    """数据被修改或删除时清除缓存，下次读取回源"""
+    cache.delete(CACHE_KEY)
+    with _lock:
+        _local['row'] = None
+        _local['at'] = 0.0
+        _counters['invalidations'] += 1
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        data = dict(_counters)
+    reads = data['local_hits'] + data['shared_hits'] + data['misses']
+    data['hit_ratio'] = round((reads - data['misses']) / reads, 4) if reads else None
+    data['max_age_s'] = max_age()
+    return data
@@ -0,0 +1,244 @@
+"""
+实时数据推送中心（LiveHub）。
+
+进程内只有一个后台线程跟踪 sensor_data 的新数据，新采样只计算一次与上一条的差异（仅变化的字段），
+编码一次后分发给所有订阅者；连接数增加不会增加数据库查询，只增加内存中的分发。
+
+数据来源（settings.LIVE_SOURCE）：
+- auto（默认）：document 模式尝试 MongoDB change stream（需要副本集），不可用时退回轮询
+- change_stream：只使用 change stream
+- poll：按 LIVE_POLL_INTERVAL_S 轮询 timestamp 大于上次位置的新行（timeseries/bucket 模式总是轮询）
+
+订阅者是回调函数，在推送线程中被调用，必须立即返回（例如放入队列）。
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from django.conf import settings
+from pymongo.errors import PyMongoError
+
+from . import storage
+from .models import SensorData, SENSOR_FIELDS
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def row_payload(row: Dict[str, Any], fields=SENSOR_FIELDS) -> Dict[str, Any]:
+    """把数据库行转换为可 JSON 序列化的字典（时间格式与 SensorDataSerializer 一致）"""
+    data = {'id': str(row['_id']) if row.get('_id') is not None else None,
+            'timestamp': row['timestamp'].strftime(TIMESTAMP_FORMAT)}
+    for f in fields:
+        data[f] = row.get(f)
+    return data
+
+
+class LiveEvent:
+    """一条推送事件；SSE 编码结果在第一次使用时生成并被所有订阅者共享"""
+
+    __slots__ = ('name', 'data', 'event_id', '_sse')
+
+    def __init__(self, name: str, data: Dict[str, Any], event_id: Optional[str] = None):
+        self.name = name
+        self.data = data
+        self.event_id = event_id
+        self._sse: Optional[bytes] = None
+
+    def sse(self) -> bytes:
+        if self._sse is None:
+            lines = []
+            if self.event_id:
+                lines.append(f'id: {self.event_id}')
+            lines.append(f'event: {self.name}')
+            lines.append('data: ' + json.dumps(self.data, ensure_ascii=False, separators=(',', ':')))
+            self._sse = ('\n'.join(lines) + '\n\n').encode('utf-8')
+        return self._sse
+
+
+class LiveHub:
+    """单个跟踪线程 + 回调订阅者"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, Callable[[LiveEvent], None]] = {}
+        self._next_token = 1
+        self._thread: Optional[threading.Thread] = None
+        self._last_row: Optional[Dict[str, Any]] = None
+        self.counters = {'samples': 0, 'events': 0, 'dropped': 0}
+        self.source: Optional[str] = None
+
+    # ------------------------------------------------------------------
+    # 订阅
+    # ------------------------------------------------------------------
+
+    def subscribe(self, callback: Callable[[LiveEvent], None]) -> int:
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._subscribers[token] = callback
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sensor-live-hub', daemon=True)
+                self._thread.start()
+        return token
+
+    def unsubscribe(self, token: int):
+        with self._lock:
+            self._subscribers.pop(token, None)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def snapshot(self) -> Optional[LiveEvent]:
+        """当前最新一行的完整数据，供新连接的第一条消息使用"""
+        with self._lock:
+            row = self._last_row
+        if row is None:
+            row = storage.latest_row()
+        if row is None:
+            return None
+        return LiveEvent('snapshot', row_payload(row), row['timestamp'].isoformat())
+
+    def record_drop(self):
+        with self._lock:
+            self.counters['dropped'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self.counters)
+            data['subscribers'] = len(self._subscribers)
+        data['source'] = self.source
+        return data
+
+    # ------------------------------------------------------------------
+    # 跟踪与分发
+    # ------------------------------------------------------------------
+
+    def _dispatch(self, row: Dict[str, Any]):
+        with self._lock:
+            previous = self._last_row
+            if previous is not None and row['timestamp'] <= previous['timestamp']:
+                return
+            self._last_row = row
+            subscribers = list(self._subscribers.values())
+            self.counters['samples'] += 1
+
+        if previous is None:
+            event = LiveEvent('snapshot', row_payload(row), row['timestamp'].isoformat())
+        else:
+            changed = [f for f in SENSOR_FIELDS if row.get(f) != previous.get(f)]
+            event = LiveEvent('delta', row_payload(row, changed), row['timestamp'].isoformat())
+
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception('实时推送回调异常')
+        with self._lock:
+            self.counters['events'] += len(subscribers)
+
+    def _idle(self) -> bool:
+        with self._lock:
+            if not self._subscribers:
+                self._thread = None
+                return True
+        return False
+
+    def _run(self):
+        mode = getattr(settings, 'LIVE_SOURCE', 'auto')
+        if mode != 'poll' and storage.storage_mode() == storage.MODE_DOCUMENT:
+            try:
+                self._watch()
+                return
+            except PyMongoError as e:
+                if mode == 'change_stream':
+                    logger.error('change stream 不可用: %s', e)
+                    with self._lock:
+                        self._thread = None
+                    return
+                logger.info('change stream 不可用，改为轮询: %s', e)
+        self._poll()
+
+    def _watch(self):
+        self.source = 'change_stream'
+        pipeline = [{'$match': {'operationType': 'insert'}}]
+        with SensorData._get_collection().watch(pipeline, max_await_time_ms=1000) as stream:
+            while not self._idle():
+                change = stream.try_next()
+                if change is not None:
+                    self._dispatch(change['fullDocument'])
+
+    def _poll(self):
+        self.source = 'poll'
+        interval = float(getattr(settings, 'LIVE_POLL_INTERVAL_S', 2))
+        if self._last_row is None:
+            row = storage.latest_row()
+            if row is not None:
+                self._dispatch(row)
+        while not self._idle():
+            try:
+                last = self._last_row
+                match = {'timestamp': {'$gt': last['timestamp']}} if last else {}
+                rows: List[Dict[str, Any]] = list(
+                    storage.find_rows(match, sort=[('timestamp', 1)], limit=100)
+                )
+                for row in rows:
+                    self._dispatch(row)
+            except PyMongoError as e:
+                logger.warning('实时数据轮询失败: %s', e)
+            time.sleep(interval)
+
+
+_hub: Optional[LiveHub] = None
+_hub_lock = threading.Lock()
+
+
+def get_hub() -> LiveHub:
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = LiveHub()
+        return _hub
+
+
+def sse_stream(hub: Optional[LiveHub] = None, max_queue: int = 100) -> Iterator[bytes]:
+    """
+    单个 SSE 连接的输出生成器：先发送完整快照，之后只发送变化字段。
+    客户端处理过慢导致积压时清空积压、改发一条完整快照，既不阻塞推送线程，也不会让客户端状态错乱。
+    """
+    hub = hub or get_hub()
+    keepalive = float(getattr(settings, 'LIVE_KEEPALIVE_S', 15))
+    events: 'queue.Queue[LiveEvent]' = queue.Queue(maxsize=max_queue)
+
+    def on_event(event: LiveEvent):
+        try:
+            events.put_nowait(event)
+            return
+        except queue.Full:
+            pass
+        while True:
+            try:
+                events.get_nowait()
+                hub.record_drop()
+            except queue.Empty:
+                break
+        events.put_nowait(hub.snapshot() or event)
+
+    token = hub.subscribe(on_event)
+    try:
+        yield f'retry: {int(keepalive * 1000)}\n\n'.encode()
+        snapshot = hub.snapshot()
+        if snapshot is not None:
+            yield snapshot.sse()
+        while True:
+            try:
+                yield events.get(timeout=keepalive).sse()
+            except queue.Empty:
+                yield b': keepalive\n\n'
+    finally:
+        hub.unsubscribe(token)
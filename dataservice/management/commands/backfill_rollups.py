@@ -0,0 +1,127 @@
+from django.core.management.base import BaseCommand, CommandError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import time
+
+from mongoengine.connection import get_db
+
+from dataservice import rollups, storage
+
+
+CHECKPOINT_COLLECTION = 'rollup_backfill'
+
+# 各粒度默认分片天数：分片按天对齐，因此同时对齐分钟/小时/日时间桶
+DEFAULT_SHARD_DAYS = {'minute': 1, 'hour': 7, 'day': 30}
+
+
+class Command(BaseCommand):
+    help = (
+        '并行重建历史汇总：把 [start, end) 按天对齐切分为分片，用有限的线程池并发执行，'
+        '已完成的分片记录在 rollup_backfill 集合，中断后重复执行即可继续。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--granularity', type=str, choices=['minute', 'hour', 'day', 'all'], default='all',
+                            help='重建的粒度，all 表示按 分钟→小时→日 顺序全部重建')
+        parser.add_argument('--start', type=str, help='开始时间，ISO格式；默认为最早一条原始数据所在日')
+        parser.add_argument('--end', type=str, help='结束时间，ISO格式；默认为今天零点')
+        parser.add_argument('--shard-days', type=int, help='每个分片的天数，默认 minute=1 / hour=7 / day=30')
+        parser.add_argument('--workers', type=int, default=4, help='并发分片数，默认4')
+        parser.add_argument('--from-raw', action='store_true', help='小时/日级直接扫描原始数据，而不是读取下一级汇总')
+        parser.add_argument('--restart', action='store_true', help='忽略之前的断点，全部分片重新执行')
+
+    def handle(self, *args, **options):
+        start, end = self.resolve_range(options)
+        if start >= end:
+            raise CommandError('开始时间必须早于结束时间')
+
+        granularities = rollups.GRANULARITIES if options['granularity'] == 'all' else (options['granularity'],)
+        workers = max(1, options['workers'])
+        rollups.prepare()
+
+        for granularity in granularities:
+            shard_days = options['shard_days'] or DEFAULT_SHARD_DAYS[granularity]
+            failed = self.backfill(granularity, start, end, shard_days, workers, options['from_raw'], options['restart'])
+            if failed and granularity != granularities[-1]:
+                # 上级汇总读取本级结果，本级不完整时不继续
+                self.stdout.write(self.style.ERROR(f'{granularity} 存在失败分片，停止后续粒度的重建'))
+                return
+
+    def resolve_range(self, options):
+        if options.get('start'):
+            start = datetime.fromisoformat(options['start'].replace('Z', '+00:00')).replace(tzinfo=None)
+        else:
+            first = next(iter(storage.find_rows({}, fields=['timestamp'], sort=[('timestamp', 1)], limit=1)), None)
+            if first is None:
+                raise CommandError('sensor_data 中没有数据')
+            start = first['timestamp']
+        if options.get('end'):
+            end = datetime.fromisoformat(options['end'].replace('Z', '+00:00')).replace(tzinfo=None)
+        else:
+            end = rollups.floor_time(datetime.now(), 'day')
+        return rollups.floor_time(start, 'day'), end
+
+    def backfill(self, granularity, start, end, shard_days, workers, from_raw, restart):
+        checkpoints = get_db()[CHECKPOINT_COLLECTION]
+        shards = []
+        cursor = start
+        while cursor < end:
+            shard_end = min(cursor + timedelta(days=shard_days), end)
+            shards.append((cursor, shard_end))
+            cursor = shard_end
+
+        def shard_id(shard):
+            source = 'raw' if from_raw or granularity == 'minute' else 'cascade'
+            return f'{granularity}:{source}:{shard[0].isoformat()}:{shard[1].isoformat()}'
+
+        if restart:
+            checkpoints.delete_many({'granularity': granularity})
+        done = {doc['_id'] for doc in checkpoints.find({'_id': {'$in': [shard_id(s) for s in shards]}}, {'_id': 1})}
+        pending = [s for s in shards if shard_id(s) not in done]
+        self.stdout.write(
+            f'{granularity}: 共 {len(shards)} 个分片（{shard_days} 天/片），已完成 {len(done)}，待执行 {len(pending)}，并发 {workers}'
+        )
+        if not pending:
+            return 0
+
+        def run(shard):
+            shard_started = time.monotonic()
+            rollups.rollup_range(granularity, shard[0], shard[1], from_raw=from_raw)
+            elapsed = time.monotonic() - shard_started
+            checkpoints.replace_one(
+                {'_id': shard_id(shard)},
+                {'_id': shard_id(shard), 'granularity': granularity, 'start': shard[0], 'end': shard[1],
+                 'elapsed_s': round(elapsed, 3), 'finished_at': datetime.now()},
+                upsert=True,
+            )
+            return shard
+
+        started = time.monotonic()
+        completed = 0
+        failed = 0
+        span_days = 0.0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run, shard): shard for shard in pending}
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f'{granularity} 分片 {shard[0]} ~ {shard[1]} 失败: {e}'))
+                    continue
+                completed += 1
+                span_days += (shard[1] - shard[0]).total_seconds() / 86400
+                elapsed = max(time.monotonic() - started, 1e-6)
+                remaining = (len(pending) - completed - failed) * elapsed / (completed + failed)
+                self.stdout.write(
+                    f'{granularity}: {completed}/{len(pending)} 分片，{span_days / elapsed:.2f} 天数据/秒，'
+                    f'已用 {elapsed:.0f}s，预计剩余 {remaining:.0f}s'
+                )
+
+        elapsed = time.monotonic() - started
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{granularity} 完成 {completed} 个分片，失败 {failed} 个，重新执行命令即可继续'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{granularity} 重建完成：{completed} 个分片，耗时 {elapsed:.1f}s'))
+        return failed
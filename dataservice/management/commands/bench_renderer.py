@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+import time
+
+from rest_framework.renderers import JSONRenderer
+
+from dataservice import renderers
+from dataservice.management.commands.bench_serialization import generate_rows
+from dataservice.serializers import sensor_doc_to_dict
+from dataservice.views import HOURLY_CHART_FIELDS
+
+
+class Command(BaseCommand):
+    help = (
+        '对比 DRF JSONRenderer 与 FastJSONRenderer 渲染 list（一页）与 hourly_data 响应的耗时，'
+        '并校验两者解析后的内容一致'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='list 响应的行数，默认1000')
+        parser.add_argument('--hours', type=int, default=168, help='hourly_data 响应的小时数，默认168')
+        parser.add_argument('--rounds', type=int, default=50, help='计时轮数，默认50')
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            self.stdout.write(self.style.WARNING('未安装 orjson，FastJSONRenderer 使用标准库回退路径'))
+
+        rows = [sensor_doc_to_dict(row) for row in generate_rows(options['rows'])]
+        hourly = []
+        for row in rows[:options['hours']]:
+            item = {k: None for k in row}
+            item.update({k: row[k] for k in ('id', 'timestamp', *HOURLY_CHART_FIELDS)})
+            hourly.append(item)
+        payloads = {
+            'list': {'code': 0, 'message': '获取传感器数据列表成功', 'data': {
+                'count': len(rows), 'next': None, 'previous': None, 'results': rows,
+            }},
+            'hourly_data': {'code': 0, 'message': '获取数据成功', 'data': {
+                'results': hourly, 'hours': [item['timestamp'][11:16] for item in hourly],
+            }},
+        }
+
+        stock = JSONRenderer()
+        fast = renderers.FastJSONRenderer()
+        for name, payload in payloads.items():
+            expected = stock.render(payload)
+            actual = fast.render(payload)
+            if json.loads(expected) != json.loads(actual):
+                raise CommandError(f'{name}: 渲染结果不一致')
+            stock_ms = self.measure(stock.render, payload, options['rounds'])
+            fast_ms = self.measure(fast.render, payload, options['rounds'])
+            self.stdout.write(
+                f'{name}: {len(expected) / 1024:.1f} KB，JSONRenderer {stock_ms:.2f} ms，'
+                f'FastJSONRenderer {fast_ms:.2f} ms，加速 {stock_ms / max(fast_ms, 1e-9):.1f}x'
+            )
+
+    def measure(self, render, payload, rounds):
+        render(payload)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            render(payload)
+        return (time.perf_counter() - started) * 1000 / rounds
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import datetime, timedelta
+import random
+import time
+
+from bson import ObjectId
+
+from dataservice import storage
+from dataservice.models import SensorData
+from dataservice.serializers import SENSOR_VALUE_FIELD_NAMES, SensorDataSerializer, sensor_doc_to_dict
+
+
+def generate_rows(count):
+    """生成与 sensor_data 原始文档同结构的随机行（约 5% 缺失值，覆盖 null 输出）"""
+    start = datetime.now().replace(microsecond=0) - timedelta(seconds=10 * count)
+    rows = []
+    for i in range(count):
+        row = {'_id': ObjectId(), 'timestamp': start + timedelta(seconds=10 * i)}
+        for name in SENSOR_VALUE_FIELD_NAMES:
+            if random.random() > 0.05:
+                row[name] = round(random.uniform(0, 500), 3)
+        rows.append(row)
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        '对比 SensorDataSerializer（mongoengine 文档）与 sensor_doc_to_dict（原始文档快速路径）：'
+        '先校验两者输出完全一致，再分别计时'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='每轮的行数（一页数据），默认1000')
+        parser.add_argument('--rounds', type=int, default=20, help='计时轮数，默认20')
+        parser.add_argument('--from-db', action='store_true', help='读取数据库中最新的 --rows 行，默认使用随机生成的文档')
+
+    def handle(self, *args, **options):
+        rows = self.load_rows(options['rows'], options['from_db'])
+        if not rows:
+            raise CommandError('没有可用于测试的数据')
+
+        # 慢路径与接口原来的做法一致：先构造文档对象，再经序列化器输出
+        def slow():
+            return SensorDataSerializer([SensorData._from_son(row) for row in rows], many=True).data
+
+        def fast():
+            return [sensor_doc_to_dict(row) for row in rows]
+
+        expected = [dict(item) for item in slow()]
+        actual = fast()
+        mismatches = [i for i, (a, b) in enumerate(zip(expected, actual)) if a != b]
+        if len(expected) != len(actual) or mismatches:
+            index = mismatches[0] if mismatches else 0
+            raise CommandError(f'输出不一致：共 {len(mismatches)} 行不同，第 {index} 行\n'
+                               f'serializer: {expected[index]}\nfast: {actual[index]}')
+        self.stdout.write(self.style.SUCCESS(f'输出一致：{len(rows)} 行'))
+
+        slow_ms = self.measure(slow, options['rounds'])
+        fast_ms = self.measure(fast, options['rounds'])
+        self.stdout.write(f'SensorDataSerializer: {slow_ms:.2f} ms/页')
+        self.stdout.write(f'sensor_doc_to_dict:   {fast_ms:.2f} ms/页')
+        self.stdout.write(self.style.SUCCESS(f'加速 {slow_ms / max(fast_ms, 1e-9):.1f}x'))
+
+    def load_rows(self, count, from_db):
+        if from_db:
+            return list(storage.find_rows({}, fields=SENSOR_VALUE_FIELD_NAMES, limit=count))
+        return generate_rows(count)
+
+    def measure(self, func, rounds):
+        func()
+        started = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        return (time.perf_counter() - started) * 1000 / rounds
@@ -1,10 +1,14 @@
 import time
 import random
+import signal
+import threading
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from datetime import datetime
 import logging
 
+from dataservice import storage
+from dataservice.ingest import BufferedSensorWriter, build_spool
 from dataservice.models import SensorData
 
 class Command(BaseCommand):
@@ -83,34 +87,32 @@ class Command(BaseCommand):
         parser.add_argument(
             '--continuous',
             action='store_true',
-            help='连续运行，每10秒获取一次数据',
+            help='连续运行，按 --interval 周期获取数据并批量写入',
         )
+        parser.add_argument('--interval', type=float, default=10, help='连续模式下的采样间隔秒，默认10')
+        parser.add_argument('--batch-size', type=int, help='连续模式下批量写入的条数，默认 settings.INGEST_BATCH_SIZE')
+        parser.add_argument('--flush-interval', type=float, help='连续模式下最长刷新间隔秒，默认取 settings.INGEST_FLUSH_INTERVAL_S 与 --interval 中较小者')
+        parser.add_argument('--write-concern', type=str, help='写关注，如 0/1/majority，默认 settings.INGEST_WRITE_CONCERN')
+        parser.add_argument('--stats-interval', type=float, default=60, help='连续模式下输出写入统计的间隔秒，默认60')
+        parser.add_argument('--spool-dir', type=str, help='数据库不可用时的本地落盘目录，默认 settings.INGEST_SPOOL_DIR')
+        parser.add_argument('--no-spool', action='store_true', help='不使用本地落盘，数据库不可用时重试后丢弃')
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('开始生成传感器数据...'))
         
-        # 尝试保存一条简单的测试数据
-        try:
-            test_data = SensorData(timestamp=datetime.now())
-            test_data.LDC_1 = 100.0
-            test_data.save()
-            self.stdout.write(self.style.SUCCESS('成功保存测试数据'))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'保存测试数据失败: {e}'))
+        # 尝试保存一条简单的测试数据（分桶模式下不向 sensor_data 写入）
+        if not storage.is_bucket_mode():
+            try:
+                test_data = SensorData(timestamp=datetime.now())
+                test_data.LDC_1 = 100.0
+                test_data.save()
+                self.stdout.write(self.style.SUCCESS('成功保存测试数据'))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'保存测试数据失败: {e}'))
         
         # 检查是否连续运行
         if options['continuous']:
-            try:
-                while True:
-                    try:
-                        data = self.generate_and_save_data()
-                        self.stdout.write(self.style.SUCCESS(f'成功生成模拟数据，时间: {datetime.now()}'))
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f'生成数据失败: {e}'))
-                    # 等待10秒
-                    time.sleep(10)
-            except KeyboardInterrupt:
-                self.stdout.write(self.style.WARNING('数据生成已停止'))
+            self.run_continuous(options)
         else:
             # 单次运行
             try:
@@ -119,12 +121,84 @@ class Command(BaseCommand):
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f'生成数据失败: {e}'))
 
-    def generate_and_save_data(self):
+    def run_continuous(self, options):
         """
-        生成模拟数据并保存
+        连续采集：采样放入批量写入器，由后台线程按条数/时间批量写库；
+        收到 Ctrl+C 或 SIGTERM 时把缓冲区写完再退出
         """
-        # 创建新的SensorData对象
-        sensor_data = SensorData(timestamp=datetime.now())
+        interval = max(0.1, options['interval'])
+        stats_interval = max(1.0, options['stats_interval'])
+        stop = threading.Event()
+
+        def _on_term(signum, frame):
+            stop.set()
+        try:
+            signal.signal(signal.SIGTERM, _on_term)
+        except ValueError:
+            pass  # 非主线程中运行时无法注册信号
+
+        # 未指定时刷新间隔不超过采样间隔：低频采集时每次采样都及时入库，latest/SSE/整点数据不滞后
+        flush_interval = options.get('flush_interval')
+        if flush_interval is None:
+            flush_interval = min(float(getattr(settings, 'INGEST_FLUSH_INTERVAL_S', 10)), interval)
+
+        spool = None if options.get('no_spool') else build_spool(options.get('spool_dir'))
+        writer = BufferedSensorWriter(
+            batch_size=options.get('batch_size'),
+            flush_interval=flush_interval,
+            write_concern=options.get('write_concern'),
+            spool=spool,
+        ).start()
+        self.stdout.write(self.style.SUCCESS(
+            f'连续采集已启动：间隔 {interval}s，批量 {writer.batch_size} 条 / {writer.flush_interval}s'
+        ))
+        if spool is not None:
+            self.stdout.write(self.style.SUCCESS(f'本地落盘目录：{spool.directory}'))
+
+        next_tick = time.monotonic()
+        next_stats = next_tick + stats_interval
+        try:
+            while not stop.is_set():
+                try:
+                    writer.add(self.generate_sample())
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'生成数据失败: {e}'))
+
+                now = time.monotonic()
+                if now >= next_stats:
+                    self.write_stats(writer)
+                    next_stats = now + stats_interval
+
+                # 按固定节拍采样，不受写库耗时影响
+                next_tick += interval
+                stop.wait(max(0, next_tick - time.monotonic()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stdout.write(self.style.WARNING('数据生成已停止，正在写入缓冲区剩余数据...'))
+            writer.close()
+            self.write_stats(writer)
+
+    def write_stats(self, writer):
+        stats = writer.stats()
+        message = (
+            f'写入统计：已写入 {stats["flushed"]}，失败 {stats["failed"]}，重试 {stats["retried"]}，'
+            f'缓冲中 {stats["pending"]}，批次 {stats["batches"]}'
+        )
+        if writer.spool is not None:
+            message += f'，落盘 {stats["spooled"]}，回放 {stats["replayed"]}'
+            if stats['spool_pending']:
+                message += '（spool 待回放）'
+        if stats['failed'] and stats['last_error']:
+            self.stdout.write(self.style.ERROR(f'{message}，最近错误: {stats["last_error"]}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
+
+    def generate_sample(self):
+        """
+        生成一条模拟采样，返回与 SensorData 字段同名的字典
+        """
+        sample = {'timestamp': datetime.now()}
         
         # 为每个字段生成模拟数据（在基准值基础上浮动±5个点）
         for field, base_value in self.base_data.items():
@@ -137,8 +211,28 @@ class Command(BaseCommand):
                 if base_value > 5:
                     new_value = max(0, new_value)
                     
-                # 设置字段值
-                setattr(sensor_data, field, new_value)
+                sample[field] = new_value
+        return sample
+
+    def generate_and_save_data(self):
+        """
+        生成模拟数据并保存
+        """
+        sample = self.generate_sample()
+
+        # 分桶存储模式：追加到所在的分钟/小时桶
+        if storage.is_bucket_mode():
+            self.stdout.write(self.style.SUCCESS(f'准备保存数据: {sample["timestamp"]}（分桶）'))
+            try:
+                storage.insert_rows([sample])
+                self.stdout.write(self.style.SUCCESS('数据保存成功'))
+                return sample
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'保存数据时出错: {str(e)}'))
+                raise
+
+        # 创建新的SensorData对象
+        sensor_data = SensorData(**sample)
         
         # 输出调试信息
         self.stdout.write(self.style.SUCCESS(f'准备保存数据: {sensor_data.timestamp}'))
@@ -150,4 +244,4 @@ class Command(BaseCommand):
             return sensor_data
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'保存数据时出错: {str(e)}'))
-            raise 
\ No newline at end of file
+            raise 
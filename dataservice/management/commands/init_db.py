@@ -2,6 +2,8 @@ from django.core.management.base import BaseCommand
 import pymongo
 from django.conf import settings
 
+from dataservice import storage
+
 class Command(BaseCommand):
     help = '初始化MongoDB数据库，清除现有集合并重新创建索引'
 
@@ -38,13 +40,27 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.SUCCESS('已删除sensor_data集合'))
             
             # 创建集合和索引
-            db.create_collection('sensor_data')
-            db.sensor_data.create_index(
-                [('timestamp', pymongo.ASCENDING)], 
-                expireAfterSeconds=94608000,  # 3年 = 3*365*24*60*60秒
-                name='timestamp_1',
-                background=True
-            )
+            if storage.is_timeseries_mode():
+                # 时间序列集合：过期时间在集合级设置
+                storage.create_timeseries_collection(db)
+                self.stdout.write(self.style.SUCCESS('已创建sensor_data时间序列集合'))
+            else:
+                db.create_collection('sensor_data')
+                db.sensor_data.create_index(
+                    [('timestamp', pymongo.ASCENDING)], 
+                    expireAfterSeconds=94608000,  # 3年 = 3*365*24*60*60秒
+                    name='timestamp_1',
+                    background=True
+                )
+                db.sensor_data.create_index(
+                    [('timestamp', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+                    name='ts_id_desc'
+                )
+            
+            # 分桶存储模式：同时创建分桶集合的索引
+            if storage.is_bucket_mode():
+                storage.ensure_bucket_indexes(db[storage.BUCKET_COLLECTION])
+                self.stdout.write(self.style.SUCCESS(f'已创建分桶集合索引: {storage.BUCKET_COLLECTION}'))
             
             self.stdout.write(self.style.SUCCESS('成功初始化MongoDB数据库和索引'))
         except Exception as e:
@@ -0,0 +1,129 @@
+from django.core.management.base import BaseCommand
+from datetime import datetime
+import time
+
+from mongoengine.connection import get_db
+from pymongo.errors import CollectionInvalid
+
+from dataservice import storage
+
+
+STATE_COLLECTION = 'storage_migrations'
+STATE_ID = 'sensor_data_timeseries'
+
+
+class Command(BaseCommand):
+    help = (
+        '将 sensor_data 迁移为 MongoDB 时间序列集合（timeField=timestamp，granularity=seconds）。'
+        '原集合先改名为 legacy 集合，再分块复制到新集合；中断后重复执行即可从断点继续。'
+        '请先设置 SENSOR_STORAGE_MODE=timeseries，使采集端在迁移期间直接写入新集合；'
+        '仍以 document 模式写入的进程会在改名后重建普通 sensor_data，此时迁移会中止。'
+        '注意：时间序列集合上按任意条件的 update/delete 需要 MongoDB 7.0+。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='每批复制的文档数')
+        parser.add_argument('--legacy-collection', type=str, default='sensor_data_legacy', help='原集合改名后的名称')
+        parser.add_argument('--drop-legacy', action='store_true', help='复制完成后删除 legacy 集合')
+        parser.add_argument('--sleep-ms', type=int, default=0, help='每批之间的休眠毫秒数，用于降低对线上库的压力')
+
+    def handle(self, *args, **options):
+        chunk_size: int = max(1, options['chunk_size'])
+        legacy_name: str = options['legacy_collection']
+        sleep_s: float = max(0, options['sleep_ms']) / 1000.0
+
+        db = get_db()
+        names = set(db.list_collection_names())
+        state_coll = db[STATE_COLLECTION]
+        state = state_coll.find_one({'_id': STATE_ID}) or {}
+
+        if state.get('finished_at'):
+            self.stdout.write(self.style.WARNING(f'迁移已于 {state["finished_at"]} 完成，无需重复执行'))
+            return
+
+        # 1) 原集合改名为 legacy（时间序列集合不支持 rename，因此只能移走旧集合）
+        if storage.SENSOR_COLLECTION in names and not storage.is_timeseries_collection(db):
+            if legacy_name in names:
+                self.stdout.write(self.style.ERROR(
+                    f'{legacy_name} 已存在且 sensor_data 仍是普通集合，请确认后手动处理'
+                ))
+                return
+            db[storage.SENSOR_COLLECTION].rename(legacy_name)
+            names = set(db.list_collection_names())
+            self.stdout.write(self.style.SUCCESS(f'已将 sensor_data 改名为 {legacy_name}'))
+
+        # 2) 创建时间序列集合
+        if storage.SENSOR_COLLECTION not in names:
+            try:
+                storage.create_timeseries_collection(db)
+                self.stdout.write(self.style.SUCCESS('已创建 sensor_data 时间序列集合'))
+            except CollectionInvalid:
+                pass  # 改名与创建之间被写入端抢先建成了普通集合，交给下面的检查处理
+
+        # 改名后仍有写入端以 document 模式写入时，sensor_data 会被重建为普通集合，
+        # 继续复制就会把历史数据写进普通集合，必须中止
+        if not storage.is_timeseries_collection(db):
+            self.stdout.write(self.style.ERROR(
+                'sensor_data 不是时间序列集合：迁移期间仍有进程以 document 模式写入。'
+                '请将所有写入端切换为 SENSOR_STORAGE_MODE=timeseries（或暂停写入），'
+                '把这期间写入的 sensor_data 改名保留后重新执行本命令'
+            ))
+            return
+
+        if legacy_name not in set(db.list_collection_names()):
+            self.stdout.write(self.style.WARNING(f'未找到 {legacy_name}，没有需要复制的历史数据'))
+            state_coll.update_one({'_id': STATE_ID}, {'$set': {'finished_at': datetime.now()}}, upsert=True)
+            return
+
+        # 3) 按 _id 顺序分块复制，每块完成后记录断点
+        legacy = db[legacy_name]
+        target = db[storage.SENSOR_COLLECTION]
+        last_id = state.get('last_id')
+        copied = state.get('copied', 0)
+        # 时间序列集合不校验 _id 唯一：上次在“已写入、未记录断点”时中断，需要对该块去重
+        pending = state.get('pending')
+        total = legacy.estimated_document_count()
+        started = time.time()
+        session_copied = 0
+
+        if not state:
+            state_coll.insert_one({'_id': STATE_ID, 'copied': 0, 'started_at': datetime.now()})
+
+        self.stdout.write(f'开始复制：共约 {total} 条，已复制 {copied} 条')
+        while True:
+            query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+            docs = list(legacy.find(query).sort('_id', 1).limit(chunk_size))
+            if not docs:
+                break
+
+            chunk_last_id = docs[-1]['_id']
+            if pending:
+                existing = {
+                    d['_id'] for d in target.find({'_id': {'$in': [d['_id'] for d in docs]}}, {'_id': 1})
+                }
+                docs = [d for d in docs if d['_id'] not in existing]
+                pending = None
+
+            state_coll.update_one({'_id': STATE_ID}, {'$set': {'pending': chunk_last_id}})
+            if docs:
+                target.insert_many(docs, ordered=False)
+            copied += len(docs)
+            session_copied += len(docs)
+            last_id = chunk_last_id
+            state_coll.update_one(
+                {'_id': STATE_ID},
+                {'$set': {'last_id': last_id, 'copied': copied, 'updated_at': datetime.now()},
+                 '$unset': {'pending': ''}}
+            )
+
+            elapsed = max(time.time() - started, 1e-6)
+            self.stdout.write(f'已复制 {copied}/{total} 条，{session_copied / elapsed:.0f} 条/秒')
+            if sleep_s:
+                time.sleep(sleep_s)
+
+        state_coll.update_one({'_id': STATE_ID}, {'$set': {'finished_at': datetime.now()}})
+        self.stdout.write(self.style.SUCCESS(f'迁移完成，共复制 {copied} 条'))
+
+        if options['drop_legacy']:
+            legacy.drop()
+            self.stdout.write(self.style.SUCCESS(f'已删除 {legacy_name}'))
@@ -1,21 +1,31 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import datetime, timedelta
-from typing import List, Dict
+import time
 
-from mongoengine.connection import get_db
+from dataservice import rollups
 
 
 class Command(BaseCommand):
-    help = "按分钟/小时/日将 sensor_data 增量汇总到对应集合（sensor_data_minute/hour/day）"
+    help = (
+        "按分钟/小时/日将 sensor_data 汇总到对应集合（sensor_data_minute/hour/day）。"
+        "默认重算 --hours 窗口；--follow 为常驻增量模式，按水位只处理新增与迟到数据，并逐级级联汇总"
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('--granularity', type=str, choices=['minute', 'hour', 'day'], default='minute', help='汇总粒度')
-        parser.add_argument('--hours', type=int, default=24, help='回溯的小时数，用于本次增量聚合的时间窗口')
+        parser.add_argument('--hours', type=int, default=24, help='回溯的小时数，用于本次聚合的时间窗口；增量模式下为首次运行的起点')
         parser.add_argument('--start', type=str, help='开始时间，ISO格式，如 2025-08-01T00:00:00Z')
         parser.add_argument('--end', type=str, help='结束时间，ISO格式，如 2025-08-02T00:00:00Z')
+        parser.add_argument('--follow', action='store_true', help='常驻增量模式：按水位处理分钟→小时→日')
+        parser.add_argument('--once', action='store_true', help='执行一轮增量汇总后退出（适合由 cron 调度）')
+        parser.add_argument('--interval', type=float, default=60, help='常驻模式下每轮间隔秒数，默认60')
 
     def handle(self, *args, **options):
+        if options['follow'] or options['once']:
+            self.run_incremental(options)
+            return
+
         granularity: str = options['granularity']
         start_iso: str = options.get('start')
         end_iso: str = options.get('end')
@@ -28,81 +38,35 @@ class Command(BaseCommand):
             end_dt = timezone.now()
             start_dt = end_dt - timedelta(hours=hours)
 
-        db = get_db()
-        source = db['sensor_data']
-
-        target_name = {
-            'minute': 'sensor_data_minute',
-            'hour': 'sensor_data_hour',
-            'day': 'sensor_data_day',
-        }[granularity]
-        target = db[target_name]
-
         # 确保目标集合上有索引
-        target.create_index('timestamp', name='ts_asc')
-        target.create_index([('timestamp', -1)], name='ts_desc')
-
-        # 选取常用指标做示范，可按需扩展
-        avg_fields: List[str] = [
-            'FEED_T_HG', 'FEED_T_STC', 'FEED_T_NH',
-            'BACK_T_HG', 'BACK_T_STC', 'BACK_T_NH',
-            'FEED_P_HG', 'FEED_P_STC', 'FEED_P_NH',
-            'BACK_P_HG', 'BACK_P_STC', 'BACK_P_NH',
-        ]
-        sum_fields: List[str] = [
-            'U1_FLOW', 'U2_FLOW', 'U3_FLOW', 'U4_FLOW', 'U5_FLOW', 'U6_FLOW', 'U7_FLOW', 'U8_FLOW',
-            'F_STEAM_FLOW', 'F_DRAIN_FLOW'
-        ]
-
-        # $dateTrunc 单位
-        unit = granularity
-
-        pipeline = [
-            {
-                '$match': {
-                    'timestamp': {'$gte': start_dt, '$lt': end_dt}
-                }
-            },
-            {
-                '$set': {
-                    't_bucket': {
-                        '$dateTrunc': {
-                            'date': '$timestamp',
-                            'unit': unit
-                        }
-                    }
-                }
-            },
-            {
-                '$group': self._build_group_stage(avg_fields, sum_fields)
-            },
-            {
-                '$set': {'timestamp': '$_id'}
-            },
-            {
-                '$unset': ['_id']
-            },
-            {
-                '$merge': {
-                    'into': target_name,
-                    'on': 'timestamp',
-                    'whenMatched': 'replace',
-                    'whenNotMatched': 'insert'
-                }
-            }
-        ]
-
-        result = list(source.aggregate(pipeline, allowDiskUse=True))
-        self.stdout.write(self.style.SUCCESS(f'{granularity} 汇总完成: 写入/更新 {len(result)} 条 [ {start_dt.isoformat()} , {end_dt.isoformat()} )'))
-
-    def _build_group_stage(self, avg_fields: List[str], sum_fields: List[str]) -> Dict:
-        group = {
-            '_id': '$t_bucket'
-        }
-        for f in avg_fields:
-            group[f + '_avg'] = {'$avg': f'${f}'}
-        for f in sum_fields:
-            group[f + '_sum'] = {'$sum': f'${f}'}
-        return group
-
-
+        rollups.ensure_rollup_indexes(granularity)
+
+        # 时间过滤由 storage.aggregate_rows 注入，分桶存储模式下会先展开为行
+        rollups.rollup_range(granularity, start_dt, end_dt, from_raw=True)
+        self.stdout.write(self.style.SUCCESS(f'{granularity} 汇总完成 [ {start_dt.isoformat()} , {end_dt.isoformat()} )'))
+
+    def run_incremental(self, options):
+        rollups.prepare()
+        lookback = timedelta(hours=options['hours'])
+        interval = max(1.0, options['interval'])
+        self.stdout.write(self.style.SUCCESS('增量汇总已启动' if options['follow'] else '执行一轮增量汇总'))
+        try:
+            while True:
+                started = time.monotonic()
+                for granularity in rollups.GRANULARITIES:
+                    try:
+                        processed = rollups.advance(granularity, initial_lookback=lookback)
+                    except Exception as e:
+                        self.stdout.write(self.style.ERROR(f'{granularity} 汇总失败: {e}'))
+                        break
+                    if processed:
+                        start, end = processed
+                        self.stdout.write(self.style.SUCCESS(
+                            f'{granularity} 汇总 [ {start.isoformat()} , {end.isoformat()} ) '
+                            f'耗时 {time.monotonic() - started:.2f}s'
+                        ))
+                if not options['follow']:
+                    return
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('增量汇总已停止'))
@@ -1,4 +1,5 @@
 from django.db import models
+from django.conf import settings
 from mongoengine import Document, DateTimeField, FloatField, StringField, IntField, BooleanField, DictField
 import datetime
 
@@ -26,6 +27,33 @@ class User(Document):
     def __str__(self):
         return self.username
 
+def _sensor_data_indexes():
+    """
+    sensor_data 的索引声明。
+    时间序列集合（SENSOR_STORAGE_MODE=timeseries）的过期由集合级 expireAfterSeconds 控制，
+    不能再在 timestamp 上建 TTL 索引，因此只保留 timestamp 倒序索引。
+    """
+    indexes = [
+        # 仅设置TTL过期时间，不设置background以避免参数冲突
+        {
+            'fields': ['timestamp'],
+            'expireAfterSeconds': 94608000  # 3年 = 3*365*24*60*60 = 94608000秒
+        },
+        # 新增：按时间倒序的普通索引，优化“最新一条/时间段倒序”查询
+        {
+            'fields': ['-timestamp'],
+            'name': 'ts_desc'
+        },
+        # 游标分页按 (timestamp, _id) 倒序取下一页，同一时间戳内用 _id 保证顺序稳定
+        {
+            'fields': ['-timestamp', '-id'],
+            'name': 'ts_id_desc'
+        }
+    ]
+    if getattr(settings, 'SENSOR_STORAGE_MODE', 'document') == 'timeseries':
+        return indexes[1:2]
+    return indexes
+
 class SensorData(Document):
     """
     传感器数据模型，对应yuan.csv中的数据结构
@@ -138,22 +166,18 @@ class SensorData(Document):
     
     meta = {
         'collection': 'sensor_data',  # 集合名称
-        'indexes': [
-            # 仅设置TTL过期时间，不设置background以避免参数冲突
-            {
-                'fields': ['timestamp'],
-                'expireAfterSeconds': 94608000  # 3年 = 3*365*24*60*60 = 94608000秒
-            },
-            # 新增：按时间倒序的普通索引，优化“最新一条/时间段倒序”查询
-            {
-                'fields': ['-timestamp'],
-                'name': 'ts_desc'
-            }
-        ],
+        'indexes': _sensor_data_indexes(),
         'ordering': ['-timestamp']  # 默认按时间降序排列
     }
 
 
+# SensorData 全部数值测点字段（按模型声明顺序），供分桶存储、汇总等按 schema 生成的逻辑复用
+SENSOR_FIELDS = tuple(
+    name for name in SensorData._fields_ordered
+    if isinstance(SensorData._fields[name], FloatField)
+)
+
+
 class ManualPlan(Document):
     """
     月度手动计划（单位：万GJ）
@@ -295,3 +319,21 @@ class HeatPrediction(Document):
     def save(self, *args, **kwargs):
         self.updated_at = datetime.datetime.now()
         return super().save(*args, **kwargs)
+
+
+# 测点字段分类（AI 工具的 schema 说明、WebSocket 按分类订阅共用）
+SENSOR_FIELD_CATEGORIES = {
+    "负荷": ["LDC_1", "LDC_2", "LDC_3", "LDC_4"],
+    "五抽压力": ["S5_01", "S5_02", "S5_0301", "S5_0302", "S5_0401", "S5_0402"],
+    "累计热量": ["HEATSUP_TOTAL_HG", "HEATSUP_TOTAL_STC", "HEATSUP_TOTAL_NH", "STEAMSUP_TOTAL_YC"],
+    "供水流量": ["FEED_FLOW_HG", "FEED_FLOW_STC", "FEED_FLOW_NH"],
+    "回水流量": ["BACK_FLOW_HG", "BACK_FLOW_STC", "BACK_FLOW_NH"],
+    "供水压力": ["FEED_P_HG", "FEED_P_STC", "FEED_P_NH"],
+    "回水压力": ["BACK_P_HG", "BACK_P_STC", "BACK_P_NH"],
+    "实时热量": ["HEATNOW_HG", "HEATNOW_STC", "HEATNOW_NH"],
+    "供水温度": ["FEED_T_HG", "FEED_T_STC", "FEED_T_NH"],
+    "回水温度": ["BACK_T_HG", "BACK_T_STC", "BACK_T_NH"],
+    "疏水流量": ["DRAIN_BH_03", "DRAIN_BH_04", "DRAIN_NH_03", "DRAIN_NH_04"],
+    "补水流量": ["MAKEUP_BH_N", "MAKEUP_BH_E", "MAKEUP_NH_N", "MAKEUP_NH_E"],
+    "海淡抽汽": ["U1_FLOW", "U2_FLOW", "U3_FLOW", "U4_FLOW", "U5_FLOW", "U6_FLOW", "U7_FLOW", "U8_FLOW"]
+}
@@ -0,0 +1,70 @@
+from bson import ObjectId
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时回退到标准库 json
+    orjson = None
+
+
+class MongoJSONEncoder(JSONEncoder):
+    """标准库回退路径：在 DRF 编码器基础上支持 ObjectId 与 NumPy 标量"""
+
+    def default(self, obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        if hasattr(obj, 'item') and hasattr(obj, 'dtype'):
+            return obj.item()
+        return super().default(obj)
+
+
+_fallback_encoder = MongoJSONEncoder()
+
+
+def _orjson_default(obj):
+    # 只有 orjson 不能原生处理的类型（ObjectId、Decimal、惰性翻译字符串等）才会进入这里
+    return _fallback_encoder.default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON 渲染器：安装了 orjson 时用其编码（datetime、dict/list 子类、NumPy 数组与标量原生支持，
+    NaN 输出为 null），否则回退到标准库 json + MongoJSONEncoder。
+    与 DRF JSONRenderer 的输出差异仅在 datetime 保留微秒（DRF 截断到毫秒）。
+    """
+    encoder_class = MongoJSONEncoder
+
+    if orjson is not None:
+        OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        options = self.OPTIONS
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_orjson_default, option=options)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    text/event-stream 渲染器。
+    SSE 接口直接返回 StreamingHttpResponse，这里只用于让 Accept: text/event-stream 的请求通过内容协商。
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return str(data or '').encode(self.charset)
+
+
+class ColumnarJSONRenderer(FastJSONRenderer):
+    """
+    ?format=columnar 的渲染器：输出仍为 JSON，视图根据 request.accepted_renderer.format
+    决定返回列式结构（见 columnar.py）。
+    """
+    format = 'columnar'
@@ -1,19 +1,24 @@
+import time
 from datetime import datetime, timedelta
-from typing import Iterable, List, Optional
+from typing import Dict, Iterable, List, Optional, Sequence
 
 from mongoengine.queryset.visitor import Q
 
+from . import downsample, latest_cache, rollups, storage
 from .models import SensorData
+from .sketch import QuantileSketch
 
 
 def get_latest(fields: Optional[List[str]] = None):
     """
-    读取最新一条记录，可选仅返回部分字段
+    读取最新一条记录（经 latest_cache 缓存），可选仅返回部分字段
     """
-    qs = SensorData.objects.order_by('-timestamp')
+    row = latest_cache.get_latest_row()
+    if not row:
+        return None
     if fields:
-        qs = qs.only(*(['timestamp'] + fields))
-    return qs.first()
+        row = {k: v for k, v in row.items() if k in ('_id', 'timestamp') or k in fields}
+    return SensorData._from_son(row)
 
 
 def choose_collection_by_span(start: datetime, end: datetime) -> str:
@@ -27,32 +32,176 @@ def choose_collection_by_span(start: datetime, end: datetime) -> str:
     return 'sensor_data_day'
 
 
-def get_timeseries(start: datetime, end: datetime, fields: List[str], order: str = 'asc') -> List[dict]:
+def get_timeseries(start: datetime, end: datetime, fields: List[str], order: str = 'asc',
+                   stat: str = 'avg', max_points: Optional[int] = None,
+                   downsample_method: str = 'lttb') -> List[dict]:
     """
     在[start, end) 区间按时间返回指定字段的时序数据，自动根据跨度选择分钟/小时/日汇总集合。
+    stat 为每个时间桶内的统计量：avg/min/max/first/last/count/sum/delta（delta 仅对累计量字段有值）。
+    分桶存储模式下分钟级数据直接由分桶计算，无需单独的分钟汇总集合。
+    max_points 不为空时按 downsample_method（lttb/minmax）降采样，返回行数不超过 max_points。
     返回字典列表：{ timestamp, field1, field2, ... }
     """
     from mongoengine.connection import get_db
 
-    db = get_db()
+    if stat not in rollups.STATS:
+        raise ValueError(f'不支持的统计量: {stat}')
+    if downsample_method not in downsample.METHODS:
+        raise ValueError(f'不支持的降采样方法: {downsample_method}')
+    if max_points:
+        downsample.check_budget(max_points, len(fields))
     coll_name = choose_collection_by_span(start, end)
-    coll = db[coll_name]
+    direction = 1 if order == 'asc' else -1
 
-    projection = {f + '_avg': 1 for f in fields}
-    projection['timestamp'] = 1
+    # 需要读取的汇总字段：sum 对没有 _sum 的字段由 avg*count 计算，delta 由汇总中的 _delta 提供
+    if stat == 'sum':
+        suffixes = ['_sum', '_avg', '_count']
+    else:
+        suffixes = ['_' + stat]
 
-    cursor = coll.find(
-        {'timestamp': {'$gte': start, '$lt': end}},
-        projection
-    ).sort('timestamp', 1 if order == 'asc' else -1)
+    if coll_name == 'sensor_data_minute' and storage.is_bucket_mode():
+        group = {'_id': {'$dateTrunc': {'date': '$timestamp', 'unit': 'minute'}}}
+        counters = [f for f in fields if f in rollups.COUNTER_FIELDS] if stat == 'delta' else []
+        finalize = {'timestamp': '$_id'}
+        for f in fields:
+            if stat == 'delta':
+                if f in counters:
+                    group[f + '_delta'] = rollups.raw_accumulator(f, 'delta')
+                    group[f + '_count'] = rollups.raw_accumulator(f, 'count')
+                    finalize[f + '_delta'] = rollups.bucket_delta(f)
+            else:
+                group[f'{f}_{stat}'] = rollups.raw_accumulator(f, stat)
+        seeds = rollups.counter_seeds(start, counters) if counters else None
+        cursor = storage.aggregate_rows(
+            {'timestamp': {'$gte': start, '$lt': end}},
+            [{'$sort': {'timestamp': 1}}, *rollups.counter_step_stages(counters, seeds),
+             {'$group': group}, {'$set': finalize}, {'$sort': {'timestamp': direction}}],
+            fields=fields,
+        )
+    else:
+        coll = get_db()[coll_name]
+        projection = {f + suffix: 1 for f in fields for suffix in suffixes}
+        projection['timestamp'] = 1
+
+        cursor = coll.find(
+            {'timestamp': {'$gte': start, '$lt': end}},
+            projection
+        ).sort('timestamp', direction)
 
     # 将汇总字段名改回原字段名，便于前端统一处理
     results: List[dict] = []
     for doc in cursor:
         item = {'timestamp': doc['timestamp']}
         for f in fields:
-            item[f] = doc.get(f + '_avg')
+            value = doc.get(f'{f}_{stat}')
+            if value is None and stat == 'sum' and doc.get(f + '_avg') is not None:
+                value = doc[f + '_avg'] * (doc.get(f + '_count') or 0)
+            item[f] = value
         results.append(item)
+    if max_points:
+        results = downsample.downsample(results, fields, max_points, downsample_method)
     return results
 
 
+def get_hourly_snapshots(start: datetime, end: datetime, fields: List[str]) -> List[dict]:
+    """
+    在[start, end] 区间内为每个小时取最接近整点的一条采样（即该小时内最早的一条），
+    一次聚合完成，只投影所需字段。返回按时间升序的字典列表：{ hour, timestamp, field1, ... }
+    """
+    first = {'timestamp': '$timestamp'}
+    for f in fields:
+        first[f] = f'${f}'
+    cursor = storage.aggregate_rows(
+        {'timestamp': {'$gte': start, '$lte': end}},
+        [
+            {'$sort': {'timestamp': 1}},
+            {'$group': {
+                '_id': {'$dateTrunc': {'date': '$timestamp', 'unit': 'hour'}},
+                'doc': {'$first': first},
+            }},
+            {'$sort': {'_id': 1}},
+        ],
+        fields=fields,
+    )
+    return [dict(doc['doc'], hour=doc['_id']) for doc in cursor]
+
+
+def _ceil_time(ts: datetime, granularity: str) -> datetime:
+    floor = rollups.floor_time(ts, granularity)
+    if floor == ts:
+        return floor
+    return floor + (timedelta(hours=1) if granularity == 'hour' else timedelta(days=1))
+
+
+def get_percentiles(start: datetime, end: datetime, fields: List[str],
+                    percentiles: Sequence[float] = (5, 50, 95)) -> Dict[str, dict]:
+    """
+    计算 [start, end) 区间内各字段的分位数（percentiles 为 0-100）。
+    区间拆为：完整的日桶（日汇总草图）、其余完整的小时桶（小时汇总草图）、首尾不足一小时的部分（原始数据），
+    各部分草图合并后求分位数，相对误差约为 ROLLUP_SKETCH_ACCURACY。
+    超过汇总 watermark 的时间段尚未汇总，同样读取原始数据。
+    返回 {field: {percentiles: {"p5": v, ...}, count, min, max}, ...} 以及 _meta（各来源的桶数、耗时）。
+    """
+    from mongoengine.connection import get_db
+
+    unknown = [f for f in fields if f not in rollups.sketch_fields()]
+    if unknown:
+        raise ValueError(f'以下字段未配置分位数草图: {", ".join(unknown)}')
+    started = time.monotonic()
+    sketches = {f: QuantileSketch(rollups.sketch_accuracy()) for f in fields}
+    meta = {'day_buckets': 0, 'hour_buckets': 0, 'raw_rows': 0, 'missing_sketches': 0}
+
+    def merge_buckets(granularity: str, lo: datetime, hi: datetime):
+        if lo >= hi:
+            return
+        projection = {f + '_sketch': 1 for f in fields}
+        coll = get_db()[rollups.ROLLUP_COLLECTIONS[granularity]]
+        for doc in coll.find({'timestamp': {'$gte': lo, '$lt': hi}}, projection):
+            meta[granularity + '_buckets'] += 1
+            for f in fields:
+                data = doc.get(f + '_sketch')
+                if data:
+                    sketches[f].merge(QuantileSketch.from_bytes(data))
+                else:
+                    meta['missing_sketches'] += 1
+
+    def merge_raw(lo: datetime, hi: datetime):
+        if lo >= hi:
+            return
+        for row in storage.find_rows({'timestamp': {'$gte': lo, '$lt': hi}}, fields=fields, batch_size=5000):
+            meta['raw_rows'] += 1
+            for f in fields:
+                sketches[f].add(row.get(f))
+
+    hour_lo = _ceil_time(start, 'hour')
+    hour_hi = rollups.floor_time(end, 'hour')
+    hour_watermark = rollups.get_state('hour').get('watermark')
+    hour_hi = min(hour_hi, hour_watermark) if hour_watermark else hour_lo
+    if hour_lo >= hour_hi:
+        merge_raw(start, end)
+    else:
+        day_lo = _ceil_time(hour_lo, 'day')
+        day_hi = rollups.floor_time(hour_hi, 'day')
+        day_watermark = rollups.get_state('day').get('watermark')
+        day_hi = min(day_hi, day_watermark) if day_watermark else day_lo
+        if day_lo < day_hi:
+            merge_buckets('hour', hour_lo, day_lo)
+            merge_buckets('day', day_lo, day_hi)
+            merge_buckets('hour', day_hi, hour_hi)
+        else:
+            merge_buckets('hour', hour_lo, hour_hi)
+        merge_raw(start, hour_lo)
+        merge_raw(hour_hi, end)
+
+    result: Dict[str, dict] = {}
+    for f, sketch in sketches.items():
+        values = sketch.quantiles([p / 100 for p in percentiles])
+        result[f] = {
+            'percentiles': {f'p{p:g}': v for p, v in zip(percentiles, values)},
+            'count': sketch.count,
+            'min': sketch.min if sketch.count else None,
+            'max': sketch.max if sketch.count else None,
+        }
+    meta['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+    result['_meta'] = meta
+    return result
@@ -0,0 +1,381 @@
+"""
+传感器数据汇总（sensor_data_minute / hour / day）。
+
+增量模式（rollup_sensor_data --follow）：
+- 每个粒度在 rollup_state 集合中记录一条状态 {_id: 粒度, watermark, dirty_from}
+  watermark 之前的完整时间桶都已汇总；dirty_from 为 watermark 之前有新写入（迟到数据）的最早时间
+- 每轮只重算 [min(watermark, dirty_from), 可汇总上界) 内的时间桶，成本与新写入量成正比，与窗口大小无关
+- 分钟级从原始数据汇总；小时级从分钟汇总、日级从小时汇总（按 count 加权），不再重复扫描 sensor_data
+- 下级重算的区间会标记为上级的 dirty_from，从而级联更新
+
+写入路径（BufferedSensorWriter、CSV 导入）在写入早于分钟 watermark 的数据时调用 mark_dirty()。
+
+各级汇总另为 ROLLUP_SKETCH_FIELDS 保存分位数草图 F_sketch。从原始数据汇总时，$group 同时把这些字段的取值收集为
+F_values 数组，草图在同一次读取中构建并随汇总文档一起写入（write_raw_rollups），原始数据每个窗口只读一次；
+小时级合并分钟草图、日级合并小时草图（update_sketches），级联同样不扫描原始数据。
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from bson import Binary
+from django.conf import settings
+from mongoengine.connection import get_db
+from pymongo import ReplaceOne, UpdateOne
+
+from . import storage
+from .models import SENSOR_FIELDS
+from .sketch import QuantileSketch
+
+GRANULARITIES = ('minute', 'hour', 'day')
+ROLLUP_COLLECTIONS = {
+    'minute': 'sensor_data_minute',
+    'hour': 'sensor_data_hour',
+    'day': 'sensor_data_day',
+}
+STATE_COLLECTION = 'rollup_state'
+
+# 汇总覆盖 SensorData 的全部数值字段，每个字段在每个时间桶内存储：
+#   F_avg / F_min / F_max / F_first / F_last / F_count（非空采样数）
+# 累计量字段（*_TOTAL*）另存 F_delta：桶内每条采样相对上一条非空取值的增量之和（见 counter_step），
+# 相邻桶之间的增量归入后一个桶，因此上级汇总的 F_delta 可以直接由下级相加得到；
+# 流量类字段额外保留 F_sum（兼容早期汇总）
+ROLLUP_FIELDS = SENSOR_FIELDS
+COUNTER_FIELDS = tuple(f for f in SENSOR_FIELDS if '_TOTAL' in f)
+ROLLUP_SUM_FIELDS: List[str] = [
+    'U1_FLOW', 'U2_FLOW', 'U3_FLOW', 'U4_FLOW', 'U5_FLOW', 'U6_FLOW', 'U7_FLOW', 'U8_FLOW',
+    'F_STEAM_FLOW', 'F_DRAIN_FLOW'
+]
+STATS = ('avg', 'min', 'max', 'first', 'last', 'count', 'sum', 'delta')
+
+# 各级汇总额外为这些字段存储分位数草图 F_sketch（见 sketch.py），用于任意区间的分位数查询
+DEFAULT_SKETCH_FIELDS = [
+    'LDC_1', 'LDC_2', 'LDC_3', 'LDC_4',
+    'FEED_T_HG', 'FEED_T_STC', 'FEED_T_NH',
+    'BACK_T_HG', 'BACK_T_STC', 'BACK_T_NH',
+]
+SKETCH_GRANULARITIES = ('minute', 'hour', 'day')
+
+
+def sketch_fields() -> List[str]:
+    return list(getattr(settings, 'ROLLUP_SKETCH_FIELDS', DEFAULT_SKETCH_FIELDS))
+
+
+def sketch_accuracy() -> float:
+    return float(getattr(settings, 'ROLLUP_SKETCH_ACCURACY', 0.01))
+
+
+def floor_time(ts: datetime, granularity: str) -> datetime:
+    """向下取整到时间桶起点（与 $dateTrunc 一致）"""
+    if granularity == 'minute':
+        return ts.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ensure_rollup_indexes(granularity: str):
+    """汇总集合按 timestamp 唯一（$merge on timestamp 需要唯一索引）"""
+    coll = get_db()[ROLLUP_COLLECTIONS[granularity]]
+    info = coll.index_information()
+    if 'ts_asc' in info and not info['ts_asc'].get('unique'):
+        coll.drop_index('ts_asc')
+    coll.create_index('timestamp', name='ts_asc', unique=True)
+    coll.create_index([('timestamp', -1)], name='ts_desc')
+    return coll
+
+
+def _merge_stage(granularity: str) -> Dict[str, Any]:
+    return {
+        '$merge': {
+            'into': ROLLUP_COLLECTIONS[granularity],
+            'on': 'timestamp',
+            'whenMatched': 'replace',
+            'whenNotMatched': 'insert'
+        }
+    }
+
+
+def raw_accumulator(field: str, stat: str) -> Dict[str, Any]:
+    """原始行上某个字段某种统计的 $group 累加器（first/last 依赖之前按 timestamp 升序排序）"""
+    if stat == 'count':
+        return {'$sum': {'$cond': [{'$gt': [f'${field}', None]}, 1, 0]}}
+    if stat == 'delta':
+        # 需要先经过 counter_step_stages
+        return {'$sum': f'${field}_step'}
+    return {f'${stat}': f'${field}'}
+
+
+def counter_step(field: str, seed: Any = None) -> Dict[str, Any]:
+    """
+    单条采样的增量：当前值减去之前最近的非空取值 F_prev（区间内首条用 seed，见 counter_seeds）；
+    取值变小视为计数器复位（从 0 重新累计），增量为当前值；当前值为空或之前没有任何取值时为 null
+    """
+    value = f'${field}'
+    prev = {'$ifNull': [f'${field}_prev', {'$literal': seed}]}
+    return {'$cond': [
+        {'$and': [{'$gt': [value, None]}, {'$gt': [prev, None]}]},
+        {'$cond': [{'$gte': [value, prev]}, {'$subtract': [value, prev]}, value]},
+        None,
+    ]}
+
+
+def counter_step_stages(fields: Sequence[str], seeds: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    在原始行上为累计量字段计算 F_step（见 counter_step），之后按桶 $sum 即为桶内增量：
+    $locf 把取值向后填充跨过空值，$shift 取上一行的值（需要 MongoDB 5.2+）
+    """
+    if not fields:
+        return []
+    seeds = seeds or {}
+    return [
+        {'$setWindowFields': {
+            'sortBy': {'timestamp': 1},
+            'output': {f'{f}_carry': {'$locf': f'${f}'} for f in fields},
+        }},
+        {'$setWindowFields': {
+            'sortBy': {'timestamp': 1},
+            'output': {f'{f}_prev': {'$shift': {'output': f'${f}_carry', 'by': -1}} for f in fields},
+        }},
+        {'$set': {f'{f}_step': counter_step(f, seeds.get(f)) for f in fields}},
+    ]
+
+
+def bucket_delta(field: str) -> Dict[str, Any]:
+    """$group 之后的 F_delta：桶内没有非空采样时为 null（$sum 对全空得到 0）"""
+    return {'$cond': [{'$gt': [f'${field}_count', 0]}, f'${field}_delta', None]}
+
+
+def counter_seeds(start: datetime, fields: Sequence[str] = COUNTER_FIELDS,
+                  lookback: timedelta = timedelta(hours=1), max_rows: int = 30) -> Dict[str, Any]:
+    """start 之前（lookback 以内）各累计量字段最近的非空原始取值，作为区间内首个桶增量的起点"""
+    seeds: Dict[str, Any] = {}
+    if not fields:
+        return seeds
+    rows = storage.find_rows(
+        {'timestamp': {'$gte': start - lookback, '$lt': start}},
+        fields=list(fields), sort=[('timestamp', -1)], limit=max_rows,
+    )
+    for row in rows:
+        for f in fields:
+            if f not in seeds and row.get(f) is not None:
+                seeds[f] = row[f]
+        if len(seeds) == len(fields):
+            break
+    return seeds
+
+
+def raw_rollup_stages(granularity: str, seeds: Optional[Dict[str, Any]] = None,
+                      sketch_values: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """
+    从原始行汇总的阶段（时间过滤由 storage.aggregate_rows 注入；seeds 见 counter_seeds）。
+    sketch_values 中的字段另把桶内取值收集为 F_values（10 秒采样时日级每字段约 8640 个），
+    此时不追加 $merge，由 write_raw_rollups 构建草图后写入
+    """
+    group: Dict[str, Any] = {
+        '_id': {'$dateTrunc': {'date': '$timestamp', 'unit': granularity}},
+        'count': {'$sum': 1},
+    }
+    for f in ROLLUP_FIELDS:
+        for stat in ('avg', 'min', 'max', 'first', 'last', 'count'):
+            group[f'{f}_{stat}'] = raw_accumulator(f, stat)
+    for f in ROLLUP_SUM_FIELDS:
+        group[f + '_sum'] = raw_accumulator(f, 'sum')
+    for f in COUNTER_FIELDS:
+        group[f + '_delta'] = raw_accumulator(f, 'delta')
+    for f in sketch_values:
+        group[f + '_values'] = {'$push': f'${f}'}
+    finalize: Dict[str, Any] = {'timestamp': '$_id'}
+    finalize.update({f + '_delta': bucket_delta(f) for f in COUNTER_FIELDS})
+    stages = [
+        {'$sort': {'timestamp': 1}},
+        *counter_step_stages(COUNTER_FIELDS, seeds),
+        {'$group': group},
+        {'$set': finalize},
+        {'$unset': ['_id']},
+    ]
+    if not sketch_values:
+        stages.append(_merge_stage(granularity))
+    return stages
+
+
+def write_raw_rollups(granularity: str, docs, fields: Sequence[str], batch_size: int = 1000) -> int:
+    """
+    把 raw_rollup_stages(sketch_values=fields) 输出的汇总文档中的 F_values 转换为草图 F_sketch，
+    按 timestamp 整体替换写入（与 $merge whenMatched=replace 一致），返回写入的文档数
+    """
+    coll = get_db()[ROLLUP_COLLECTIONS[granularity]]
+    ops: List[ReplaceOne] = []
+    written = 0
+    for doc in docs:
+        for f in fields:
+            sketch = QuantileSketch(sketch_accuracy())
+            sketch.extend(doc.pop(f + '_values', None) or ())
+            doc[f + '_sketch'] = Binary(sketch.to_bytes())
+        ops.append(ReplaceOne({'timestamp': doc['timestamp']}, doc, upsert=True))
+        if len(ops) >= batch_size:
+            coll.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+    if ops:
+        coll.bulk_write(ops, ordered=False)
+        written += len(ops)
+    return written
+
+
+def cascade_rollup_stages(granularity: str) -> List[Dict[str, Any]]:
+    """
+    从下一级汇总再汇总的阶段：平均值按字段的非空采样数加权，min/max/first/last 取极值与首尾，
+    count/sum 以及累计量的增量相加
+    """
+    group: Dict[str, Any] = {
+        '_id': {'$dateTrunc': {'date': '$timestamp', 'unit': granularity}},
+        'count': {'$sum': '$count'},
+    }
+    finalize: Dict[str, Any] = {'timestamp': '$_id'}
+    helpers: List[str] = ['_id']
+    for f in ROLLUP_FIELDS:
+        group[f'{f}_wsum'] = {'$sum': {'$multiply': [f'${f}_avg', f'${f}_count']}}
+        group[f'{f}_count'] = {'$sum': f'${f}_count'}
+        group[f'{f}_min'] = {'$min': f'${f}_min'}
+        group[f'{f}_max'] = {'$max': f'${f}_max'}
+        group[f'{f}_first'] = {'$first': f'${f}_first'}
+        group[f'{f}_last'] = {'$last': f'${f}_last'}
+        finalize[f + '_avg'] = {
+            '$cond': [{'$gt': [f'${f}_count', 0]}, {'$divide': [f'${f}_wsum', f'${f}_count']}, None]
+        }
+        helpers.append(f'{f}_wsum')
+    for f in ROLLUP_SUM_FIELDS:
+        group[f + '_sum'] = {'$sum': f'${f}_sum'}
+    for f in COUNTER_FIELDS:
+        group[f + '_delta'] = {'$sum': f'${f}_delta'}
+        finalize[f + '_delta'] = bucket_delta(f)
+    return [
+        {'$sort': {'timestamp': 1}},
+        {'$group': group},
+        {'$set': finalize},
+        {'$unset': helpers},
+        _merge_stage(granularity),
+    ]
+
+
+def rollup_range(granularity: str, start: datetime, end: datetime, from_raw: bool = False):
+    """重算 [start, end) 内的时间桶；小时/日级默认从下一级汇总读取，from_raw=True 时直接扫描原始数据"""
+    if granularity == 'minute' or from_raw:
+        fields = sketch_fields() if granularity in SKETCH_GRANULARITIES else []
+        cursor = storage.aggregate_rows(
+            {'timestamp': {'$gte': start, '$lt': end}},
+            raw_rollup_stages(granularity, counter_seeds(start), fields),
+        )
+        if fields:
+            write_raw_rollups(granularity, cursor, fields)
+        else:
+            list(cursor)
+        return
+    source = ROLLUP_COLLECTIONS[GRANULARITIES[GRANULARITIES.index(granularity) - 1]]
+    pipeline = [{'$match': {'timestamp': {'$gte': start, '$lt': end}}}] + cascade_rollup_stages(granularity)
+    list(get_db()[source].aggregate(pipeline, allowDiskUse=True))
+    if granularity in SKETCH_GRANULARITIES:
+        update_sketches(granularity, start, end)
+
+
+def update_sketches(granularity: str, start: datetime, end: datetime):
+    """为 [start, end) 内由下一级汇总得到的汇总文档合并写入分位数草图（$merge 替换文档后需要重新写入）"""
+    fields = sketch_fields()
+    if not fields:
+        return
+    sketches: Dict[datetime, Dict[str, QuantileSketch]] = {}
+    lower = ROLLUP_COLLECTIONS[GRANULARITIES[GRANULARITIES.index(granularity) - 1]]
+    projection = {f + '_sketch': 1 for f in fields}
+    projection['timestamp'] = 1
+    for doc in get_db()[lower].find({'timestamp': {'$gte': start, '$lt': end}}, projection):
+        key = floor_time(doc['timestamp'], granularity)
+        if key not in sketches:
+            sketches[key] = {f: QuantileSketch(sketch_accuracy()) for f in fields}
+        for f in fields:
+            data = doc.get(f + '_sketch')
+            if data:
+                sketches[key][f].merge(QuantileSketch.from_bytes(data))
+
+    ops = [
+        UpdateOne({'timestamp': ts}, {'$set': {f + '_sketch': Binary(s.to_bytes()) for f, s in per_field.items()}})
+        for ts, per_field in sketches.items()
+    ]
+    if ops:
+        get_db()[ROLLUP_COLLECTIONS[granularity]].bulk_write(ops, ordered=False)
+
+
+# ---------------------------------------------------------------------------
+# 水位状态
+# ---------------------------------------------------------------------------
+
+def _state():
+    return get_db()[STATE_COLLECTION]
+
+
+def get_state(granularity: str) -> Dict[str, Any]:
+    return _state().find_one({'_id': granularity}) or {}
+
+
+def mark_dirty(earliest: datetime, granularity: str = 'minute'):
+    """登记 watermark 之前的迟到写入；只有早于 watermark 时才会修改状态"""
+    _state().update_one(
+        {'_id': granularity, 'watermark': {'$gt': earliest}},
+        {'$min': {'dirty_from': earliest}},
+    )
+
+
+def _upper_bound(granularity: str, now: datetime) -> Optional[datetime]:
+    """本轮可汇总的上界：分钟级为已经结束并超过等待时间的分钟，上级不超过下一级的 watermark"""
+    if granularity == 'minute':
+        settle = float(getattr(settings, 'ROLLUP_SETTLE_S', 30))
+        return floor_time(now - timedelta(seconds=settle), 'minute')
+    lower = get_state(GRANULARITIES[GRANULARITIES.index(granularity) - 1]).get('watermark')
+    return floor_time(lower, granularity) if lower else None
+
+
+def advance(granularity: str, now: Optional[datetime] = None,
+            initial_lookback: timedelta = timedelta(hours=24)) -> Optional[Tuple[datetime, datetime]]:
+    """
+    执行一个粒度的一轮增量汇总，返回本轮重算的区间；没有需要处理的数据时返回 None。
+    首次运行（没有状态）时从 now - initial_lookback 开始。
+    """
+    now = now or datetime.now()
+    end = _upper_bound(granularity, now)
+    if end is None:
+        return None
+
+    state = get_state(granularity)
+    watermark = state.get('watermark')
+    if watermark is None:
+        watermark = floor_time(now - initial_lookback, granularity)
+        _state().update_one({'_id': granularity}, {'$setOnInsert': {'watermark': watermark}}, upsert=True)
+    dirty_from = state.get('dirty_from')
+    start = floor_time(min(watermark, dirty_from) if dirty_from else watermark, granularity)
+    if start >= end:
+        return None
+
+    rollup_range(granularity, start, end)
+
+    update: Dict[str, Any] = {'$set': {'watermark': max(end, watermark), 'updated_at': datetime.now()}}
+    _state().update_one({'_id': granularity}, update)
+    if dirty_from:
+        # 只清除本轮读到的 dirty_from；期间新登记的更早时间保留到下一轮
+        _state().update_one({'_id': granularity, 'dirty_from': dirty_from}, {'$unset': {'dirty_from': ''}})
+
+    # 级联：本轮重算的区间若早于上级 watermark，标记上级需要重算
+    index = GRANULARITIES.index(granularity)
+    if index + 1 < len(GRANULARITIES):
+        mark_dirty(start, GRANULARITIES[index + 1])
+    return start, end
+
+
+def coverage_start(granularity: str) -> Optional[datetime]:
+    """汇总覆盖的起点：最早的汇总桶（增量模式从首次运行的回看起点开始，更早的数据需要 backfill_rollups）"""
+    doc = get_db()[ROLLUP_COLLECTIONS[granularity]].find_one({}, {'timestamp': 1}, sort=[('timestamp', 1)])
+    return doc['timestamp'] if doc else None
+
+
+def prepare():
+    """确保所有汇总集合的索引（已有重复 timestamp 的旧汇总数据时需先清理该集合）"""
+    for granularity in GRANULARITIES:
+        ensure_rollup_indexes(granularity)
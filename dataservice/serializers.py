@@ -1,6 +1,56 @@
 from rest_framework import serializers
 from .models import SensorData, ManualPlan, DailyManualData, WeatherRecord, HeatPrediction
 
+# SensorDataSerializer 输出的字段（顺序即输出顺序）
+SENSOR_FIELD_NAMES = (
+    'timestamp', 'LDC_1', 'LDC_2', 'LDC_3', 'LDC_4',
+    'S5_01', 'S5_02', 'S5_0301', 'S5_0302', 'S5_0401', 'S5_0402',
+    'PLAN_MONTH', 'HEATSUP_DAY_HG', 'HEATSUP_DAY_STC', 'HEATSUP_DAY_NH',
+    'STEAMSUP_DAY_YC', 'HEATSUP_TOTAL_HG', 'HEATSUP_TOTAL_STC',
+    'HEATSUP_TOTAL_NH', 'STEAMSUP_TOTAL_YC', 'FEED_FLOW_HG',
+    'FEED_FLOW_STC', 'FEED_FLOW_NH', 'BACK_FLOW_HG', 'BACK_FLOW_STC',
+    'BACK_FLOW_NH', 'FEED_P_HG', 'FEED_P_STC', 'FEED_P_NH',
+    'BACK_P_HG', 'BACK_P_STC', 'BACK_P_NH', 'HEATNOW_HG',
+    'HEATNOW_STC', 'HEATNOW_NH', 'FEED_T_HG', 'FEED_T_STC',
+    'FEED_T_NH', 'BACK_T_HG', 'BACK_T_STC', 'BACK_T_NH',
+    'DRAIN_BH_03', 'DRAIN_BH_04', 'DRAIN_NH_03', 'DRAIN_NH_04',
+    'MAKEUP_BH_N', 'MAKEUP_BH_N_TOTAL', 'MAKEUP_BH_E', 'MAKEUP_BH_E_TOTAL',
+    'MAKEUP_NH_N', 'MAKEUP_NH_N_TOTAL', 'MAKEUP_NH_E', 'MAKEUP_NH_E_TOTAL',
+    'STEAMNOW_YC', 'U1_FLOW', 'U2_FLOW', 'U3_FLOW', 'U4_FLOW',
+    'U5_FLOW', 'U6_FLOW', 'U7_FLOW', 'U8_FLOW', 'F_STEAM_FLOW',
+    'F_DRAIN_FLOW', 'F_FEED_T', 'F_BACK_T',
+)
+SENSOR_VALUE_FIELD_NAMES = SENSOR_FIELD_NAMES[1:]
+
+
+def format_timestamp(value):
+    """与 DateTimeField(format="%Y-%m-%d %H:%M:%S") 输出一致；naive 时间用 isoformat，比 strftime 快数倍"""
+    if not value:
+        return value
+    if value.tzinfo is None and value.year >= 1000:
+        return value.isoformat(' ', 'seconds')
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def sensor_doc_to_dict(doc):
+    """
+    只读快速路径：把 pymongo 返回的原始文档（或 storage 的行字典）直接转换为与
+    SensorDataSerializer(...).data 相同的字典，不构造 mongoengine 文档对象。
+    整数值与 FloatField 一样转换为浮点数。
+    """
+    if doc is None:
+        return None
+    get = doc.get
+    _id = get('_id')
+    data = {'id': str(_id) if _id else None, 'timestamp': format_timestamp(get('timestamp'))}
+    for name in SENSOR_VALUE_FIELD_NAMES:
+        value = get(name)
+        if value.__class__ is int:
+            value = float(value)
+        data[name] = value
+    return data
+
+
 class SensorDataSerializer(serializers.Serializer):
     """
     传感器数据序列化器，手动处理MongoEngine文档序列化
@@ -125,27 +175,7 @@ class SensorDataSerializer(serializers.Serializer):
         # 添加id字段
         data['id'] = str(instance.id) if hasattr(instance, 'id') and instance.id else None
         
-        # 处理所有字段
-        field_names = [
-            'timestamp', 'LDC_1', 'LDC_2', 'LDC_3', 'LDC_4',
-            'S5_01', 'S5_02', 'S5_0301', 'S5_0302', 'S5_0401', 'S5_0402',
-            'PLAN_MONTH', 'HEATSUP_DAY_HG', 'HEATSUP_DAY_STC', 'HEATSUP_DAY_NH', 
-            'STEAMSUP_DAY_YC', 'HEATSUP_TOTAL_HG', 'HEATSUP_TOTAL_STC', 
-            'HEATSUP_TOTAL_NH', 'STEAMSUP_TOTAL_YC', 'FEED_FLOW_HG', 
-            'FEED_FLOW_STC', 'FEED_FLOW_NH', 'BACK_FLOW_HG', 'BACK_FLOW_STC', 
-            'BACK_FLOW_NH', 'FEED_P_HG', 'FEED_P_STC', 'FEED_P_NH', 
-            'BACK_P_HG', 'BACK_P_STC', 'BACK_P_NH', 'HEATNOW_HG', 
-            'HEATNOW_STC', 'HEATNOW_NH', 'FEED_T_HG', 'FEED_T_STC', 
-            'FEED_T_NH', 'BACK_T_HG', 'BACK_T_STC', 'BACK_T_NH',
-            'DRAIN_BH_03', 'DRAIN_BH_04', 'DRAIN_NH_03', 'DRAIN_NH_04',
-            'MAKEUP_BH_N', 'MAKEUP_BH_N_TOTAL', 'MAKEUP_BH_E', 'MAKEUP_BH_E_TOTAL',
-            'MAKEUP_NH_N', 'MAKEUP_NH_N_TOTAL', 'MAKEUP_NH_E', 'MAKEUP_NH_E_TOTAL',
-            'STEAMNOW_YC', 'U1_FLOW', 'U2_FLOW', 'U3_FLOW', 'U4_FLOW',
-            'U5_FLOW', 'U6_FLOW', 'U7_FLOW', 'U8_FLOW', 'F_STEAM_FLOW',
-            'F_DRAIN_FLOW', 'F_FEED_T', 'F_BACK_T'
-        ]
-        
-        for field_name in field_names:
+        for field_name in SENSOR_FIELD_NAMES:
             if hasattr(instance, field_name):
                 value = getattr(instance, field_name)
                 if field_name == 'timestamp' and value:
@@ -0,0 +1,181 @@
+"""
+可合并的分位数草图（DDSketch 思路：对数分桶，保证相对误差）。
+
+值 x>0 落入下标 ceil(log_gamma(x)) 的桶，gamma = (1+a)/(1-a)，a 为相对精度（默认 1%），
+负数按绝对值落入单独的桶，0 单独计数。两个草图合并只是按桶相加，因此可以在汇总桶中各存一份，
+查询任意区间时把区间内的草图合并后求分位数，误差不随合并次数累积。
+
+二进制格式（存入汇总文档的 F_sketch 字段）：
+    version(1B) | alpha(float64) | min(float64) | max(float64) | zero_count(varint)
+    | 正数桶数(varint) | [下标差(zigzag varint), 计数(varint)] ...
+    | 负数桶数(varint) | [下标差(zigzag varint), 计数(varint)] ...
+"""
+import math
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+VERSION = 1
+HEADER = struct.Struct('<Bddd')
+
+
+def _write_varint(out: bytearray, value: int):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+class QuantileSketch:
+    """相对误差有界的可合并分位数草图"""
+
+    __slots__ = ('alpha', 'gamma', '_log_gamma', 'positive', 'negative', 'zero_count', 'count', 'min', 'max')
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.alpha = float(relative_accuracy)
+        self.gamma = (1 + self.alpha) / (1 - self.alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    # ------------------------------------------------------------------
+    # 写入与合并
+    # ------------------------------------------------------------------
+
+    def add(self, value: Optional[float]):
+        if value is None or value != value:  # 忽略空值与 NaN
+            return
+        if value > 0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        elif value < 0:
+            index = math.ceil(math.log(-value) / self._log_gamma)
+            self.negative[index] = self.negative.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def extend(self, values: Iterable[Optional[float]]):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: 'QuantileSketch'):
+        if other.count == 0:
+            return self
+        if abs(other.alpha - self.alpha) > 1e-12:
+            raise ValueError('相对精度不同的草图不能合并')
+        for index, n in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + n
+        for index, n in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    def _bin_value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """返回 q 分位数（0 <= q <= 1），空草图返回 None"""
+        if self.count == 0:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError('分位数必须在 0 到 1 之间')
+        if q == 0:
+            return self.min
+        if q == 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = 0
+        # 负数按值从小到大，即绝对值下标从大到小
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return max(self.min, -self._bin_value(index))
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return min(self.max, self._bin_value(index))
+        return self.max
+
+    def quantiles(self, qs: Iterable[float]) -> List[Optional[float]]:
+        return [self.quantile(q) for q in qs]
+
+    # ------------------------------------------------------------------
+    # 序列化
+    # ------------------------------------------------------------------
+
+    def to_bytes(self) -> bytes:
+        out = bytearray(HEADER.pack(VERSION, self.alpha, self.min, self.max))
+        _write_varint(out, self.zero_count)
+        for store in (self.positive, self.negative):
+            _write_varint(out, len(store))
+            previous = 0
+            for index in sorted(store):
+                _write_varint(out, _zigzag(index - previous))
+                _write_varint(out, store[index])
+                previous = index
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'QuantileSketch':
+        version, alpha, min_value, max_value = HEADER.unpack_from(data, 0)
+        if version != VERSION:
+            raise ValueError(f'不支持的草图版本: {version}')
+        sketch = cls(alpha)
+        sketch.min = min_value
+        sketch.max = max_value
+        pos = HEADER.size
+        sketch.zero_count, pos = _read_varint(data, pos)
+        total = sketch.zero_count
+        for store in (sketch.positive, sketch.negative):
+            size, pos = _read_varint(data, pos)
+            index = 0
+            for _ in range(size):
+                delta, pos = _read_varint(data, pos)
+                n, pos = _read_varint(data, pos)
+                index += _unzigzag(delta)
+                store[index] = n
+                total += n
+        sketch.count = total
+        return sketch
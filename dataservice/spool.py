@@ -0,0 +1,252 @@
+"""
+采集数据本地落盘队列（spool）。
+
+数据库写入失败或积压时，采样以追加方式写入本地段文件，数据库恢复后由 SpoolReplayer
+在后台批量回放到 sensor_data，采集节拍不受数据库延迟影响。
+
+文件格式：目录下若干段文件 spool-<序号>.log，每条记录为
+    [4字节大端长度][4字节 crc32][BSON 文档]
+尾部不完整或校验失败的记录（进程被杀时的半条写入）在读取时被丢弃。
+回放进度记录在 replay.checkpoint（"段文件名 偏移量"），段文件回放完即删除。
+"""
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import bson
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>II')
+SEGMENT_RE = re.compile(r'^spool-(\d{12})\.log$')
+CHECKPOINT_NAME = 'replay.checkpoint'
+
+
+class DiskSpool:
+    """追加写的分段落盘队列，线程安全"""
+
+    def __init__(self,
+                 directory: str,
+                 segment_bytes: int = 64 * 1024 * 1024,
+                 fsync_every: int = 100,
+                 fsync_interval: float = 1.0):
+        self.directory = str(directory)
+        self.segment_bytes = max(1024, int(segment_bytes))
+        self.fsync_every = max(1, int(fsync_every))
+        self.fsync_interval = float(fsync_interval)
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_name: Optional[str] = None
+        self._active_size = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        # 启动时已有的段文件（含上次进程未封存的段）全部视为已封存，新数据写入新段
+        existing = self._segment_names()
+        self._next_seq = (int(SEGMENT_RE.match(existing[-1]).group(1)) + 1) if existing else 1
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def append(self, docs: List[Dict[str, Any]]) -> int:
+        """追加若干文档，按 fsync_every/fsync_interval 批量落盘，返回写入条数"""
+        if not docs:
+            return 0
+        payload = bytearray()
+        for doc in docs:
+            data = bson.encode(doc)
+            payload += HEADER.pack(len(data), zlib.crc32(data))
+            payload += data
+        with self._lock:
+            if self._active is None or self._active_size >= self.segment_bytes:
+                self._open_new_segment()
+            self._active.write(payload)
+            self._active_size += len(payload)
+            self._unsynced += len(docs)
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+        return len(docs)
+
+    def sync_if_due(self):
+        with self._lock:
+            if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def seal(self):
+        """封存当前段，使其可以被回放；之后的写入进入新段"""
+        with self._lock:
+            self._close_active()
+
+    def close(self):
+        self.seal()
+
+    def _open_new_segment(self):
+        self._close_active()
+        name = f'spool-{self._next_seq:012d}.log'
+        self._next_seq += 1
+        self._active = open(os.path.join(self.directory, name), 'ab')
+        self._active_name = name
+        self._active_size = 0
+
+    def _close_active(self):
+        if self._active is not None:
+            self._sync()
+            self._active.close()
+            self._active = None
+            self._active_name = None
+            self._active_size = 0
+
+    def _sync(self):
+        if self._active is not None:
+            self._active.flush()
+            os.fsync(self._active.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def _segment_names(self) -> List[str]:
+        return sorted(n for n in os.listdir(self.directory) if SEGMENT_RE.match(n))
+
+    def sealed_segments(self, seal_active: bool = True) -> List[str]:
+        with self._lock:
+            active = self._active_name
+            active_size = self._active_size
+        names = [n for n in self._segment_names() if n != active]
+        # 没有已封存的段但当前段有数据时，封存当前段以便回放
+        if seal_active and not names and active and active_size:
+            self.seal()
+            names = self._segment_names()
+        return names
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            if self._active_size:
+                return True
+            active = self._active_name
+        return any(n != active for n in self._segment_names())
+
+    def read_segment(self, name: str, offset: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """从 offset 开始逐条读取，产出 (下一条记录的偏移量, 文档)；遇到残缺/损坏记录即停止"""
+        path = os.path.join(self.directory, name)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                length, crc = HEADER.unpack(header)
+                data = f.read(length)
+                if len(data) < length or zlib.crc32(data) != crc:
+                    logger.warning('spool 段 %s 在偏移 %s 处记录残缺，丢弃其后内容', name, offset)
+                    return
+                offset += HEADER.size + length
+                yield offset, bson.decode(data)
+
+    def remove_segment(self, name: str):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def load_checkpoint(self) -> Tuple[Optional[str], int]:
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_NAME), 'r', encoding='utf-8') as f:
+                name, offset = f.read().split()
+                return name, int(offset)
+        except (FileNotFoundError, ValueError):
+            return None, 0
+
+    def save_checkpoint(self, name: str, offset: int):
+        path = os.path.join(self.directory, CHECKPOINT_NAME)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(f'{name} {offset}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+class SpoolReplayer:
+    """
+    后台回放线程：周期检查已封存的段，按批调用 write_fn 写回数据库。
+    write_fn 抛出异常（如数据库仍不可用）时保留进度，等待下一个周期重试。
+    """
+
+    def __init__(self,
+                 spool: DiskSpool,
+                 write_fn: Callable[[List[Dict[str, Any]]], Any],
+                 batch_size: int = 500,
+                 interval: float = 5.0):
+        self.spool = spool
+        self.write_fn = write_fn
+        self.batch_size = max(1, int(batch_size))
+        self.interval = float(interval)
+        self.replayed = 0
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='sensor-spool-replayer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.spool.sync_if_due()
+            try:
+                self.drain()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning('spool 回放失败，稍后重试: %s', e)
+            self._stop.wait(self.interval)
+
+    def drain(self) -> int:
+        """回放所有已封存的段，返回本次回放的条数"""
+        total = 0
+        # 上次回放失败（数据库可能仍不可用）时不封存当前段，避免产生大量碎小段文件
+        for name in self.spool.sealed_segments(seal_active=self.last_error is None):
+            if self._stop.is_set():
+                break
+            ck_name, offset = self.spool.load_checkpoint()
+            if ck_name != name:
+                offset = 0
+            batch: List[Dict[str, Any]] = []
+            next_offset = offset
+            for next_offset, doc in self.spool.read_segment(name, offset):
+                batch.append(doc)
+                if len(batch) >= self.batch_size:
+                    self.write_fn(batch)
+                    total += len(batch)
+                    self.replayed += len(batch)
+                    self.spool.save_checkpoint(name, next_offset)
+                    batch = []
+            if batch:
+                self.write_fn(batch)
+                total += len(batch)
+                self.replayed += len(batch)
+                # 先记录断点再删除段文件：两步之间崩溃时不会重复回放最后一批
+                self.spool.save_checkpoint(name, next_offset)
+            self.spool.remove_segment(name)
+            self.spool.save_checkpoint('-', 0)
+        if total:
+            logger.info('spool 回放完成 %s 条', total)
+        return total
@@ -0,0 +1,327 @@
+"""
+传感器数据存储布局适配层。
+
+- document（默认）：每个采样点一条宽文档，集合 sensor_data
+- timeseries：文档结构与 document 相同，但 sensor_data 为 MongoDB 原生时间序列集合
+  （timeField=timestamp，granularity=seconds），由服务端做列式压缩分桶
+- bucket：按 unit + 分钟/小时分桶，每桶一条文档，字段值以数组存放，集合 sensor_data_bucket
+
+分桶文档结构：
+{
+    unit: 'main', start: <桶起始时间>, first: <桶内最早采样>, end: <桶内最新采样>, count: N,
+    ts: [t0, t1, ...],
+    v: {LDC_1: [..], LDC_2: [..], ...}   # 与 ts 按下标对齐，缺失值为 null
+}
+
+读路径统一使用 aggregate_rows()/find_rows()/count_rows()/latest_row()，
+返回与 sensor_data 相同结构的“行”文档，调用方无需关心底层布局。
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+from django.conf import settings
+from mongoengine.connection import get_db
+from pymongo import UpdateOne
+
+from .models import SensorData, SENSOR_FIELDS
+
+MODE_DOCUMENT = 'document'
+MODE_TIMESERIES = 'timeseries'
+MODE_BUCKET = 'bucket'
+
+SENSOR_COLLECTION = 'sensor_data'
+BUCKET_COLLECTION = 'sensor_data_bucket'
+DEFAULT_UNIT = 'main'
+
+# 与 SensorData 的 TTL 保持一致：3年
+SENSOR_TTL_SECONDS = 94608000
+BUCKET_TTL_SECONDS = SENSOR_TTL_SECONDS
+
+
+def storage_mode() -> str:
+    """当前存储布局，来自 settings.SENSOR_STORAGE_MODE"""
+    return getattr(settings, 'SENSOR_STORAGE_MODE', MODE_DOCUMENT) or MODE_DOCUMENT
+
+
+def is_bucket_mode() -> bool:
+    return storage_mode() == MODE_BUCKET
+
+
+def is_timeseries_mode() -> bool:
+    return storage_mode() == MODE_TIMESERIES
+
+
+def timeseries_options() -> Dict[str, Any]:
+    """创建 sensor_data 时间序列集合的参数"""
+    return {
+        'timeseries': {'timeField': 'timestamp', 'granularity': 'seconds'},
+        'expireAfterSeconds': SENSOR_TTL_SECONDS,
+    }
+
+
+def is_timeseries_collection(db, name: str = SENSOR_COLLECTION) -> bool:
+    info = list(db.list_collections(filter={'name': name}))
+    return bool(info) and info[0].get('type') == 'timeseries'
+
+
+def create_timeseries_collection(db, name: str = SENSOR_COLLECTION):
+    """创建时间序列集合及倒序索引（需要 MongoDB 6.0+）"""
+    db.create_collection(name, **timeseries_options())
+    db[name].create_index([('timestamp', -1)], name='ts_desc')
+    return db[name]
+
+
+def bucket_granularity() -> str:
+    granularity = getattr(settings, 'SENSOR_BUCKET_GRANULARITY', 'minute')
+    return granularity if granularity in ('minute', 'hour') else 'minute'
+
+
+def bucket_start(ts: datetime, granularity: Optional[str] = None) -> datetime:
+    """将时间向下取整到所在桶的起始时间"""
+    granularity = granularity or bucket_granularity()
+    if granularity == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(second=0, microsecond=0)
+
+
+def get_bucket_collection():
+    return get_db()[BUCKET_COLLECTION]
+
+
+def ensure_bucket_indexes(coll=None):
+    """分桶集合索引：(unit, start) 唯一，start 倒序用于取最新，end 上的 TTL 用于过期清理"""
+    coll = coll if coll is not None else get_bucket_collection()
+    coll.create_index([('unit', 1), ('start', 1)], unique=True, name='uniq_unit_start')
+    coll.create_index([('start', -1)], name='start_desc')
+    coll.create_index('end', expireAfterSeconds=BUCKET_TTL_SECONDS, name='ttl_end')
+
+
+# ---------------------------------------------------------------------------
+# 写入
+# ---------------------------------------------------------------------------
+
+def bucket_updates(samples: Iterable[Dict[str, Any]], unit: str = DEFAULT_UNIT) -> List[UpdateOne]:
+    """
+    把一批采样（与 SensorData 字段同名的字典）合并为按桶的 upsert 操作。
+    同一桶内的多条采样用 $push/$each 一次追加，保持 ts 与各字段数组下标对齐。
+    """
+    grouped: Dict[datetime, List[Dict[str, Any]]] = {}
+    for sample in samples:
+        grouped.setdefault(bucket_start(sample['timestamp']), []).append(sample)
+
+    ops: List[UpdateOne] = []
+    for start, items in grouped.items():
+        timestamps = [it['timestamp'] for it in items]
+        push = {'ts': {'$each': timestamps}}
+        for f in SENSOR_FIELDS:
+            push['v.' + f] = {'$each': [it.get(f) for it in items]}
+        ops.append(UpdateOne(
+            {'unit': unit, 'start': start},
+            {
+                '$push': push,
+                '$inc': {'count': len(items)},
+                '$min': {'first': min(timestamps)},
+                '$max': {'end': max(timestamps)},
+            },
+            upsert=True,
+        ))
+    return ops
+
+
+def insert_rows(rows: Sequence[Dict[str, Any]], write_concern=None) -> int:
+    """
+    按当前存储布局批量写入采样行，返回写入的行数。
+    document 模式使用无序 insert_many；bucket 模式合并为按桶的无序 bulk_write。
+    """
+    if not rows:
+        return 0
+    if is_bucket_mode():
+        coll = get_bucket_collection()
+        if write_concern is not None:
+            coll = coll.with_options(write_concern=write_concern)
+        coll.bulk_write(bucket_updates(rows), ordered=False)
+        return len(rows)
+
+    coll = SensorData._get_collection()
+    if write_concern is not None:
+        coll = coll.with_options(write_concern=write_concern)
+    result = coll.insert_many(list(rows), ordered=False)
+    return len(result.inserted_ids)
+
+
+def existing_row_ids(rows: Sequence[Dict[str, Any]]) -> Set[Any]:
+    """
+    查询一批采样中已经写入的 _id。时间序列集合不校验 _id 唯一，重试/回放前用它去重；
+    按批次的时间范围过滤，走 timestamp 索引。
+    """
+    if not rows:
+        return set()
+    timestamps = [row['timestamp'] for row in rows]
+    cursor = SensorData._get_collection().find(
+        {'timestamp': {'$gte': min(timestamps), '$lte': max(timestamps)},
+         '_id': {'$in': [row['_id'] for row in rows]}},
+        {'_id': 1},
+    )
+    return {doc['_id'] for doc in cursor}
+
+
+# ---------------------------------------------------------------------------
+# 读取（行视图）
+# ---------------------------------------------------------------------------
+
+def _bucket_prefilter(time_cond: Any) -> Dict[str, Any]:
+    """把作用于 timestamp 的条件转换为桶级过滤，使其能走 start/end 索引"""
+    if isinstance(time_cond, datetime):
+        return {'start': {'$lte': time_cond}, 'end': {'$gte': time_cond}}
+    if not isinstance(time_cond, dict):
+        return {}
+    prefilter: Dict[str, Any] = {}
+    for op, value in time_cond.items():
+        if op in ('$gte', '$gt'):
+            prefilter.setdefault('end', {})[op] = value
+        elif op in ('$lte', '$lt'):
+            prefilter.setdefault('start', {})[op] = value
+    return prefilter
+
+
+def bucket_row_stages(time_cond: Any = None, fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """
+    将分桶文档展开为与 sensor_data 同结构的行：{_id, timestamp, field...}。
+    _id 为 "<桶ID>:<下标>"，仅用于展示与排序稳定。
+    """
+    fields = list(fields) if fields else list(SENSOR_FIELDS)
+    stages: List[Dict[str, Any]] = []
+    prefilter = _bucket_prefilter(time_cond)
+    if prefilter:
+        stages.append({'$match': prefilter})
+
+    row = {
+        '_id': {'$concat': [{'$toString': '$_id'}, ':', {'$toString': '$_i'}]},
+        'timestamp': '$ts',
+    }
+    for f in fields:
+        row[f] = {'$arrayElemAt': ['$v.' + f, '$_i']}
+
+    stages.extend([
+        {'$unwind': {'path': '$ts', 'includeArrayIndex': '_i'}},
+        {'$replaceWith': row},
+    ])
+    if time_cond is not None:
+        stages.append({'$match': {'timestamp': time_cond}})
+    return stages
+
+
+def aggregate_rows(match: Optional[Dict[str, Any]] = None,
+                   stages: Optional[List[Dict[str, Any]]] = None,
+                   fields: Optional[Sequence[str]] = None,
+                   **kwargs):
+    """
+    在“行视图”上执行聚合，返回 pymongo cursor。
+    document 模式直接作用于 sensor_data；bucket 模式先展开分桶，再应用 match 和后续 stages。
+    """
+    match = dict(match or {})
+    if is_bucket_mode():
+        pipeline = bucket_row_stages(match.pop('timestamp', None), fields)
+        coll = get_bucket_collection()
+    else:
+        pipeline = []
+        coll = SensorData._get_collection()
+    if match:
+        pipeline.append({'$match': match})
+    pipeline.extend(stages or [])
+    kwargs.setdefault('allowDiskUse', True)
+    return coll.aggregate(pipeline, **kwargs)
+
+
+def find_rows(match: Optional[Dict[str, Any]] = None,
+              fields: Optional[Sequence[str]] = None,
+              sort: Optional[List] = None,
+              skip: int = 0,
+              limit: int = 0,
+              batch_size: Optional[int] = None):
+    """
+    读取行文档（可迭代）。document 模式使用 find 以便直接利用索引与游标；
+    bucket 模式通过 aggregate_rows 展开后排序/分页。
+    """
+    sort = sort or [('timestamp', -1)]
+    if not is_bucket_mode():
+        projection = None
+        if fields:
+            projection = {f: 1 for f in fields}
+            projection['timestamp'] = 1
+        cursor = SensorData._get_collection().find(match or {}, projection).sort(sort)
+        if skip:
+            cursor = cursor.skip(skip)
+        if limit:
+            cursor = cursor.limit(limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    stages: List[Dict[str, Any]] = [{'$sort': dict(sort)}]
+    if skip:
+        stages.append({'$skip': skip})
+    if limit:
+        stages.append({'$limit': limit})
+    kwargs = {'batchSize': batch_size} if batch_size else {}
+    return aggregate_rows(match, stages, fields=fields, **kwargs)
+
+
+def bucket_count_stages(time_cond: Any = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    只有时间条件（或无条件）时的分桶计数：整桶落在范围内的直接累加桶的 count，
+    只对跨越边界的桶过滤 ts 数组，不展开任何桶。条件不是 $gte/$gt/$lte/$lt 组合时返回 None。
+    """
+    if time_cond is None:
+        return [{'$group': {'_id': None, 'n': {'$sum': '$count'}}}]
+    if isinstance(time_cond, datetime):
+        time_cond = {'$gte': time_cond, '$lte': time_cond}
+    if not isinstance(time_cond, dict) or not time_cond or set(time_cond) - {'$gte', '$gt', '$lte', '$lt'}:
+        return None
+    # 桶内最早采样满足下界、最新采样满足上界，即整桶在范围内
+    inside = [{op: ['$first' if op in ('$gte', '$gt') else '$end', value]} for op, value in time_cond.items()]
+    in_range = [{op: ['$$t', value]} for op, value in time_cond.items()]
+    matched = {'$size': {'$filter': {'input': '$ts', 'as': 't', 'cond': {'$and': in_range}}}}
+    return [
+        {'$match': _bucket_prefilter(time_cond)},
+        {'$group': {'_id': None, 'n': {'$sum': {'$cond': [{'$and': inside}, '$count', matched]}}}},
+    ]
+
+
+def count_rows(match: Optional[Dict[str, Any]] = None, max_time_ms: Optional[int] = None) -> int:
+    """
+    计数；指定 max_time_ms 时超时抛出 pymongo.errors.ExecutionTimeout。
+    bucket 模式只有时间条件时按桶累加（bucket_count_stages），有字段条件时才展开为行后计数。
+    """
+    kwargs = {'maxTimeMS': max_time_ms} if max_time_ms else {}
+    if not is_bucket_mode():
+        return SensorData._get_collection().count_documents(match or {}, **kwargs)
+    match = match or {}
+    stages = bucket_count_stages(match.get('timestamp')) if not match.keys() - {'timestamp'} else None
+    if stages is not None:
+        result = list(get_bucket_collection().aggregate(stages, **kwargs))
+        return result[0]['n'] if result else 0
+    result = list(aggregate_rows(match, [{'$count': 'n'}], **kwargs))
+    return result[0]['n'] if result else 0
+
+
+def latest_row(fields: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+    """读取最新一行（bucket 模式只读取最新的一个桶）"""
+    if not is_bucket_mode():
+        projection = None
+        if fields:
+            projection = {f: 1 for f in fields}
+            projection['timestamp'] = 1
+        return SensorData._get_collection().find_one({}, projection, sort=[('timestamp', -1)])
+
+    bucket = get_bucket_collection().find_one({}, sort=[('start', -1)])
+    if not bucket or not bucket.get('ts'):
+        return None
+    timestamps = bucket['ts']
+    i = max(range(len(timestamps)), key=timestamps.__getitem__)
+    values = bucket.get('v') or {}
+    row = {'_id': f"{bucket['_id']}:{i}", 'timestamp': timestamps[i]}
+    for f in (fields or SENSOR_FIELDS):
+        column = values.get(f) or []
+        row[f] = column[i] if i < len(column) else None
+    return row
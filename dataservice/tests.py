@@ -1,3 +1,1110 @@
-from django.test import TestCase
+import gzip
+import io
+import operator
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipIf
 
-# Create your tests here.
+import numpy as np
+from bson import ObjectId
+from django.test import SimpleTestCase, override_settings
+from pymongo import ReplaceOne
+from pymongo.errors import AutoReconnect
+
+from . import exporter, importer, ingest, repository, rollups, storage
+from .columnar import EpochConverter, build_columns
+from .downsample import check_budget, downsample, lttb_indices, minmax_indices
+from .ingest import BufferedSensorWriter
+from .sketch import QuantileSketch
+from .spool import HEADER, DiskSpool, SpoolReplayer
+from .views import decode_page_cursor, encode_page_cursor
+
+
+@override_settings(SENSOR_STORAGE_MODE='bucket', SENSOR_BUCKET_GRANULARITY='minute')
+class BucketLayoutTests(SimpleTestCase):
+    """bucket 模式：采样按桶合并为 upsert，读取时展开为与 sensor_data 同结构的行"""
+
+    def test_samples_grouped_per_bucket(self):
+        start = datetime(2024, 1, 1, 8, 0, 50)
+        samples = [{'timestamp': start + timedelta(seconds=10 * i), 'LDC_1': float(i)} for i in range(3)]
+        ops = storage.bucket_updates(samples, unit='u1')
+        self.assertEqual([op._filter for op in ops], [
+            {'unit': 'u1', 'start': datetime(2024, 1, 1, 8, 0)},
+            {'unit': 'u1', 'start': datetime(2024, 1, 1, 8, 1)},
+        ])
+        update = ops[1]._doc
+        self.assertEqual(update['$push']['ts'], {'$each': [samples[1]['timestamp'], samples[2]['timestamp']]})
+        self.assertEqual(update['$push']['v.LDC_1'], {'$each': [1.0, 2.0]})
+        self.assertEqual(update['$push']['v.LDC_2'], {'$each': [None, None]})
+        self.assertEqual(update['$inc'], {'count': 2})
+        self.assertEqual((update['$min'], update['$max']),
+                         ({'first': samples[1]['timestamp']}, {'end': samples[2]['timestamp']}))
+        self.assertTrue(ops[1]._upsert)
+
+    def test_row_stages_prefilter_buckets(self):
+        start, end = datetime(2024, 1, 1, 8), datetime(2024, 1, 1, 9)
+        stages = storage.bucket_row_stages({'$gte': start, '$lt': end}, fields=['LDC_1'])
+        self.assertEqual(stages[0], {'$match': {'end': {'$gte': start}, 'start': {'$lt': end}}})
+        self.assertEqual(stages[1], {'$unwind': {'path': '$ts', 'includeArrayIndex': '_i'}})
+        self.assertEqual(stages[2]['$replaceWith']['LDC_1'], {'$arrayElemAt': ['$v.LDC_1', '$_i']})
+        self.assertNotIn('LDC_2', stages[2]['$replaceWith'])
+        self.assertEqual(stages[-1], {'$match': {'timestamp': {'$gte': start, '$lt': end}}})
+        self.assertEqual(storage.bucket_row_stages(start)[0],
+                         {'$match': {'start': {'$lte': start}, 'end': {'$gte': start}}})
+
+
+@override_settings(SENSOR_STORAGE_MODE='bucket')
+class BucketCountTests(SimpleTestCase):
+    """bucket 模式计数：只有时间条件时按桶累加 count，不展开桶"""
+
+    def count(self, match):
+        collection = mock.Mock()
+        collection.aggregate.return_value = iter([{'n': 42}])
+        with mock.patch.object(storage, 'get_bucket_collection', return_value=collection), \
+                mock.patch.object(storage, 'aggregate_rows', return_value=iter([{'n': 7}])) as rows:
+            n = storage.count_rows(match, max_time_ms=500)
+        return n, collection, rows
+
+    def test_unfiltered_sums_bucket_counts(self):
+        n, collection, rows = self.count(None)
+        self.assertEqual(n, 42)
+        rows.assert_not_called()
+        pipeline = collection.aggregate.call_args[0][0]
+        self.assertEqual(pipeline, [{'$group': {'_id': None, 'n': {'$sum': '$count'}}}])
+        self.assertEqual(collection.aggregate.call_args[1], {'maxTimeMS': 500})
+
+    def test_time_range_only_filters_edge_buckets(self):
+        start, end = datetime(2024, 1, 1, 8, 0, 30), datetime(2024, 1, 1, 9, 0)
+        n, collection, rows = self.count({'timestamp': {'$gte': start, '$lt': end}})
+        self.assertEqual(n, 42)
+        rows.assert_not_called()
+        prefilter, group = collection.aggregate.call_args[0][0]
+        self.assertEqual(prefilter, {'$match': {'end': {'$gte': start}, 'start': {'$lt': end}}})
+        inside, whole, edge = group['$group']['n']['$sum']['$cond']
+        self.assertEqual(inside, {'$and': [{'$gte': ['$first', start]}, {'$lt': ['$end', end]}]})
+        self.assertEqual(whole, '$count')
+        self.assertEqual(edge['$size']['$filter']['cond'],
+                         {'$and': [{'$gte': ['$$t', start]}, {'$lt': ['$$t', end]}]})
+        self.assertNotIn('$unwind', str(group))
+
+    def test_field_filter_unwinds_rows(self):
+        match = {'timestamp': {'$gte': datetime(2024, 1, 1)}, 'LDC_1': {'$gt': 1}}
+        n, collection, rows = self.count(match)
+        self.assertEqual(n, 7)
+        collection.aggregate.assert_not_called()
+        self.assertEqual(rows.call_args[0][0], match)
+
+    def test_unsupported_time_condition_falls_back(self):
+        self.assertIsNone(storage.bucket_count_stages({'$in': [datetime(2024, 1, 1)]}))
+        n, collection, rows = self.count({'timestamp': {'$ne': datetime(2024, 1, 1)}})
+        self.assertEqual(n, 7)
+        self.assertEqual(rows.call_args[0][0], {'timestamp': {'$ne': datetime(2024, 1, 1)}})
+
+
+class BufferedWriterTests(SimpleTestCase):
+    """批量写入器：按条数/时间刷新、关闭时写完缓冲区、重试去重与落盘"""
+
+    def setUp(self):
+        self.inserted = []
+        self.insert_errors = []
+        self.existing = set()
+        self.patch(storage, 'insert_rows', self.fake_insert)
+        self.patch(storage, 'existing_row_ids', self.fake_existing)
+        self.patch(ingest.latest_cache, 'publish', mock.Mock())
+        self.patch(ingest.latest_cache, 'invalidate', mock.Mock())
+        self.patch(ingest.rollups, 'mark_dirty', mock.Mock())
+
+    def patch(self, target, name, replacement):
+        patcher = mock.patch.object(target, name, replacement)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_insert(self, rows, write_concern=None):
+        if self.insert_errors:
+            raise self.insert_errors.pop(0)
+        self.inserted.append(list(rows))
+        return len(rows)
+
+    def fake_existing(self, rows):
+        return {row['_id'] for row in rows} & self.existing
+
+    def samples(self, count):
+        start = datetime(2024, 1, 1, 8, 0)
+        return [{'timestamp': start + timedelta(seconds=i), 'LDC_1': float(i)} for i in range(count)]
+
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_flush_when_batch_is_full(self):
+        writer = BufferedSensorWriter(batch_size=3, flush_interval=3600).start()
+        self.addCleanup(writer.close)
+        samples = self.samples(5)
+        for sample in samples[:3]:
+            writer.add(sample)
+        self.assertTrue(self.wait_for(lambda: self.inserted))
+        self.assertEqual(self.inserted, [samples[:3]])
+        for sample in samples[3:]:
+            writer.add(sample)
+        time.sleep(0.1)
+        self.assertEqual(len(self.inserted), 1)
+        self.assertEqual(writer.pending(), 2)
+
+    def test_flush_after_interval(self):
+        writer = BufferedSensorWriter(batch_size=100, flush_interval=0.05).start()
+        self.addCleanup(writer.close)
+        writer.add(self.samples(1)[0])
+        self.assertTrue(self.wait_for(lambda: self.inserted))
+        self.assertEqual(writer.stats()['flushed'], 1)
+        ingest.rollups.mark_dirty.assert_called_once_with(datetime(2024, 1, 1, 8, 0))
+
+    def test_close_flushes_remaining_samples(self):
+        writer = BufferedSensorWriter(batch_size=100, flush_interval=3600).start()
+        samples = self.samples(4)
+        for sample in samples:
+            writer.add(sample)
+        writer.close()
+        self.assertEqual(self.inserted, [samples])
+        self.assertTrue(all(isinstance(doc['_id'], ObjectId) for doc in samples))
+        self.assertEqual(writer.stats()['pending'], 0)
+
+    def test_retry_after_network_error(self):
+        writer = BufferedSensorWriter(batch_size=100, flush_interval=3600, retry_backoff=0)
+        samples = self.samples(3)
+        for sample in samples:
+            writer.add(sample)
+        self.insert_errors = [AutoReconnect('lost')]
+        self.assertEqual(writer.flush(), 3)
+        self.assertEqual(self.inserted, [samples])
+        self.assertEqual(writer.stats()['retried'], 3)
+
+    @override_settings(SENSOR_STORAGE_MODE='timeseries')
+    def test_timeseries_dedupe_skips_existing_ids(self):
+        batch = [dict(doc, _id=ObjectId()) for doc in self.samples(4)]
+        self.existing = {batch[0]['_id'], batch[2]['_id']}
+        self.assertEqual(ingest.write_batch(batch, dedupe=True), (4, 0))
+        self.assertEqual(self.inserted, [[batch[1], batch[3]]])
+        # 首次写入不查询
+        self.assertEqual(ingest.write_batch(batch[:1]), (1, 0))
+        self.assertEqual(self.inserted[-1], batch[:1])
+
+    @override_settings(SENSOR_STORAGE_MODE='timeseries')
+    def test_retry_dedupes_partially_written_batch(self):
+        writer = BufferedSensorWriter(batch_size=100, flush_interval=3600, retry_backoff=0)
+        samples = self.samples(3)
+        for sample in samples:
+            writer.add(sample)
+        self.existing = {samples[0]['_id']}
+        self.insert_errors = [AutoReconnect('lost')]
+        self.assertEqual(writer.flush(), 3)
+        self.assertEqual(self.inserted, [samples[1:]])
+        self.assertEqual(writer.stats()['retried'], 3)
+
+    def test_failed_after_retries_without_spool(self):
+        writer = BufferedSensorWriter(batch_size=100, flush_interval=3600, max_retries=1, retry_backoff=0)
+        writer.add(self.samples(1)[0])
+        self.insert_errors = [AutoReconnect('down'), AutoReconnect('down')]
+        self.assertEqual(writer.flush(), 0)
+        stats = writer.stats()
+        self.assertEqual((stats['failed'], stats['retried']), (1, 1))
+        self.assertEqual(stats['last_error'], 'down')
+
+    def test_spool_after_retries_exhausted(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        writer = BufferedSensorWriter(batch_size=100, flush_interval=3600, max_retries=1, retry_backoff=0,
+                                      spool=DiskSpool(directory, fsync_every=1))
+        samples = self.samples(2)
+        for sample in samples:
+            writer.add(sample)
+        self.insert_errors = [AutoReconnect('down'), AutoReconnect('down')]
+        self.assertEqual(writer.flush(), 0)
+        stats = writer.stats()
+        self.assertEqual((stats['spooled'], stats['failed']), (2, 0))
+        self.assertTrue(stats['spool_pending'])
+        writer.spool.seal()
+        name = writer.spool.sealed_segments()[0]
+        self.assertEqual([doc for _, doc in writer.spool.read_segment(name)], samples)
+
+
+class DiskSpoolTests(SimpleTestCase):
+    """spool 段文件的分帧、CRC 校验与回放断点"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.spool = DiskSpool(self.directory, fsync_every=1)
+
+    def docs(self, count, start=0):
+        return [{'_id': ObjectId(), 'timestamp': datetime(2024, 1, 1, 0, 0, i % 60), 'LDC_1': float(start + i)}
+                for i in range(count)]
+
+    def read_all(self, name):
+        return [doc for _, doc in self.spool.read_segment(name)]
+
+    def test_round_trip(self):
+        docs = self.docs(5)
+        self.spool.append(docs)
+        self.spool.seal()
+        names = self.spool.sealed_segments()
+        self.assertEqual(len(names), 1)
+        self.assertEqual(self.read_all(names[0]), docs)
+
+    def test_truncated_tail_is_dropped(self):
+        docs = self.docs(3)
+        self.spool.append(docs)
+        self.spool.seal()
+        name = self.spool.sealed_segments()[0]
+        with open(os.path.join(self.directory, name), 'ab') as f:
+            f.write(HEADER.pack(100, 0) + b'partial')
+        self.assertEqual(self.read_all(name), docs)
+
+    def test_crc_mismatch_stops_reading(self):
+        docs = self.docs(3)
+        self.spool.append(docs)
+        self.spool.seal()
+        name = self.spool.sealed_segments()[0]
+        path = os.path.join(self.directory, name)
+        with open(path, 'rb') as f:
+            data = bytearray(f.read())
+        # 破坏第二条记录的最后一个字节
+        first_length = HEADER.unpack_from(data, 0)[0]
+        second_start = HEADER.size + first_length
+        second_length = HEADER.unpack_from(data, second_start)[0]
+        data[second_start + HEADER.size + second_length - 1] ^= 0xFF
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.assertEqual(self.read_all(name), docs[:1])
+
+    def test_read_from_offset(self):
+        docs = self.docs(4)
+        self.spool.append(docs)
+        self.spool.seal()
+        name = self.spool.sealed_segments()[0]
+        offsets = [offset for offset, _ in self.spool.read_segment(name)]
+        self.assertEqual([doc for _, doc in self.spool.read_segment(name, offsets[1])], docs[2:])
+
+    def test_replayer_drains_in_order_and_removes_segments(self):
+        docs = self.docs(7)
+        self.spool.append(docs[:4])
+        self.spool.seal()
+        self.spool.append(docs[4:])
+        self.spool.seal()
+        written = []
+        replayer = SpoolReplayer(self.spool, written.extend, batch_size=3)
+        self.assertEqual(replayer.drain(), 7)
+        self.assertEqual(written, docs)
+        self.assertEqual(self.spool.sealed_segments(), [])
+        self.assertFalse(self.spool.has_pending())
+
+    def test_last_partial_batch_is_checkpointed_before_removal(self):
+        docs = self.docs(5)
+        self.spool.append(docs)
+        self.spool.seal()
+        name = self.spool.sealed_segments()[0]
+        end_offset = [offset for offset, _ in self.spool.read_segment(name)][-1]
+
+        def crash(segment):
+            raise RuntimeError('crash')
+
+        self.spool.remove_segment = crash
+        replayer = SpoolReplayer(self.spool, lambda batch: None, batch_size=2)
+        with self.assertRaises(RuntimeError):
+            replayer.drain()
+        self.assertEqual(self.spool.load_checkpoint(), (name, end_offset))
+
+    def test_failed_write_keeps_checkpoint(self):
+        docs = self.docs(4)
+        self.spool.append(docs)
+        self.spool.seal()
+        name = self.spool.sealed_segments()[0]
+        calls = []
+
+        def write(batch):
+            calls.append(list(batch))
+            if len(calls) == 2:
+                raise ConnectionError('down')
+
+        replayer = SpoolReplayer(self.spool, write, batch_size=2)
+        with self.assertRaises(ConnectionError):
+            replayer.drain()
+        checkpoint_name, offset = self.spool.load_checkpoint()
+        self.assertEqual(checkpoint_name, name)
+        self.assertEqual([doc for _, doc in self.spool.read_segment(name, offset)], docs[2:])
+
+
+class CsvImportTests(SimpleTestCase):
+    """CSV 流式导入：表头映射、坏行处理与批次边界"""
+
+    HEADER = '时间戳,#1机负荷(MW),LDC_2,ID\n'
+
+    def setUp(self):
+        self.batches = []
+        patcher = mock.patch.object(importer, 'write_batch', self.fake_write)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(importer.rollups, 'mark_dirty')
+        self.mark_dirty = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_write(self, batch, write_concern=None, dedupe=False):
+        self.batches.append(list(batch))
+        return len(batch), 0
+
+    def run_import(self, text, **kwargs):
+        return importer.import_csv(io.BytesIO(text.encode('utf-8-sig')), **kwargs)
+
+    def test_rows_are_converted_in_batches(self):
+        lines = ''.join(f'2024-01-01 08:00:0{i},{i}.5,{i},x{i}\n' for i in range(5))
+        result = self.run_import(self.HEADER + lines, batch_size=2)
+        self.assertEqual([len(batch) for batch in self.batches], [2, 2, 1])
+        self.assertEqual(self.batches[0][1], {'timestamp': datetime(2024, 1, 1, 8, 0, 1), 'LDC_1': 1.5, 'LDC_2': 1.0})
+        self.assertEqual((result['rows'], result['created'], result['errors'], result['skipped']), (5, 5, 0, 0))
+        self.mark_dirty.assert_called_once_with(datetime(2024, 1, 1, 8, 0))
+
+    def test_bad_rows_are_reported_with_line_numbers(self):
+        text = self.HEADER + (
+            '2024-01-01 08:00:00,1,2,a\n'
+            '2024-01-01 08:00:01,abc,2,b\n'
+            ',,,\n'
+            ',3,4,c\n'
+            'not a time,1,1,d\n'
+            '2024-01-01T08:00:05,5,,e\n'
+        )
+        result = self.run_import(text)
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['skipped'], 1)
+        self.assertEqual([r['line'] for r in result['rejected']], [3, 5, 6])
+        self.assertTrue(result['rejected'][0]['error'].startswith('LDC_1:'))
+        self.assertEqual(result['rejected'][1]['error'], 'timestamp: 缺少时间戳')
+        self.assertEqual(self.batches[0][1], {'timestamp': datetime(2024, 1, 1, 8, 0, 5), 'LDC_1': 5.0})
+
+    @override_settings(IMPORT_MAX_BATCH_SIZE=3)
+    def test_batch_size_is_capped(self):
+        lines = ''.join(f'2024-01-01 08:00:0{i},{i}\n' for i in range(7))
+        self.run_import('timestamp,LDC_1\n' + lines, batch_size=100000)
+        self.assertEqual([len(batch) for batch in self.batches], [3, 3, 1])
+
+    def test_invalid_files(self):
+        with self.assertRaisesMessage(ValueError, 'CSV文件为空'):
+            self.run_import('')
+        with self.assertRaisesMessage(ValueError, 'CSV缺少时间戳列'):
+            self.run_import('LDC_1,LDC_2\n1,2\n')
+        self.assertEqual(self.batches, [])
+        self.mark_dirty.assert_not_called()
+
+
+class FakeCursor(list):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def export_rows(count):
+    start = datetime(2024, 1, 1, 8, 0)
+    return [{'_id': ObjectId(), 'timestamp': start + timedelta(seconds=i), 'LDC_1': 100.0 + i,
+             'LDC_2': None if i % 2 else 3.25, 'U1_FLOW': 1.5, 'U2_FLOW': 2.0} for i in range(count)]
+
+
+class CsvExportTests(SimpleTestCase):
+    """CSV 导出：表头、分块与 gzip 分帧，导出结果可以被导入接口读回"""
+
+    COLUMNS = ['id', 'timestamp', 'LDC_1', 'LDC_2', 'U_FLOW_SUM']
+
+    def export(self, rows, **kwargs):
+        self.cursor = FakeCursor(rows)
+        with mock.patch.object(storage, 'find_rows', return_value=self.cursor) as find_rows, \
+                mock.patch.object(exporter, 'ROWS_PER_CHUNK', 2):
+            chunks = list(exporter.iter_csv({}, self.COLUMNS, **kwargs))
+        self.assertTrue(self.cursor.closed)
+        self.assertEqual(find_rows.call_args[1]['fields'], ['LDC_1', 'LDC_2'] + list(exporter.FLOW_FIELDS))
+        return chunks
+
+    def test_csv_layout(self):
+        rows = export_rows(5)
+        chunks = self.export(rows)
+        self.assertEqual(len(chunks), 3)
+        lines = b''.join(chunks).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], '\ufeffID,时间戳,#1机负荷(MW),#2机负荷(MW),海淡抽汽流量总和(T/H)')
+        self.assertEqual(lines[1], f"{rows[0]['_id']},2024-01-01 08:00:00,100.0,3.25,3.5")
+        self.assertEqual(lines[2], f"{rows[1]['_id']},2024-01-01 08:00:01,101.0,,3.5")
+        self.assertEqual(len(lines), 6)
+
+    def test_gzip_framing(self):
+        rows = export_rows(5)
+        plain = b''.join(self.export(rows))
+        chunks = self.export(rows, gzip=True)
+        data = b''.join(chunks)
+        self.assertEqual(data[:2], b'\x1f\x8b')
+        self.assertEqual(gzip.decompress(data), plain)
+
+    def test_round_trip_through_import(self):
+        rows = export_rows(4)
+        data = b''.join(self.export(rows))
+        batches = []
+        with mock.patch.object(importer, 'write_batch', lambda batch: batches.append(batch) or (len(batch), 0)), \
+                mock.patch.object(importer.rollups, 'mark_dirty'):
+            result = importer.import_csv(io.BytesIO(data))
+        self.assertEqual(result['created'], 4)
+        expected = [{k: v for k, v in row.items() if k in ('timestamp', 'LDC_1', 'LDC_2') and v is not None}
+                    for row in rows]
+        self.assertEqual(batches[0], expected)
+
+
+class PageCursorTests(SimpleTestCase):
+    """列表分页游标的编码与解析"""
+
+    def test_round_trip_object_id(self):
+        doc = {'timestamp': datetime(2024, 3, 1, 12, 30, 5, 250000), '_id': ObjectId()}
+        token = encode_page_cursor(doc)
+        self.assertNotIn('=', token)
+        self.assertEqual(decode_page_cursor(token), (doc['timestamp'], doc['_id']))
+
+    def test_round_trip_string_id(self):
+        # bucket 模式的行 _id 为字符串
+        doc = {'timestamp': datetime(2024, 3, 1, 12, 30), '_id': '65e1c2a0-17'}
+        self.assertEqual(decode_page_cursor(encode_page_cursor(doc)), (doc['timestamp'], '65e1c2a0-17'))
+
+    def test_invalid_token(self):
+        for token in ('', 'not-base64!', 'eyJ4IjoxfQ'):
+            with self.assertRaises(ValueError):
+                decode_page_cursor(token)
+
+
+def _path(doc, path):
+    value = doc
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _order(value):
+    # 与 MongoDB 一致：null/缺失小于任何数值
+    return (0, 0) if value is None else (1, value)
+
+
+def _matches(doc, query):
+    tests = {'$gt': operator.gt, '$gte': operator.ge, '$lt': operator.lt, '$lte': operator.le}
+    for key, cond in (query or {}).items():
+        value = _path(doc, key)
+        if isinstance(cond, dict) and cond and all(op.startswith('$') for op in cond):
+            for op, bound in cond.items():
+                if op == '$in':
+                    if value not in bound:
+                        return False
+                elif value is None or not tests[op](value, bound):
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _eval(expr, doc):
+    """汇总管道中用到的表达式子集"""
+    if isinstance(expr, str) and expr.startswith('$'):
+        return _path(doc, expr[1:])
+    if isinstance(expr, list):
+        return [_eval(e, doc) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) != 1 or not next(iter(expr)).startswith('$'):
+        return {k: _eval(v, doc) for k, v in expr.items()}
+    op, arg = next(iter(expr.items()))
+    if op == '$literal':
+        return arg
+    if op == '$dateTrunc':
+        return rollups.floor_time(_eval(arg['date'], doc), arg['unit'])
+    if op == '$cond':
+        condition, then, otherwise = arg
+        return _eval(then if _eval(condition, doc) not in (None, False, 0) else otherwise, doc)
+    args = _eval(arg, doc)
+    if op == '$ifNull':
+        return next((a for a in args if a is not None), None)
+    if op == '$and':
+        return all(a not in (None, False, 0) for a in args)
+    if op in ('$gt', '$gte', '$lt', '$lte', '$eq'):
+        compare = {'$gt': operator.gt, '$gte': operator.ge, '$lt': operator.lt,
+                   '$lte': operator.le, '$eq': operator.eq}[op]
+        return compare(_order(args[0]), _order(args[1]))
+    if any(a is None for a in args):
+        return None
+    return {'$subtract': operator.sub, '$multiply': operator.mul, '$divide': operator.truediv}[op](*args)
+
+
+def _accumulate(op, values):
+    if op == '$sum':
+        return sum(v for v in values if _number(v))
+    if op == '$push':
+        return list(values)
+    present = [v for v in values if v is not None]
+    if op == '$avg':
+        numbers = [v for v in present if _number(v)]
+        return sum(numbers) / len(numbers) if numbers else None
+    if op in ('$min', '$max'):
+        return (min if op == '$min' else max)(present) if present else None
+    return values[0] if op == '$first' else values[-1]
+
+
+class FakeCollection:
+    """汇总测试用的内存集合：只实现 rollups 用到的查询、更新、批量写入与聚合"""
+
+    def __init__(self, db):
+        self.db = db
+        self.docs = []
+
+    def find(self, query=None, projection=None, sort=None, limit=0):
+        docs = [doc for doc in self.docs if _matches(doc, query)]
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda doc: _order(doc.get(key)), reverse=direction < 0)
+        if limit:
+            docs = docs[:limit]
+        if projection:
+            keep = set(projection) | {'_id'}
+            docs = [{k: v for k, v in doc.items() if k in keep} for doc in docs]
+        return [dict(doc) for doc in docs]
+
+    def find_one(self, query=None, projection=None, sort=None):
+        found = self.find(query, projection, sort, limit=1)
+        return found[0] if found else None
+
+    def update_one(self, query, update, upsert=False):
+        doc = next((doc for doc in self.docs if _matches(doc, query)), None)
+        if doc is None:
+            if not upsert:
+                return
+            doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            doc.update(update.get('$setOnInsert', {}))
+            self.docs.append(doc)
+        doc.update(update.get('$set', {}))
+        for key, value in update.get('$min', {}).items():
+            if doc.get(key) is None or value < doc[key]:
+                doc[key] = value
+        for key in update.get('$unset', {}):
+            doc.pop(key, None)
+
+    def replace_one(self, query, replacement, upsert=False):
+        doc = next((doc for doc in self.docs if _matches(doc, query)), None)
+        if doc is None:
+            if upsert:
+                self.docs.append(dict(replacement, _id=ObjectId()))
+            return
+        _id = doc['_id']
+        doc.clear()
+        doc.update(replacement, _id=_id)
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            if isinstance(op, ReplaceOne):
+                self.replace_one(op._filter, op._doc, op._upsert)
+            else:
+                self.update_one(op._filter, op._doc, op._upsert)
+
+    def aggregate(self, pipeline, **kwargs):
+        return self.db.run(self.find(), pipeline)
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection(self)
+        return self[name]
+
+    def run(self, docs, pipeline):
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == '$match':
+                docs = [doc for doc in docs if _matches(doc, spec)]
+            elif name == '$sort':
+                for key, direction in reversed(list(spec.items())):
+                    docs.sort(key=lambda doc: _order(doc.get(key)), reverse=direction < 0)
+            elif name == '$group':
+                groups = {}
+                for doc in docs:
+                    groups.setdefault(_eval(spec['_id'], doc), []).append(doc)
+                docs = []
+                for key, members in groups.items():
+                    doc = {'_id': key}
+                    for out, acc in spec.items():
+                        if out != '_id':
+                            (op, arg), = acc.items()
+                            doc[out] = _accumulate(op, [_eval(arg, member) for member in members])
+                    docs.append(doc)
+            elif name == '$set':
+                docs = [dict(doc, **{k: _eval(v, doc) for k, v in spec.items()}) for doc in docs]
+            elif name == '$unset':
+                names = [spec] if isinstance(spec, str) else spec
+                docs = [{k: v for k, v in doc.items() if k not in names} for doc in docs]
+            elif name == '$setWindowFields':
+                (key, direction), = spec['sortBy'].items()
+                docs = sorted(docs, key=lambda doc: _order(doc.get(key)), reverse=direction < 0)
+                for out, window in spec['output'].items():
+                    (op, arg), = window.items()
+                    if op == '$locf':
+                        carry = None
+                        for doc in docs:
+                            value = _eval(arg, doc)
+                            carry = value if value is not None else carry
+                            doc[out] = carry
+                    else:
+                        values = [_eval(arg['output'], doc) for doc in docs]
+                        for i, doc in enumerate(docs):
+                            j = i + arg['by']
+                            doc[out] = values[j] if 0 <= j < len(values) else None
+            elif name == '$merge':
+                target = self[spec['into']]
+                for doc in docs:
+                    target.replace_one({spec['on']: doc[spec['on']]}, doc, upsert=True)
+                docs = []
+            else:
+                raise NotImplementedError(name)
+        return iter(docs)
+
+
+class RollupTestCase(SimpleTestCase):
+    """在内存数据库上运行汇总管道（原始数据在 sensor_data 集合）"""
+
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.raw = self.db['sensor_data']
+        self.raw_reads = 0
+        for target, name, replacement in (
+            (rollups, 'get_db', lambda: self.db),
+            (storage, 'aggregate_rows', self.aggregate_rows),
+            (storage, 'find_rows', self.find_rows),
+        ):
+            patcher = mock.patch.object(target, name, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def aggregate_rows(self, match=None, stages=None, fields=None, **kwargs):
+        self.raw_reads += 1
+        return self.db.run(self.raw.find(match), stages or [])
+
+    def find_rows(self, match=None, fields=None, sort=None, skip=0, limit=0, batch_size=None):
+        self.raw_reads += 1
+        return self.raw.find(match, None, sort or [('timestamp', -1)], limit)
+
+    def add_rows(self, start, count, step=timedelta(seconds=10), **series):
+        """series: 字段 -> 取值函数(i)"""
+        for i in range(count):
+            row = {'_id': ObjectId(), 'timestamp': start + step * i}
+            row.update({f: values(i) for f, values in series.items()})
+            self.raw.docs.append(row)
+
+    def rollup(self, granularity):
+        return {doc['timestamp']: doc for doc in self.db[rollups.ROLLUP_COLLECTIONS[granularity]].find()}
+
+
+@override_settings(ROLLUP_SETTLE_S=30, ROLLUP_SKETCH_FIELDS=['LDC_1'])
+class RollupWatermarkTests(RollupTestCase):
+    """增量汇总：水位推进、迟到数据重算、级联与重复执行"""
+
+    START = datetime(2024, 1, 1, 8, 0)
+
+    def setUp(self):
+        super().setUp()
+        self.add_rows(self.START, 18, LDC_1=lambda i: float(i))
+
+    def state(self, granularity):
+        return rollups.get_state(granularity)
+
+    def test_first_run_starts_from_lookback(self):
+        now = datetime(2024, 1, 1, 8, 3, 40)
+        window = rollups.advance('minute', now, initial_lookback=timedelta(hours=1))
+        self.assertEqual(window, (datetime(2024, 1, 1, 7, 3), datetime(2024, 1, 1, 8, 3)))
+        minutes = self.rollup('minute')
+        self.assertEqual(sorted(minutes), [self.START + timedelta(minutes=m) for m in range(3)])
+        self.assertEqual([minutes[ts]['count'] for ts in sorted(minutes)], [6, 6, 6])
+        self.assertEqual(self.state('minute')['watermark'], datetime(2024, 1, 1, 8, 3))
+        # 水位之后没有新的完整分钟：不重复计算
+        self.assertIsNone(rollups.advance('minute', now))
+        self.assertIsNone(rollups.advance('minute', now + timedelta(seconds=15)))
+
+    def test_late_row_behind_watermark_is_recomputed(self):
+        now = datetime(2024, 1, 1, 8, 3, 40)
+        rollups.advance('minute', now)
+        late = {'_id': ObjectId(), 'timestamp': datetime(2024, 1, 1, 8, 1, 5), 'LDC_1': 1000.0}
+        self.raw.docs.append(late)
+        rollups.mark_dirty(late['timestamp'])
+        self.assertEqual(self.state('minute')['dirty_from'], late['timestamp'])
+        # 水位之后的写入不登记
+        rollups.mark_dirty(datetime(2024, 1, 1, 8, 3, 5))
+        self.assertEqual(self.state('minute')['dirty_from'], late['timestamp'])
+
+        window = rollups.advance('minute', now)
+        self.assertEqual(window, (datetime(2024, 1, 1, 8, 1), datetime(2024, 1, 1, 8, 3)))
+        minute = self.rollup('minute')[datetime(2024, 1, 1, 8, 1)]
+        self.assertEqual((minute['count'], minute['LDC_1_max'], minute['LDC_1_count']), (7, 1000.0, 7))
+        self.assertNotIn('dirty_from', self.state('minute'))
+        self.assertEqual(len(self.rollup('minute')), 3)
+
+    def test_dirty_mark_during_run_is_kept(self):
+        now = datetime(2024, 1, 1, 8, 3, 40)
+        rollups.advance('minute', now)
+        rollups.mark_dirty(datetime(2024, 1, 1, 8, 2, 30))
+        rollup_range = rollups.rollup_range
+
+        def run_and_mark(*args, **kwargs):
+            rollup_range(*args, **kwargs)
+            rollups.mark_dirty(datetime(2024, 1, 1, 8, 0, 10))
+
+        with mock.patch.object(rollups, 'rollup_range', run_and_mark):
+            self.assertEqual(rollups.advance('minute', now)[0], datetime(2024, 1, 1, 8, 2))
+        self.assertEqual(self.state('minute')['dirty_from'], datetime(2024, 1, 1, 8, 0, 10))
+        self.assertEqual(rollups.advance('minute', now)[0], datetime(2024, 1, 1, 8, 0))
+
+    def test_cascade_to_hour(self):
+        self.add_rows(datetime(2024, 1, 1, 8, 3), 360, LDC_1=lambda i: 2.0)
+        now = datetime(2024, 1, 1, 9, 5)
+        rollups.advance('minute', now, initial_lookback=timedelta(hours=2))
+        self.assertEqual(rollups.advance('hour', now, initial_lookback=timedelta(hours=2)),
+                         (datetime(2024, 1, 1, 7), datetime(2024, 1, 1, 9)))
+        hour = self.rollup('hour')[datetime(2024, 1, 1, 8)]
+        self.assertEqual(hour['count'], 18 + 342)
+        self.assertAlmostEqual(hour['LDC_1_avg'], (sum(range(18)) + 2.0 * 342) / 360)
+
+        # 迟到数据：分钟级重算后登记小时级重算
+        self.raw.docs.append({'_id': ObjectId(), 'timestamp': datetime(2024, 1, 1, 8, 30, 5), 'LDC_1': -50.0})
+        rollups.mark_dirty(datetime(2024, 1, 1, 8, 30, 5))
+        rollups.advance('minute', now)
+        self.assertEqual(self.state('hour')['dirty_from'], datetime(2024, 1, 1, 8, 30))
+        self.assertEqual(rollups.advance('hour', now), (datetime(2024, 1, 1, 8), datetime(2024, 1, 1, 9)))
+        hour = self.rollup('hour')[datetime(2024, 1, 1, 8)]
+        self.assertEqual((hour['count'], hour['LDC_1_min']), (361, -50.0))
+        self.assertIsNone(rollups.advance('hour', now))
+
+    def test_rerun_is_idempotent(self):
+        start, end = self.START, self.START + timedelta(minutes=3)
+        rollups.rollup_range('minute', start, end)
+        first = self.rollup('minute')
+        rollups.rollup_range('minute', start, end)
+        second = self.rollup('minute')
+        self.assertEqual(len(second), 3)
+        for ts, doc in first.items():
+            self.assertEqual(second[ts], doc)
+        rollups.rollup_range('hour', datetime(2024, 1, 1, 8), datetime(2024, 1, 1, 9))
+        hour = self.rollup('hour')
+        rollups.rollup_range('hour', datetime(2024, 1, 1, 8), datetime(2024, 1, 1, 9))
+        self.assertEqual(self.rollup('hour'), hour)
+        self.assertEqual(hour[datetime(2024, 1, 1, 8)]['count'], 18)
+
+
+@override_settings(ROLLUP_SKETCH_FIELDS=[])
+class RollupStatsTests(RollupTestCase):
+    """全字段统计与累计量增量"""
+
+    START = datetime(2024, 1, 1, 8, 0)
+    COUNTER = 'HEATSUP_TOTAL_HG'
+
+    def minute(self, ts):
+        return self.rollup('minute')[ts]
+
+    def test_full_schema_stats(self):
+        values = [3.0, None, 1.0, 5.0, None, 2.0]
+        self.add_rows(self.START, 6, LDC_1=lambda i: values[i], U1_FLOW=lambda i: 10.0)
+        rollups.rollup_range('minute', self.START, self.START + timedelta(minutes=1))
+        doc = self.minute(self.START)
+        self.assertEqual(doc['count'], 6)
+        stats = {stat: doc[f'LDC_1_{stat}'] for stat in ('avg', 'min', 'max', 'first', 'last', 'count')}
+        self.assertEqual(stats, {'avg': 2.75, 'min': 1.0, 'max': 5.0, 'first': 3.0, 'last': 2.0, 'count': 4})
+        self.assertEqual(doc['U1_FLOW_sum'], 60.0)
+        # 没有取值的字段也有完整的统计字段
+        self.assertEqual((doc['LDC_2_avg'], doc['LDC_2_count']), (None, 0))
+        for f in rollups.ROLLUP_FIELDS:
+            self.assertIn(f + '_avg', doc)
+        self.assertIsNone(doc[self.COUNTER + '_delta'])
+
+    def test_counter_delta_within_bucket(self):
+        self.add_rows(self.START, 6, **{self.COUNTER: lambda i: 100.0 + 2 * i})
+        rollups.rollup_range('minute', self.START, self.START + timedelta(minutes=1))
+        doc = self.minute(self.START)
+        self.assertEqual(doc[self.COUNTER + '_delta'], 10.0)
+        self.assertEqual((doc[self.COUNTER + '_first'], doc[self.COUNTER + '_last']), (100.0, 110.0))
+
+    def test_counter_delta_spans_bucket_boundaries(self):
+        # 10 秒一条，每条 +1：每分钟增量 6，首个桶的首条增量来自区间之前的取值
+        self.add_rows(self.START - timedelta(seconds=10), 19, **{self.COUNTER: lambda i: 100.0 + i})
+        rollups.rollup_range('minute', self.START, self.START + timedelta(minutes=3))
+        deltas = [self.minute(self.START + timedelta(minutes=m))[self.COUNTER + '_delta'] for m in range(3)]
+        self.assertEqual(deltas, [6.0, 6.0, 6.0])
+
+    def test_counter_reset(self):
+        series = [100.0, 104.0, 2.0, 5.0, None, 9.0, 12.0]
+        self.add_rows(self.START, 7, **{self.COUNTER: lambda i: series[i]})
+        rollups.rollup_range('minute', self.START, self.START + timedelta(minutes=2))
+        # 4 + 2（复位后从 0 到 2）+ 3 + 4 + 3，空值跨过
+        first = self.minute(self.START)
+        second = self.minute(self.START + timedelta(minutes=1))
+        self.assertEqual(first[self.COUNTER + '_delta'], 13.0)
+        self.assertEqual(second[self.COUNTER + '_delta'], 3.0)
+        self.assertGreaterEqual(min(first[self.COUNTER + '_delta'], second[self.COUNTER + '_delta']), 0)
+
+    def test_empty_bucket_between_values(self):
+        self.add_rows(self.START, 3, step=timedelta(minutes=2), **{self.COUNTER: lambda i: 10.0 * (i + 1)})
+        self.raw.docs.append({'_id': ObjectId(), 'timestamp': self.START + timedelta(minutes=1)})
+        rollups.rollup_range('minute', self.START, self.START + timedelta(minutes=5))
+        deltas = {ts.minute: doc[self.COUNTER + '_delta'] for ts, doc in self.rollup('minute').items()}
+        # 首条取值之前没有任何取值：增量为 0；没有取值的桶为 null
+        self.assertEqual(deltas, {0: 0, 1: None, 2: 10.0, 4: 10.0})
+
+    def test_cascade_sums_deltas(self):
+        self.add_rows(self.START, 360, **{self.COUNTER: lambda i: 50.0 + i, 'LDC_1': lambda i: float(i % 3)})
+        rollups.rollup_range('minute', self.START, self.START + timedelta(hours=1))
+        rollups.rollup_range('hour', self.START, self.START + timedelta(hours=1))
+        hour = self.rollup('hour')[self.START]
+        self.assertEqual(hour[self.COUNTER + '_delta'], 359.0)
+        self.assertEqual((hour[self.COUNTER + '_first'], hour[self.COUNTER + '_last']), (50.0, 409.0))
+        self.assertAlmostEqual(hour['LDC_1_avg'], 1.0)
+        self.assertEqual((hour['LDC_1_count'], hour['count']), (360, 360))
+        self.assertIsNone(hour['LDC_2_avg'])
+        self.assertNotIn('LDC_1_delta', hour)
+
+    @override_settings(SENSOR_STORAGE_MODE='bucket')
+    def test_bucket_mode_timeseries_delta(self):
+        series = [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+        self.add_rows(self.START, 12, **{self.COUNTER: lambda i: series[i]})
+        rows = repository.get_timeseries(self.START, self.START + timedelta(minutes=2), [self.COUNTER], stat='delta')
+        self.assertEqual([row[self.COUNTER] for row in rows], [5.0, 6.0])
+
+
+class QuantileSketchTests(SimpleTestCase):
+    """分位数草图的精度、合并与序列化"""
+
+    QS = (0.01, 0.25, 0.5, 0.9, 0.95, 0.99)
+
+    def assertClose(self, sketch, values):
+        ordered = sorted(values)
+        for q in self.QS:
+            exact = ordered[int(q * (len(ordered) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), abs(exact) * sketch.alpha + 1e-9, q)
+
+    def test_relative_accuracy(self):
+        values = [float(v) for v in range(1, 10001)]
+        sketch = QuantileSketch()
+        sketch.extend(values)
+        self.assertClose(sketch, values)
+
+    def test_negative_zero_and_missing(self):
+        values = [float(v) for v in range(-500, 501)]
+        sketch = QuantileSketch()
+        sketch.extend(values + [None, float('nan')])
+        self.assertEqual(sketch.count, len(values))
+        self.assertEqual(sketch.quantile(0.5), 0.0)
+        self.assertClose(sketch, values)
+
+    def test_extremes_are_exact(self):
+        sketch = QuantileSketch()
+        sketch.extend([3.3, 1.1, 2.2])
+        self.assertEqual(sketch.quantile(0), 1.1)
+        self.assertEqual(sketch.quantile(1), 3.3)
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+        with self.assertRaises(ValueError):
+            sketch.quantile(1.5)
+
+    def test_merge_matches_single_pass(self):
+        values = [v * 0.37 for v in range(1, 5001)]
+        whole = QuantileSketch()
+        whole.extend(values)
+        left, right = QuantileSketch(), QuantileSketch()
+        left.extend(values[::2])
+        right.extend(values[1::2])
+        merged = left.merge(right).merge(QuantileSketch())
+        self.assertEqual(merged.count, whole.count)
+        self.assertEqual(merged.quantiles(self.QS), whole.quantiles(self.QS))
+        self.assertEqual((merged.min, merged.max), (whole.min, whole.max))
+
+    def test_merge_rejects_different_accuracy(self):
+        other = QuantileSketch(0.05)
+        other.add(1.0)
+        with self.assertRaises(ValueError):
+            QuantileSketch(0.01).merge(other)
+
+    def test_bytes_round_trip(self):
+        sketch = QuantileSketch()
+        sketch.extend([-2.5, 0.0, 0.001, 7.0, 1e6])
+        restored = QuantileSketch.from_bytes(sketch.to_bytes())
+        self.assertEqual(restored.count, sketch.count)
+        self.assertEqual(restored.quantiles(self.QS), sketch.quantiles(self.QS))
+        self.assertEqual(restored.to_bytes(), sketch.to_bytes())
+
+
+@override_settings(ROLLUP_SKETCH_FIELDS=['LDC_1'])
+class RollupSketchTests(RollupTestCase):
+    """分钟草图与分钟统计同一次读取原始数据，小时草图合并分钟草图"""
+
+    START = datetime(2024, 1, 1, 8, 0)
+
+    def sketch(self, doc):
+        return QuantileSketch.from_bytes(doc['LDC_1_sketch'])
+
+    def test_minute_sketch_built_in_rollup_pass(self):
+        self.add_rows(self.START, 18, LDC_1=lambda i: float(i + 1))
+        rollups.rollup_range('minute', self.START, self.START + timedelta(minutes=3))
+        # 一次累计量起点查询 + 一次汇总聚合，不再为草图单独扫描
+        self.assertEqual(self.raw_reads, 2)
+        minutes = self.rollup('minute')
+        self.assertEqual(len(minutes), 3)
+        for m, ts in enumerate(sorted(minutes)):
+            self.assertNotIn('LDC_1_values', minutes[ts])
+            sketch = self.sketch(minutes[ts])
+            self.assertEqual((sketch.count, sketch.min, sketch.max), (6, m * 6 + 1.0, m * 6 + 6.0))
+
+        reads = self.raw_reads
+        rollups.rollup_range('hour', datetime(2024, 1, 1, 8), datetime(2024, 1, 1, 9))
+        self.assertEqual(self.raw_reads, reads)
+        hour = self.sketch(self.rollup('hour')[datetime(2024, 1, 1, 8)])
+        self.assertEqual((hour.count, hour.min, hour.max), (18, 1.0, 18.0))
+        self.assertLessEqual(abs(hour.quantile(0.5) - 9.0), 9.0 * hour.alpha + 1e-9)
+
+    def test_missing_values_give_empty_sketch(self):
+        self.add_rows(self.START, 6, LDC_2=lambda i: 1.0)
+        rollups.rollup_range('minute', self.START, self.START + timedelta(minutes=1))
+        self.assertEqual(self.sketch(self.rollup('minute')[self.START]).count, 0)
+
+
+class DownsampleTests(SimpleTestCase):
+    """LTTB / minmax 的选点数量与多字段预算"""
+
+    def series(self, n):
+        x = np.arange(n, dtype=np.float64)
+        return x, np.sin(x / 25.0) * 10 + (x % 7)
+
+    def test_lttb_point_count_and_endpoints(self):
+        x, y = self.series(1000)
+        for n_out in (3, 10, 100, 999):
+            picked = lttb_indices(x, y, n_out)
+            self.assertEqual(len(picked), n_out)
+            self.assertEqual((picked[0], picked[-1]), (0, 999))
+            self.assertTrue(np.all(np.diff(picked) > 0))
+        self.assertEqual(len(lttb_indices(x, y, 2000)), 1000)
+
+    def test_minmax_point_count_keeps_extremes(self):
+        _, y = self.series(1000)
+        y[417] = 100.0
+        y[600] = -100.0
+        for n_out in (3, 4, 9, 100):
+            picked = minmax_indices(y, n_out)
+            self.assertLessEqual(len(picked), n_out)
+            self.assertIn(417, picked)
+            self.assertEqual((picked[0], picked[-1]), (0, 999))
+        self.assertIn(600, minmax_indices(y, 4))
+
+    def rows(self, n):
+        start = datetime(2024, 1, 1)
+        _, y = self.series(n)
+        return [{'timestamp': start + timedelta(seconds=i), 'LDC_1': float(y[i]),
+                 'LDC_2': None if i % 5 == 0 else float(-y[i])} for i in range(n)]
+
+    def test_multi_field_within_max_points(self):
+        rows = self.rows(2000)
+        for method in ('lttb', 'minmax'):
+            result = downsample(rows, ['LDC_1', 'LDC_2'], 100, method)
+            self.assertLessEqual(len(result), 100)
+            self.assertEqual(result[0], rows[0])
+            self.assertEqual([r['timestamp'] for r in result], sorted(r['timestamp'] for r in result))
+
+    def test_small_input_unchanged(self):
+        rows = self.rows(50)
+        self.assertIs(downsample(rows, ['LDC_1'], 100), rows)
+        self.assertIs(downsample(rows, ['LDC_1'], 0), rows)
+
+    def test_budget_checks(self):
+        with self.assertRaises(ValueError):
+            check_budget(5, 2)
+        check_budget(6, 2)
+        check_budget(0, 2)
+        with self.assertRaises(ValueError):
+            downsample(self.rows(10), ['LDC_1'], 5, 'mean')
+
+
+@override_settings(TIME_ZONE='Asia/Shanghai')
+class ColumnarTests(SimpleTestCase):
+    """列式输出：本地时间按 TIME_ZONE 换算毫秒时间戳，字段按列排列"""
+
+    def test_epoch_conversion(self):
+        to_epoch = EpochConverter()
+        self.assertEqual(to_epoch(datetime(2024, 1, 1, 8, 0)), 1704067200000)
+        self.assertEqual(to_epoch(datetime(2024, 1, 1, 8, 0, 0, 1500)), 1704067200001)
+        self.assertEqual(to_epoch(datetime(2024, 1, 1, 0, 0, tzinfo=timezone.utc)), 1704067200000)
+        self.assertIsNone(to_epoch(None))
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_offset_follows_daylight_saving(self):
+        to_epoch = EpochConverter()
+        self.assertEqual(to_epoch(datetime(2024, 1, 1, 0, 0)), 1704085200000)
+        self.assertEqual(to_epoch(datetime(2024, 7, 1, 0, 0)), 1719806400000)
+
+    def test_build_columns(self):
+        oid = ObjectId()
+        rows = [
+            {'_id': oid, 'timestamp': datetime(2024, 1, 1, 8, 0), 'LDC_1': 1.5, 'LDC_2': None},
+            {'id': 'b-1', 'timestamp': datetime(2024, 1, 1, 8, 0, 1), 'LDC_1': 2.5},
+        ]
+        self.assertEqual(build_columns(iter(rows), ['LDC_1', 'LDC_2'], include_id=True), {
+            'timestamps': [1704067200000, 1704067201000],
+            'fields': {'LDC_1': [1.5, 2.5], 'LDC_2': [None, None]},
+            'ids': [str(oid), 'b-1'],
+        })
+        self.assertNotIn('ids', build_columns(rows, ['LDC_1']))
+
+
+class ArrowExportTests(SimpleTestCase):
+    """Parquet / Arrow IPC 导出：压缩参数与分批写出的往返读取"""
+
+    COLUMNS = ['id', 'timestamp', 'LDC_1', 'LDC_2', 'U_FLOW_SUM']
+
+    def test_compression_setting(self):
+        cases = [('zstd', 'zstd', 'zstd'), ('none', 'none', None), ('', 'none', None),
+                 ('snappy', 'snappy', None), ('LZ4', 'lz4', 'lz4')]
+        for value, parquet, ipc in cases:
+            with self.settings(EXPORT_ARROW_COMPRESSION=value):
+                self.assertEqual(exporter.arrow_compression('parquet'), parquet, value)
+                self.assertEqual(exporter.arrow_compression('arrow'), ipc, value)
+
+    def export(self, rows, file_format):
+        cursor = FakeCursor(rows)
+        with mock.patch.object(storage, 'find_rows', return_value=cursor) as find_rows:
+            chunks = list(exporter.iter_arrow({}, self.COLUMNS, file_format, batch_size=2))
+        self.assertTrue(cursor.closed)
+        self.assertEqual(find_rows.call_args[1]['sort'], [('timestamp', 1)])
+        return chunks
+
+    def assertRowsEqual(self, table, rows):
+        self.assertEqual(table.column_names, self.COLUMNS)
+        self.assertEqual(table.column('id').to_pylist(), [str(row['_id']) for row in rows])
+        self.assertEqual(table.column('timestamp').to_pylist(), [row['timestamp'] for row in rows])
+        self.assertEqual(table.column('LDC_2').to_pylist(), [row['LDC_2'] for row in rows])
+        self.assertEqual(table.column('U_FLOW_SUM').to_pylist(), [3.5] * len(rows))
+
+    @skipIf(exporter.pa is None, '未安装 pyarrow')
+    def test_parquet_round_trip(self):
+        rows = export_rows(5)
+        for compression in ('zstd', 'none'):
+            with self.settings(EXPORT_ARROW_COMPRESSION=compression):
+                data = b''.join(self.export(rows, 'parquet'))
+            parquet = exporter.pq.ParquetFile(io.BytesIO(data))
+            self.assertEqual(parquet.metadata.num_row_groups, 3)
+            self.assertRowsEqual(parquet.read(), rows)
+
+    @skipIf(exporter.pa is None, '未安装 pyarrow')
+    def test_arrow_stream_round_trip(self):
+        rows = export_rows(5)
+        for compression in ('zstd', 'none'):
+            with self.settings(EXPORT_ARROW_COMPRESSION=compression):
+                chunks = self.export(rows, 'arrow')
+            self.assertEqual(len(chunks), 3)
+            reader = exporter.pa.ipc.open_stream(b''.join(chunks))
+            batches = list(reader)
+            self.assertEqual([batch.num_rows for batch in batches], [2, 2, 1])
+            self.assertRowsEqual(exporter.pa.Table.from_batches(batches), rows)
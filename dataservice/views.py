@@ -4,16 +4,29 @@ from rest_framework.response import Response
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.settings import api_settings
 from django.http import Http404
 from datetime import datetime, timedelta
+import base64
 import json
 import jwt
 import hashlib
+from bson import ObjectId
+from bson.errors import InvalidId
 from mongoengine.errors import DoesNotExist, NotUniqueError
+from pymongo.errors import ExecutionTimeout
 
-from .models import SensorData, User, ManualPlan, DailyManualData, WeatherRecord, HeatPrediction
-from .serializers import SensorDataSerializer, ManualPlanSerializer, DailyManualDataSerializer, WeatherRecordSerializer, HeatPredictionSerializer
+from . import storage
+from . import exporter, latest_cache, live
+from .renderers import ColumnarJSONRenderer, EventStreamRenderer, FastJSONRenderer
+from .columnar import build_columns
+from .repository import get_hourly_snapshots, get_percentiles, get_timeseries
+from . import rollups
+from .importer import import_csv
+from .models import SENSOR_FIELDS, SensorData, User, ManualPlan, DailyManualData, WeatherRecord, HeatPrediction
+from .serializers import SENSOR_FIELD_NAMES, SENSOR_VALUE_FIELD_NAMES, sensor_doc_to_dict, SensorDataSerializer, ManualPlanSerializer, DailyManualDataSerializer, WeatherRecordSerializer, HeatPredictionSerializer
 from django.conf import settings
+from django.core.cache import cache
 import requests
 try:
     from .predict_service import predict_heat_gj
@@ -458,6 +471,9 @@ class AuthViewSet(viewsets.ViewSet):
                 "data": None
             }, status=status.HTTP_200_OK)
 
+# hourly_data 图表使用的字段：机组负荷与五抽压力
+HOURLY_CHART_FIELDS = ['LDC_1', 'LDC_2', 'LDC_3', 'LDC_4', 'S5_01', 'S5_02', 'S5_0301', 'S5_0302', 'S5_0401', 'S5_0402']
+
 class SensorDataPagination(PageNumberPagination):
     """
     自定义分页器
@@ -466,11 +482,46 @@ class SensorDataPagination(PageNumberPagination):
     page_size_query_param = 'page_size'  # 允许客户端通过参数控制每页数据量
     max_page_size = 1000  # 每页最大数据量
 
+def encode_page_cursor(doc):
+    """把一页最后一行的 (timestamp, _id) 编码为不透明的游标字符串"""
+    payload = {'t': doc['timestamp'].isoformat(), 'i': str(doc['_id'])}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_page_cursor(token):
+    """解析游标，返回 (timestamp, _id)；格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        ts = datetime.fromisoformat(payload['t'])
+        last_id = payload['i']
+    except Exception:
+        raise ValueError('无效的游标')
+    # document 模式 _id 为 ObjectId；bucket 模式的行 _id 为字符串
+    return ts, ObjectId(last_id) if ObjectId.is_valid(last_id) else last_id
+
+
 class SensorDataViewSet(viewsets.ViewSet):
     """
     传感器数据的API视图集
     """
     pagination_class = SensorDataPagination
+    # list / timeseries 支持 ?format=columnar 列式输出
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [ColumnarJSONRenderer]
+
+    def _is_columnar(self, request):
+        return getattr(request.accepted_renderer, 'format', None) == 'columnar'
+
+    def _columnar_fields(self, request):
+        """列式输出的字段：fields 参数（逗号分隔），默认全部字段；含未知字段时抛出 ValueError"""
+        param = request.query_params.get('fields')
+        if not param:
+            return list(SENSOR_FIELDS)
+        fields = [f.strip() for f in param.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in SENSOR_FIELDS]
+        if unknown:
+            raise ValueError(f'未知字段: {", ".join(unknown)}')
+        return fields
     
     def list(self, request):
         """
@@ -485,6 +536,10 @@ class SensorDataViewSet(viewsets.ViewSet):
         - value: 字段值 (用于筛选)
         - value_gt: 大于指定值
         - value_lt: 小于指定值
+        - cursor: 游标分页，首页传空值，之后传上一页返回的 next_cursor；此时忽略 page
+        - count: 游标分页下的总数方式，estimate（默认）/ exact / none。estimate 在无筛选时用集合估算值，
+          有筛选时做限时计数（LIST_COUNT_TIMEOUT_MS），超时返回 null
+        - format: 为 columnar 时 results 为列式结构 {timestamps, ids, fields}，可用 fields 参数指定字段
         """
         # 构建查询条件
         query_params = {}
@@ -550,6 +605,10 @@ class SensorDataViewSet(viewsets.ViewSet):
         
         # 执行查询
         queryset = SensorData.objects(**query_params).order_by('-timestamp')
+
+        # 游标分页：按 (timestamp, _id) 倒序定位，任意深度的页代价与首页相同
+        if 'cursor' in request.query_params:
+            return self._list_by_cursor(request, queryset._query)
         
         # 手动分页处理
         try:
@@ -564,18 +623,22 @@ class SensorDataViewSet(viewsets.ViewSet):
             if page_size > 1000:  # 最大限制
                 page_size = 1000
                 
-            # 计算总数
-            total_count = queryset.count()
-            
             # 计算分页偏移量
             start_index = (page - 1) * page_size
-            end_index = start_index + page_size
-            
-            # 获取当前页数据
-            page_data = list(queryset[start_index:end_index])
             
-            # 序列化数据
-            serializer = SensorDataSerializer(page_data, many=True)
+            if self._is_columnar(request):
+                # 列式输出：按投影直接从游标构建数组，不经过文档对象与序列化器
+                raw_query = queryset._query
+                fields = self._columnar_fields(request)
+                total_count = storage.count_rows(raw_query)
+                rows = storage.find_rows(raw_query, fields=fields, skip=start_index, limit=page_size)
+                results = build_columns(rows, fields, include_id=True)
+            else:
+                # 复用同一查询条件经适配层读取原始行（分桶存储时展开为行），直接转换为输出字典
+                raw_query = queryset._query
+                total_count = storage.count_rows(raw_query)
+                rows = storage.find_rows(raw_query, fields=SENSOR_VALUE_FIELD_NAMES, skip=start_index, limit=page_size)
+                results = [sensor_doc_to_dict(row) for row in rows]
             
             # 计算分页信息
             total_pages = (total_count + page_size - 1) // page_size
@@ -599,7 +662,7 @@ class SensorDataViewSet(viewsets.ViewSet):
                     'count': total_count,
                     'next': next_url,
                     'previous': previous_url,
-                    'results': serializer.data
+                    'results': results
                 }
             }, status=status.HTTP_200_OK)
             
@@ -616,6 +679,88 @@ class SensorDataViewSet(viewsets.ViewSet):
                 "data": None
             }, status=status.HTTP_200_OK)
     
+    def _list_by_cursor(self, request, raw_query):
+        try:
+            page_size = min(max(int(request.query_params.get('page_size', 100)), 1), 1000)
+            token = request.query_params.get('cursor') or ''
+            count_mode = request.query_params.get('count', 'estimate')
+
+            match = dict(raw_query)
+            if token:
+                last_ts, last_id = decode_page_cursor(token)
+                # 顶层 timestamp 上界让 document 模式走索引范围扫描、bucket 模式先按桶过滤
+                time_cond = dict(match.get('timestamp') or {})
+                if '$lte' not in time_cond or time_cond['$lte'] > last_ts:
+                    time_cond['$lte'] = last_ts
+                match['timestamp'] = time_cond
+                keyset = [
+                    {'timestamp': {'$lt': last_ts}},
+                    {'timestamp': last_ts, '_id': {'$lt': last_id}},
+                ]
+                if '$or' in match:
+                    match = {'$and': [match, {'$or': keyset}]}
+                else:
+                    match['$or'] = keyset
+
+            columnar = self._is_columnar(request)
+            fields = self._columnar_fields(request) if columnar else SENSOR_VALUE_FIELD_NAMES
+            rows = list(storage.find_rows(
+                match, fields=fields, sort=[('timestamp', -1), ('_id', -1)], limit=page_size + 1
+            ))
+            has_next = len(rows) > page_size
+            rows = rows[:page_size]
+
+            if count_mode == 'exact':
+                total_count, count_exact = storage.count_rows(raw_query), True
+            elif count_mode == 'estimate' and not raw_query and not storage.is_bucket_mode():
+                total_count, count_exact = SensorData._get_collection().estimated_document_count(), False
+            elif count_mode == 'estimate':
+                # 有筛选（或分桶模式）时做限时的精确计数，超时则不返回总数
+                try:
+                    timeout_ms = int(getattr(settings, 'LIST_COUNT_TIMEOUT_MS', 500))
+                    total_count, count_exact = storage.count_rows(raw_query, max_time_ms=timeout_ms), True
+                except ExecutionTimeout:
+                    total_count, count_exact = None, False
+            else:
+                total_count, count_exact = None, False
+
+            if columnar:
+                results = build_columns(rows, fields, include_id=True)
+            else:
+                results = [sensor_doc_to_dict(row) for row in rows]
+            next_cursor = encode_page_cursor(rows[-1]) if has_next else None
+            next_link = None
+            if next_cursor:
+                # 保留筛选与排序等参数，只替换游标
+                params = request.query_params.copy()
+                params['cursor'] = next_cursor
+                params['page_size'] = page_size
+                next_link = '?' + params.urlencode()
+            return Response({
+                "code": 0,
+                "message": "获取传感器数据列表成功",
+                "data": {
+                    'count': total_count,
+                    'count_exact': count_exact,
+                    'next': next_link,
+                    'previous': None,
+                    'next_cursor': next_cursor,
+                    'results': results
+                }
+            }, status=status.HTTP_200_OK)
+        except ValueError as e:
+            return Response({
+                "code": 1,
+                "message": f"分页参数错误: {str(e)}",
+                "data": None
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({
+                "code": 1,
+                "message": f"查询失败: {str(e)}",
+                "data": None
+            }, status=status.HTTP_200_OK)
+
     def create(self, request):
         """
         创建一条或多条传感器数据
@@ -634,6 +779,7 @@ class SensorDataViewSet(viewsets.ViewSet):
                 
                 # 批量保存
                 SensorData.objects.insert(sensor_data_objects)
+                latest_cache.invalidate()
                 return Response({
                     "code": 0,
                     "message": f"成功创建{len(sensor_data_objects)}条传感器数据",
@@ -649,6 +795,7 @@ class SensorDataViewSet(viewsets.ViewSet):
             serializer = SensorDataSerializer(data=request.data)
             if serializer.is_valid():
                 serializer.save()
+                latest_cache.invalidate()
                 return Response({
                     "code": 0,
                     "message": "创建传感器数据成功",
@@ -665,14 +812,16 @@ class SensorDataViewSet(viewsets.ViewSet):
         获取单条传感器数据
         """
         try:
-            sensor_data = SensorData.objects.get(id=pk)
-            serializer = SensorDataSerializer(sensor_data)
+            projection = dict.fromkeys(SENSOR_FIELD_NAMES, 1)
+            doc = SensorData._get_collection().find_one({'_id': ObjectId(pk)}, projection)
+            if doc is None:
+                raise DoesNotExist()
             return Response({
                 "code": 0,
                 "message": "获取传感器数据成功",
-                "data": serializer.data
+                "data": sensor_doc_to_dict(doc)
             }, status=status.HTTP_200_OK)
-        except DoesNotExist:
+        except (DoesNotExist, InvalidId):
             return Response({
                 "code": 1,
                 "message": "传感器数据不存在",
@@ -688,6 +837,7 @@ class SensorDataViewSet(viewsets.ViewSet):
             serializer = SensorDataSerializer(sensor_data, data=request.data)
             if serializer.is_valid():
                 serializer.save()
+                latest_cache.invalidate()
                 return Response({
                     "code": 0,
                     "message": "更新传感器数据成功",
@@ -712,6 +862,7 @@ class SensorDataViewSet(viewsets.ViewSet):
         try:
             sensor_data = SensorData.objects.get(id=pk)
             sensor_data.delete()
+            latest_cache.invalidate()
             return Response({
                 "code": 0,
                 "message": "删除传感器数据成功",
@@ -762,6 +913,7 @@ class SensorDataViewSet(viewsets.ViewSet):
         # 执行批量删除
         try:
             result = SensorData.objects(**query_params).delete()
+            latest_cache.invalidate()
             return Response({
                 "code": 0,
                 "message": f"成功删除{result}条数据",
@@ -780,13 +932,12 @@ class SensorDataViewSet(viewsets.ViewSet):
         获取最新的传感器数据
         """
         try:
-            latest_data = SensorData.objects.order_by('-timestamp').first()
-            if latest_data:
-                serializer = SensorDataSerializer(latest_data)
+            latest_row = latest_cache.get_latest_row()
+            if latest_row:
                 return Response({
                     "code": 0,
                     "message": "获取最新数据成功",
-                    "data": serializer.data
+                    "data": sensor_doc_to_dict(latest_row)
                 }, status=status.HTTP_200_OK)
             else:
                 return Response({
@@ -801,81 +952,88 @@ class SensorDataViewSet(viewsets.ViewSet):
                 "data": None
             }, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'], renderer_classes=[EventStreamRenderer, FastJSONRenderer])
+    def stream(self, request):
+        """
+        实时数据推送（Server-Sent Events）
+        
+        连接后先推送 snapshot 事件（完整数据），之后每条新采样推送一次 delta 事件（仅包含变化的字段）；
+        所有连接共享同一个后台跟踪线程，空闲时发送注释行保活。
+        """
+        from django.http import StreamingHttpResponse
+
+        response = StreamingHttpResponse(live.sse_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # 关闭 nginx 缓冲
+        return response
+
+    @action(detail=False, methods=['get'])
+    def latest_cache_stats(self, request):
+        """
+        最新数据缓存的命中统计
+        """
+        return Response({
+            "code": 0,
+            "message": "ok",
+            "data": dict(latest_cache.stats(), live=live.get_hub().stats())
+        }, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'])
     def hourly_data(self, request):
         """
-        获取最近12小时的整点数据，用于机组功率和五抽压力图表
+        获取最近N小时的整点数据，用于机组功率和五抽压力图表
+        
+        查询参数:
+        - hours: 小时数 (默认12，最大168)
+        
+        结果缓存到下一个整点；当前小时尚无数据时只缓存 HOURLY_DATA_CACHE_MISS_TTL_S 秒。
         """
         try:
-            from datetime import datetime, timedelta
-            
-            # 计算12小时前的时间
+            hours = min(max(int(request.query_params.get('hours', 12)), 1), 168)
+        except ValueError:
+            return Response({
+                "code": 1,
+                "message": "hours参数必须是整数",
+                "data": None
+            }, status=status.HTTP_200_OK)
+
+        try:
             end_time = datetime.now()
-            start_time = end_time - timedelta(hours=12)
-            
-            # 查询最近12小时的数据
-            queryset = SensorData.objects(
-                timestamp__gte=start_time,
-                timestamp__lte=end_time
-            ).order_by('timestamp')
-            
-            # 按小时分组，取每小时的整点数据（最接近整点的数据）
-            hourly_data = {}
-            
-            for data in queryset:
-                # 将时间向下取整到小时
-                hour_key = data.timestamp.replace(minute=0, second=0, microsecond=0)
-                
-                # 如果这个小时还没有数据，或者当前数据更接近整点，则更新
-                if hour_key not in hourly_data:
-                    hourly_data[hour_key] = data
-                else:
-                    # 计算与整点的时间差
-                    current_diff = abs((data.timestamp - hour_key).total_seconds())
-                    existing_diff = abs((hourly_data[hour_key].timestamp - hour_key).total_seconds())
-                    
-                    if current_diff < existing_diff:
-                        hourly_data[hour_key] = data
-            
-            # 按时间排序并生成12小时的数据
-            sorted_hours = sorted(hourly_data.keys())
-            
-            # 确保有12个数据点，如果不足则用最新数据填充
-            result_data = []
-            for i in range(12):
-                target_hour = end_time.replace(minute=0, second=0, microsecond=0) - timedelta(hours=11-i)
-                
-                # 查找最接近的数据
-                closest_data = None
-                min_diff = float('inf')
-                
-                for hour, data in hourly_data.items():
-                    diff = abs((hour - target_hour).total_seconds())
-                    if diff < min_diff:
-                        min_diff = diff
-                        closest_data = data
-                
-                if closest_data:
-                    result_data.append(closest_data)
+            current_hour = end_time.replace(minute=0, second=0, microsecond=0)
+            cache_key = f'sensor:hourly_data:{hours}:{current_hour:%Y%m%d%H}'
+            payload = cache.get(cache_key)
+            if payload is None:
+                # 一次聚合取每小时最早的一条（最接近整点），只投影图表使用的字段
+                start_time = end_time - timedelta(hours=hours)
+                snapshots = get_hourly_snapshots(start_time, end_time, HOURLY_CHART_FIELDS)
+
+                # 每个目标整点取时间上最接近的已有小时，没有任何数据时补0
+                results = []
+                for i in range(hours):
+                    target_hour = current_hour - timedelta(hours=hours - 1 - i)
+                    closest = min(snapshots, key=lambda snap: abs((snap['hour'] - target_hour).total_seconds()), default=None)
+                    if closest:
+                        results.append(sensor_doc_to_dict(closest))
+                    else:
+                        item = sensor_doc_to_dict({'timestamp': target_hour})
+                        item.update({f: 0 for f in HOURLY_CHART_FIELDS})
+                        results.append(item)
+
+                payload = {
+                    "results": results,
+                    # timestamp 为 YYYY-MM-DD HH:MM:SS，截取 HH:MM
+                    "hours": [item['timestamp'][11:16] for item in results]
+                }
+                if snapshots and snapshots[-1]['hour'] == current_hour:
+                    timeout = max(1, int((current_hour + timedelta(hours=1) - datetime.now()).total_seconds()))
                 else:
-                    # 如果没有数据，创建一个空的数据对象
-                    empty_data = SensorData(
-                        timestamp=target_hour,
-                        LDC_1=0, LDC_2=0, LDC_3=0, LDC_4=0,
-                        S5_01=0, S5_02=0, S5_0301=0, S5_0302=0, S5_0401=0, S5_0402=0
-                    )
-                    result_data.append(empty_data)
-            
-            # 序列化数据
-            serializer = SensorDataSerializer(result_data, many=True)
+                    timeout = getattr(settings, 'HOURLY_DATA_CACHE_MISS_TTL_S', 60)
+                cache.set(cache_key, payload, timeout)
             
             return Response({
                 "code": 0,
-                "message": "获取12小时数据成功",
-                "data": {
-                    "results": serializer.data,
-                    "hours": [data.timestamp.strftime('%H:%M') for data in result_data]
-                }
+                "message": f"获取{hours}小时数据成功",
+                "data": payload
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
@@ -885,27 +1043,141 @@ class SensorDataViewSet(viewsets.ViewSet):
                 "data": None
             }, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'])
+    def timeseries(self, request):
+        """
+        按时间跨度自动选择分钟/小时/日汇总的时序数据（用于趋势图）
+        
+        查询参数:
+        - start_time: 开始时间 (YYYY-MM-DD HH:MM:SS)，必填
+        - end_time: 结束时间 (YYYY-MM-DD HH:MM:SS)，默认为当前时间
+        - fields: 逗号分隔的字段名，必填
+        - stat: 时间桶内的统计量 avg/min/max/first/last/count/sum/delta，默认 avg
+        - max_points: 最多返回的点数，超过时降采样
+        - method: 降采样方法 lttb（默认）/ minmax
+        - order: asc（默认）/ desc
+        - format: 为 columnar 时返回 {timestamps: [毫秒时间戳], fields: {字段: [...]}}
+        """
+        try:
+            start_time = datetime.strptime(request.query_params['start_time'], '%Y-%m-%d %H:%M:%S')
+            end_param = request.query_params.get('end_time')
+            end_time = datetime.strptime(end_param, '%Y-%m-%d %H:%M:%S') if end_param else datetime.now()
+            if 'fields' not in request.query_params:
+                raise ValueError('fields为必填参数')
+            fields = self._columnar_fields(request)
+            max_points = request.query_params.get('max_points')
+            rows = get_timeseries(
+                start_time, end_time, fields,
+                order='desc' if request.query_params.get('order') == 'desc' else 'asc',
+                stat=request.query_params.get('stat', 'avg'),
+                max_points=int(max_points) if max_points else None,
+                downsample_method=request.query_params.get('method', 'lttb'),
+            )
+        except KeyError:
+            return Response({
+                "code": 1,
+                "message": "start_time为必填参数",
+                "data": None
+            }, status=status.HTTP_200_OK)
+        except ValueError as e:
+            return Response({
+                "code": 1,
+                "message": f"参数错误: {str(e)}",
+                "data": None
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({
+                "code": 1,
+                "message": f"获取时序数据失败: {str(e)}",
+                "data": None
+            }, status=status.HTTP_200_OK)
+
+        if self._is_columnar(request):
+            data = build_columns(rows, fields)
+        else:
+            for row in rows:
+                row['timestamp'] = row['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+            data = {'count': len(rows), 'results': rows}
+        return Response({
+            "code": 0,
+            "message": "获取时序数据成功",
+            "data": data
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def percentiles(self, request):
+        """
+        计算时间区间内的分位数（合并汇总桶中的分位数草图，不扫描整个区间的原始数据）
+        
+        查询参数:
+        - start_time: 开始时间 (YYYY-MM-DD HH:MM:SS)，必填
+        - end_time: 结束时间 (YYYY-MM-DD HH:MM:SS)，默认为当前时间
+        - fields: 逗号分隔的字段名，默认为 ROLLUP_SKETCH_FIELDS 中的全部字段
+        - p: 逗号分隔的分位数 (0-100)，默认 5,50,95
+        """
+        try:
+            start_time = datetime.strptime(request.query_params['start_time'], '%Y-%m-%d %H:%M:%S')
+            end_param = request.query_params.get('end_time')
+            end_time = datetime.strptime(end_param, '%Y-%m-%d %H:%M:%S') if end_param else datetime.now()
+        except (KeyError, ValueError):
+            return Response({
+                "code": 1,
+                "message": "start_time为必填参数，时间格式为YYYY-MM-DD HH:MM:SS",
+                "data": None
+            }, status=status.HTTP_200_OK)
+
+        try:
+            fields_param = request.query_params.get('fields')
+            fields = [f.strip() for f in fields_param.split(',') if f.strip()] if fields_param else rollups.sketch_fields()
+            p_param = request.query_params.get('p', '5,50,95')
+            percentiles = [float(p) for p in p_param.split(',') if p.strip()]
+            if not percentiles or any(not 0 <= p <= 100 for p in percentiles):
+                raise ValueError('p 必须是 0-100 之间的数字')
+            if start_time >= end_time:
+                raise ValueError('开始时间必须早于结束时间')
+            data = get_percentiles(start_time, end_time, fields, percentiles)
+        except ValueError as e:
+            return Response({
+                "code": 1,
+                "message": str(e),
+                "data": None
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({
+                "code": 1,
+                "message": f"计算分位数失败: {str(e)}",
+                "data": None
+            }, status=status.HTTP_200_OK)
+
+        return Response({
+            "code": 0,
+            "message": "计算分位数成功",
+            "data": data
+        }, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'])
     def download(self, request):
         """
-        下载传感器数据为CSV文件
+        下载传感器数据为CSV文件（流式输出）
         
         查询参数:
         - start_time: 开始时间 (YYYY-MM-DD HH:MM:SS)
         - end_time: 结束时间 (YYYY-MM-DD HH:MM:SS)
+        - columns: 逗号分隔的导出列（字段名，另支持 id、timestamp、U_FLOW_SUM），默认为原有的21列
+        - compress: 为 gzip 时输出 .csv.gz
+        - file_format: csv（默认）/ parquet / arrow（Arrow IPC stream），后两者需要 pyarrow，
+          默认导出 id、timestamp 与全部字段，列名为字段名
         """
         try:
-            import csv
-            from django.http import HttpResponse
+            from django.http import StreamingHttpResponse
             
             # 构建查询条件
-            query_params = {}
+            time_cond = {}
             
             # 时间范围筛选
             if 'start_time' in request.query_params:
                 try:
-                    start_time = datetime.strptime(request.query_params['start_time'], '%Y-%m-%d %H:%M:%S')
-                    query_params['timestamp__gte'] = start_time
+                    time_cond['$gte'] = datetime.strptime(request.query_params['start_time'], '%Y-%m-%d %H:%M:%S')
                 except ValueError:
                     return Response({
                         "code": 1,
@@ -915,62 +1187,51 @@ class SensorDataViewSet(viewsets.ViewSet):
                     
             if 'end_time' in request.query_params:
                 try:
-                    end_time = datetime.strptime(request.query_params['end_time'], '%Y-%m-%d %H:%M:%S')
-                    query_params['timestamp__lte'] = end_time
+                    time_cond['$lte'] = datetime.strptime(request.query_params['end_time'], '%Y-%m-%d %H:%M:%S')
                 except ValueError:
                     return Response({
                         "code": 1,
                         "message": "无效的结束时间格式，请使用YYYY-MM-DD HH:MM:SS",
                         "data": None
                     }, status=status.HTTP_200_OK)
+
+            file_format = request.query_params.get('file_format', 'csv').lower()
+            if file_format != 'csv' and file_format not in exporter.ARROW_FORMATS:
+                return Response({
+                    "code": 1,
+                    "message": "file_format 只支持 csv / parquet / arrow",
+                    "data": None
+                }, status=status.HTTP_200_OK)
+            if file_format != 'csv' and exporter.pa is None:
+                return Response({
+                    "code": 1,
+                    "message": "服务器未安装 pyarrow，无法导出 Parquet/Arrow",
+                    "data": None
+                }, status=status.HTTP_200_OK)
+
+            try:
+                default_columns = None if file_format == 'csv' else exporter.arrow_default_columns()
+                columns = exporter.parse_columns(request.query_params.get('columns'), default_columns)
+            except ValueError as e:
+                return Response({
+                    "code": 1,
+                    "message": str(e),
+                    "data": {"available_columns": exporter.available_columns()}
+                }, status=status.HTTP_200_OK)
+            gzip = request.query_params.get('compress', '').lower() == 'gzip'
             
-            # 执行查询
-            queryset = SensorData.objects(**query_params).order_by('-timestamp')
-            
-            # 创建HTTP响应，设置为CSV文件下载
-            response = HttpResponse(content_type='text/csv')
+            match = {'timestamp': time_cond} if time_cond else {}
             filename = f'sensor_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+            if file_format != 'csv':
+                content_type, extension = exporter.ARROW_FORMATS[file_format]
+                response = StreamingHttpResponse(exporter.iter_arrow(match, columns, file_format), content_type=content_type)
+                filename = filename[:-len('csv')] + extension
+            elif gzip:
+                response = StreamingHttpResponse(exporter.iter_csv(match, columns, gzip=True), content_type='application/gzip')
+                filename += '.gz'
+            else:
+                response = StreamingHttpResponse(exporter.iter_csv(match, columns), content_type='text/csv; charset=utf-8')
             response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            
-            # 添加BOM以支持Excel正确显示中文
-            response.write('\ufeff')
-            
-            # 创建CSV写入器
-            writer = csv.writer(response)
-            
-            # 写入标题行
-            headers = [
-                'ID', '时间戳', 
-                '#1机负荷(MW)', '#2机负荷(MW)', '#3机负荷(MW)', '#4机负荷(MW)',
-                '#1机五抽压力(MPa)', '#2机五抽压力(MPa)', '#3机五抽一路压力(MPa)', 
-                '#3机五抽二路压力(MPa)', '#4机五抽一路压力(MPa)', '#4机五抽二路压力(MPa)',
-                '汉沽实时热量(GJ/H)', '生态城实时热量(GJ/H)', '宁河实时热量(GJ/H)', '盐场实时流量(T/H)',
-                '汉沽累计热量(GJ)', '生态城累计热量(GJ)', '宁河累计热量(GJ)', '盐场累计供汽量(GJ)',
-                '海淡抽汽流量总和(T/H)'
-            ]
-            writer.writerow(headers)
-            
-            # 写入数据行
-            for item in queryset:
-                # 计算海淡抽汽流量总和
-                haidian_total = (
-                    (item.U1_FLOW or 0) + (item.U2_FLOW or 0) + (item.U3_FLOW or 0) + (item.U4_FLOW or 0) +
-                    (item.U5_FLOW or 0) + (item.U6_FLOW or 0) + (item.U7_FLOW or 0) + (item.U8_FLOW or 0)
-                )
-                
-                row = [
-                    str(item.id),
-                    item.timestamp.strftime('%Y-%m-%d %H:%M:%S') if item.timestamp else '',
-                    item.LDC_1 or '', item.LDC_2 or '', item.LDC_3 or '', item.LDC_4 or '',
-                    item.S5_01 or '', item.S5_02 or '', item.S5_0301 or '', 
-                    item.S5_0302 or '', item.S5_0401 or '', item.S5_0402 or '',
-                    item.HEATNOW_HG or '', item.HEATNOW_STC or '', item.HEATNOW_NH or '', item.STEAMNOW_YC or '',
-                    item.HEATSUP_TOTAL_HG or '', item.HEATSUP_TOTAL_STC or '', 
-                    item.HEATSUP_TOTAL_NH or '', item.STEAMSUP_TOTAL_YC or '',
-                    round(haidian_total, 2) if haidian_total > 0 else ''
-                ]
-                writer.writerow(row)
-            
             return response
             
         except Exception as e:
@@ -989,10 +1250,7 @@ class SensorDataViewSet(viewsets.ViewSet):
         try:
             # 检查是否为文件上传
             if 'file' in request.FILES:
-                # 处理CSV文件上传
-                import csv
-                import io
-                
+                # 处理CSV文件上传：流式解析、按批写入
                 uploaded_file = request.FILES['file']
                 if not uploaded_file.name.endswith('.csv'):
                     return Response({
@@ -1001,67 +1259,35 @@ class SensorDataViewSet(viewsets.ViewSet):
                         "data": None
                     }, status=status.HTTP_200_OK)
                 
-                # 读取CSV文件内容
                 try:
-                    decoded_file = uploaded_file.read().decode('utf-8-sig')  # 支持BOM
-                    csv_data = csv.DictReader(io.StringIO(decoded_file))
-                    
-                    created_count = 0
-                    error_count = 0
-                    
-                    for row in csv_data:
-                        try:
-                            # 构建数据字典，处理空值
-                            data = {}
-                            for key, value in row.items():
-                                if value and value.strip():
-                                    # 将中文字段名映射到英文字段名
-                                    field_mapping = {
-                                        '时间戳': 'timestamp',
-                                        '#1机负荷(MW)': 'LDC_1',
-                                        '#2机负荷(MW)': 'LDC_2',
-                                        '#3机负荷(MW)': 'LDC_3',
-                                        '#4机负荷(MW)': 'LDC_4',
-                                        '汉沽实时热量(GJ/H)': 'HEATNOW_HG',
-                                        '生态城实时热量(GJ/H)': 'HEATNOW_STC',
-                                        '宁河实时热量(GJ/H)': 'HEATNOW_NH',
-                                        '盐场实时流量(T/H)': 'STEAMNOW_YC',
-                                    }
-                                    
-                                    field_name = field_mapping.get(key, key)
-                                    
-                                    if field_name == 'timestamp':
-                                        # 处理时间戳
-                                        data[field_name] = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
-                                    elif field_name in ['LDC_1', 'LDC_2', 'LDC_3', 'LDC_4', 
-                                                        'HEATNOW_HG', 'HEATNOW_STC', 'HEATNOW_NH', 'STEAMNOW_YC']:
-                                        # 处理数值字段
-                                        data[field_name] = float(value)
-                            
-                            if data:  # 只有当有数据时才创建
-                                serializer = SensorDataSerializer(data=data)
-                                if serializer.is_valid():
-                                    serializer.save()
-                                    created_count += 1
-                                else:
-                                    error_count += 1
-                                    print(f"数据验证失败: {serializer.errors}")
-                        except Exception as e:
-                            error_count += 1
-                            print(f"处理行数据失败: {str(e)}")
-                    
+                    batch_size = int(request.query_params.get('batch_size') or 0) or None
+                except ValueError:
                     return Response({
-                        "code": 0,
-                        "message": f"文件上传完成，成功创建 {created_count} 条数据，失败 {error_count} 条",
-                        "data": {"created": created_count, "errors": error_count}
+                        "code": 1,
+                        "message": "batch_size参数必须是整数",
+                        "data": None
                     }, status=status.HTTP_200_OK)
-                    
-                except Exception as e:
+
+                try:
+                    # 超过 IMPORT_MAX_BATCH_SIZE 的取值在 import_csv 中被截断
+                    result = import_csv(uploaded_file.file, batch_size=batch_size)
+                except ValueError as e:
+                    latest_cache.invalidate()  # 出错前的批次可能已写入
                     return Response({
                         "code": 1,
                         "message": f"文件解析失败: {str(e)}",
                         "data": None
                     }, status=status.HTTP_200_OK)
+                latest_cache.invalidate()
+
+                return Response({
+                    "code": 0,
+                    "message": (
+                        f"文件上传完成，成功创建 {result['created']} 条数据，失败 {result['errors']} 条，"
+                        f"{result['rows_per_sec']} 行/秒"
+                    ),
+                    "data": result
+                }, status=status.HTTP_200_OK)
             
             # 处理JSON数据上传
             elif isinstance(request.data, dict) and 'generate_test_data' in request.data:
@@ -1109,6 +1335,7 @@ class SensorDataViewSet(viewsets.ViewSet):
                 
                 # 批量创建
                 SensorData.objects.insert(test_data)
+                latest_cache.invalidate()
                 
                 return Response({
                     "code": 0,
@@ -0,0 +1,162 @@
+"""
+传感器实时数据 WebSocket（原生 ASGI，路由见 dpb2/asgi.py，路径 /ws/sensor-data/）。
+
+客户端消息（JSON）：
+    {"action": "subscribe", "fields": ["LDC_1"], "categories": ["负荷", "供水温度"], "interval": 2}
+    {"action": "ping"}
+fields 与 categories 取并集；都为空表示全部字段。interval 为最短推送间隔（秒），
+不小于 settings.WS_MIN_INTERVAL_S。重复 subscribe 会替换之前的订阅。
+
+服务端消息：
+    {"type": "snapshot", "timestamp": "...", "values": {...}}   订阅后立即发送，包含全部订阅字段
+    {"type": "update", "timestamp": "...", "values": {...}}     只包含变化过的订阅字段
+    {"type": "pong"} / {"type": "error", "message": "..."}
+
+数据来自 live.LiveHub（与 SSE 共用一个跟踪线程）。推送线程只把变化合并进每个连接的待发送字典
+（同一字段只保留最新值），发送协程按连接的 interval 节流后一次发出，客户端再慢也不会产生无界队列。
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from django.conf import settings
+
+from .live import LiveEvent, get_hub
+from .models import SENSOR_FIELD_CATEGORIES, SENSOR_FIELDS
+
+logger = logging.getLogger(__name__)
+
+WS_PATH = '/ws/sensor-data/'
+
+
+def resolve_fields(fields: Optional[List[str]], categories: Optional[List[str]]) -> List[str]:
+    """把字段名与分类名展开为字段列表（保持模型声明顺序），含未知名称时抛出 ValueError"""
+    selected: Set[str] = set()
+    for name in fields or []:
+        if name not in SENSOR_FIELDS:
+            raise ValueError(f'未知字段: {name}')
+        selected.add(name)
+    for name in categories or []:
+        if name not in SENSOR_FIELD_CATEGORIES:
+            raise ValueError(f'未知分类: {name}')
+        selected.update(SENSOR_FIELD_CATEGORIES[name])
+    if not selected:
+        return list(SENSOR_FIELDS)
+    return [f for f in SENSOR_FIELDS if f in selected]
+
+
+class SensorSubscription:
+    """单个连接的订阅状态：推送线程写入、发送协程读取"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+        self.fields: Set[str] = set()
+        self.interval = 1.0
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Any] = {}
+        self._timestamp: Optional[str] = None
+
+    def configure(self, fields: List[str], interval: float):
+        with self._lock:
+            self.fields = set(fields)
+            self.interval = interval
+            self._pending = {}
+            self._timestamp = None
+
+    def on_event(self, event: LiveEvent):
+        """推送线程回调：合并变化后唤醒发送协程"""
+        with self._lock:
+            if not self.fields:
+                return
+            changed = {k: v for k, v in event.data.items() if k in self.fields}
+            if event.name == 'delta' and not changed:
+                return
+            self._pending.update(changed)
+            self._timestamp = event.data['timestamp']
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def take(self):
+        with self._lock:
+            values, self._pending = self._pending, {}
+            return self._timestamp, values
+
+
+async def _send_json(send, message: Dict[str, Any]):
+    await send({'type': 'websocket.send', 'text': json.dumps(message, ensure_ascii=False, separators=(',', ':'))})
+
+
+async def _sender(send, subscription: SensorSubscription):
+    last_sent = 0.0
+    while True:
+        await subscription.wakeup.wait()
+        # 节流：距上次发送不足 interval 时等待，期间到达的变化被合并
+        delay = last_sent + subscription.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        subscription.wakeup.clear()
+        timestamp, values = subscription.take()
+        if values:
+            await _send_json(send, {'type': 'update', 'timestamp': timestamp, 'values': values})
+            last_sent = time.monotonic()
+
+
+async def _subscribe(send, subscription: SensorSubscription, message: Dict[str, Any]):
+    try:
+        fields = resolve_fields(message.get('fields'), message.get('categories'))
+        min_interval = float(getattr(settings, 'WS_MIN_INTERVAL_S', 0.5))
+        interval = max(min_interval, float(message.get('interval') or 1.0))
+    except (TypeError, ValueError) as e:
+        await _send_json(send, {'type': 'error', 'message': str(e)})
+        return
+    subscription.configure(fields, interval)
+
+    snapshot = await subscription.loop.run_in_executor(None, get_hub().snapshot)
+    if snapshot is not None:
+        await _send_json(send, {
+            'type': 'snapshot',
+            'timestamp': snapshot.data['timestamp'],
+            'values': {f: snapshot.data.get(f) for f in fields},
+            'interval': interval,
+        })
+
+
+async def sensor_websocket(scope, receive, send):
+    """ASGI 应用：处理 /ws/sensor-data/ 连接"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+
+    loop = asyncio.get_running_loop()
+    subscription = SensorSubscription(loop)
+    hub = get_hub()
+    token = hub.subscribe(subscription.on_event)
+    sender = loop.create_task(_sender(send, subscription))
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message['type'] != 'websocket.receive':
+                continue
+            try:
+                payload = json.loads(message.get('text') or message.get('bytes') or '{}')
+            except ValueError:
+                await _send_json(send, {'type': 'error', 'message': '消息必须是JSON'})
+                continue
+            action = payload.get('action') if isinstance(payload, dict) else None
+            if action == 'subscribe':
+                await _subscribe(send, subscription, payload)
+            elif action == 'ping':
+                await _send_json(send, {'type': 'pong'})
+            else:
+                await _send_json(send, {'type': 'error', 'message': f'未知操作: {action}'})
+    except Exception:
+        logger.exception('WebSocket 连接异常')
+    finally:
+        hub.unsubscribe(token)
+        sender.cancel()
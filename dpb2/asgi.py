@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+
+HTTP 请求交给 Django，/ws/sensor-data/ 的 WebSocket 交给 dataservice.ws，lifespan 直接确认。
+注意 Django 3.2 的 ASGIHandler 在事件循环上迭代同步的 StreamingHttpResponse，SSE（stream、agent/ask/stream）
+与导出下载等待数据时会阻塞同一进程内的其它请求和 WebSocket；流式接口较多时建议按 README“生产部署”
+把 HTTP 放到 WSGI 线程工作进程，ASGI 服务只承担 WebSocket。
 """
 
 import os
@@ -13,4 +18,32 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dpb2.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# 必须在 Django 初始化之后导入
+from dataservice.ws import WS_PATH, sensor_websocket  # noqa: E402
+
+
+async def lifespan(receive, send):
+    """没有需要在启动/关闭时执行的任务，收到事件直接确认"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """HTTP 交给 Django；/ws/sensor-data/ 的 WebSocket 连接交给 dataservice.ws，其它 WebSocket 路径关闭"""
+    if scope['type'] == 'websocket':
+        if scope['path'] == WS_PATH:
+            await sensor_websocket(scope, receive, send)
+        else:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 4404})
+    elif scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    else:
+        await django_application(scope, receive, send)
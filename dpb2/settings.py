@@ -144,14 +144,71 @@ MONGODB_SETTINGS = {
     'connect': False,  # 懒连接
 }
 
+# 传感器数据存储布局：document（默认，每次采样一条文档）/ timeseries（sensor_data 为 MongoDB 时间序列集合）
+# / bucket（按分钟或小时分桶，字段值以数组存放）
+SENSOR_STORAGE_MODE = os.getenv('SENSOR_STORAGE_MODE', 'document')
+SENSOR_BUCKET_GRANULARITY = os.getenv('SENSOR_BUCKET_GRANULARITY', 'minute')  # minute / hour
+
+# 采集批量写入（fetch_data --continuous）
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '100'))  # 缓冲达到该条数即写入
+INGEST_FLUSH_INTERVAL_S = float(os.getenv('INGEST_FLUSH_INTERVAL_S', '10'))  # 最长刷新间隔（秒），不超过采样间隔，避免新数据延迟入库
+INGEST_WRITE_CONCERN = os.getenv('INGEST_WRITE_CONCERN', '')  # 空表示使用连接默认值，可设为 0/1/majority
+INGEST_MAX_RETRIES = int(os.getenv('INGEST_MAX_RETRIES', '3'))  # 网络类错误的重试次数
+INGEST_MAX_PENDING = int(os.getenv('INGEST_MAX_PENDING', '10000'))  # 缓冲积压超过该条数时转入本地 spool
+
+# 采集本地落盘（spool）：数据库不可用时写入本地段文件，恢复后后台回放；目录设为空字符串即关闭
+INGEST_SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR', str(BASE_DIR / 'spool'))
+INGEST_SPOOL_SEGMENT_MB = int(os.getenv('INGEST_SPOOL_SEGMENT_MB', '64'))  # 单个段文件大小上限
+INGEST_SPOOL_FSYNC_EVERY = int(os.getenv('INGEST_SPOOL_FSYNC_EVERY', '100'))  # 每写入多少条 fsync 一次
+INGEST_SPOOL_FSYNC_INTERVAL_S = float(os.getenv('INGEST_SPOOL_FSYNC_INTERVAL_S', '1'))  # 最长 fsync 间隔（秒）
+INGEST_SPOOL_REPLAY_INTERVAL_S = float(os.getenv('INGEST_SPOOL_REPLAY_INTERVAL_S', '5'))  # 回放检查间隔（秒）
+
+# 传感器数据列表游标分页 count=estimate 且带筛选时，限时计数的超时（毫秒），超时不返回总数
+LIST_COUNT_TIMEOUT_MS = int(os.getenv('LIST_COUNT_TIMEOUT_MS', '500'))
+
+# CSV 导入（/api/sensor-data/upload/）每批写入条数
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+IMPORT_MAX_BATCH_SIZE = int(os.getenv('IMPORT_MAX_BATCH_SIZE', '5000'))  # 上传接口 batch_size 参数的上限
+
+# CSV 导出（/api/sensor-data/download/）游标每批读取条数
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '2000'))
+EXPORT_ARROW_BATCH_ROWS = int(os.getenv('EXPORT_ARROW_BATCH_ROWS', '65536'))  # Parquet/Arrow 导出每个 row group / record batch 的行数
+EXPORT_ARROW_COMPRESSION = os.getenv('EXPORT_ARROW_COMPRESSION', 'zstd')  # Parquet 压缩算法，如 zstd/snappy/none；Arrow IPC 只支持 zstd/lz4，其余按不压缩
+
+# 缓存：默认进程内缓存；多进程部署时可改为 Redis 等共享缓存
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'dpb2'),
+    }
+}
+HOURLY_DATA_CACHE_MISS_TTL_S = 60  # hourly_data 当前小时尚无数据时的缓存秒数
+LATEST_CACHE_MAX_AGE_S = float(os.getenv('LATEST_CACHE_MAX_AGE_S', '5'))  # 最新数据缓存的最长陈旧时间（秒）
+
+# 增量汇总（rollup_sensor_data --follow）：分钟结束后等待多少秒再汇总，给采集写入留出延迟
+ROLLUP_SETTLE_S = int(os.getenv('ROLLUP_SETTLE_S', '30'))
+# 小时/日汇总中保存分位数草图的字段与相对精度（percentiles 接口使用）
+ROLLUP_SKETCH_FIELDS = [
+    'LDC_1', 'LDC_2', 'LDC_3', 'LDC_4',
+    'FEED_T_HG', 'FEED_T_STC', 'FEED_T_NH',
+    'BACK_T_HG', 'BACK_T_STC', 'BACK_T_NH',
+]
+ROLLUP_SKETCH_ACCURACY = 0.01
+
+# 实时推送（/api/sensor-data/stream/）
+LIVE_SOURCE = os.getenv('LIVE_SOURCE', 'auto')  # auto / change_stream（需副本集）/ poll
+LIVE_POLL_INTERVAL_S = float(os.getenv('LIVE_POLL_INTERVAL_S', '2'))  # 轮询间隔（秒）
+LIVE_KEEPALIVE_S = 15  # 无数据时的保活间隔（秒）
+WS_MIN_INTERVAL_S = float(os.getenv('WS_MIN_INTERVAL_S', '0.5'))  # WebSocket 订阅允许的最短推送间隔（秒）
+
 # REST Framework设置
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100,
+    # orjson 可用时使用 orjson 编码（见 dataservice/renderers.py）；可浏览 API 仅在 DEBUG 下启用
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
-    ],
+        'dataservice.renderers.FastJSONRenderer',
+    ] + (['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
 }
 
 # CORS设置
@@ -181,4 +238,17 @@ AGENT_MAX_DOCS = 5000      # 强制 limit 上限（考虑10秒采集频率）
 AGENT_TIMEOUT_S = 20       # 查询超时（增加到20秒）
 AGENT_MAX_TIME_RANGE_HOURS = 72  # 最大查询时间范围（3天）
 AGENT_DEFAULT_SAMPLE_INTERVAL = 60  # 默认采样间隔（秒）
-AGENT_ALLOWED_COLLECTIONS = ['sensor_data']  # 允许的集合列表
\ No newline at end of file
+AGENT_ALLOWED_COLLECTIONS = ['sensor_data']  # 允许的集合列表
+AGENT_COST_BUDGET = int(os.getenv('AGENT_COST_BUDGET', '100000'))  # 聚合执行前估算成本上限（扫描文档数×高成本阶段倍数）
+AGENT_COST_COUNT_TIMEOUT_MS = 1000  # 成本估算中 count 的超时（毫秒）
+AGENT_CACHE_TTL_S = int(os.getenv('AGENT_CACHE_TTL_S', '120'))  # run_aggregation 结果缓存秒数，0 表示关闭
+AGENT_CACHE_BUCKET_S = 60  # 缓存键中时间范围对齐的粒度（秒）
+AGENT_CACHE_MAX_ENTRIES = 256
+AGENT_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 缓存结果总大小上限（按 JSON 长度估算）
+
+# 大模型 HTTP 客户端（aiservice/llm_client.py）：连接池大小与 429/5xx 重试
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', '10'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_BACKOFF_BASE_S = 0.5  # 退避基数（秒），第 n 次重试在 [0, base*2^n] 内随机等待
+LLM_BACKOFF_MAX_S = 8
+AGENT_STREAM_KEEPALIVE_S = 15  # agent/ask/stream/ 无事件时的保活间隔（秒）